@@ -0,0 +1,159 @@
+# Store-and-forward backlog of the sensor's unsent
+# transmissions (runs on Python and Micropython).
+#
+# Transmissions are fixed size records (the binary wire
+# format), held in a RAM ring buffer. When the ring is full,
+# its older half is spilled to a flash file in one write, so
+# an outage of many hours costs little RAM and few flash
+# writes. The flash file starts with the offset of its first
+# unsent record, so a reboot or deep sleep resumes where the
+# last flush stopped.
+
+import os
+import struct
+
+HEADER_FORMAT = "!I" # Offset (in bytes) of the first unsent record.
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+class Backlog:
+    def __init__(self, record_size, size, spill_file=None, spill_size=0):
+        """
+            A FIFO of up to {size} records in RAM, plus up to
+            {spill_size} records in {spill_file} on flash
+            (None to disable the spill).
+        """
+        self.record_size = record_size
+        self.size = size
+        self.ring = bytearray(record_size * size)
+        self.head = 0 # Index of the oldest record in the ring.
+        self.count = 0 # Records in the ring.
+        self.spill_file = spill_file
+        self.spill_size = spill_size
+        self.spill_offset = HEADER_SIZE
+        self.spill_end = HEADER_SIZE
+        self.dropped = 0 # Records lost since boot.
+        if spill_file is not None:
+            self.open_spill()
+
+    def __len__(self):
+        return (self.spill_end - self.spill_offset) // self.record_size + self.count
+
+    ### Spill Functions:
+    def open_spill(self):
+        """
+            Resumes the records left in the spill file by an
+            earlier boot.
+        """
+        try:
+            self.spill_end = os.stat(self.spill_file)[6]
+            with open(self.spill_file, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            self.spill_offset = struct.unpack(HEADER_FORMAT, header)[0] if len(header) == HEADER_SIZE else 0
+        except OSError:
+            self.spill_offset = self.spill_end = HEADER_SIZE
+        end = self.spill_end - (self.spill_end - HEADER_SIZE) % self.record_size
+        if not HEADER_SIZE <= self.spill_offset < end or \
+            (self.spill_offset - HEADER_SIZE) % self.record_size:
+            # Nothing is left to send:
+            self.reset_spill()
+        elif end != self.spill_end:
+            # A torn last write left a partial record:
+            with open(self.spill_file, "rb") as f:
+                data = f.read(end)
+            with open(self.spill_file, "wb") as f:
+                f.write(data)
+            self.spill_end = end
+
+    def reset_spill(self):
+        """
+            Removes the spill file, once all of its records were
+            sent.
+        """
+        try:
+            os.remove(self.spill_file)
+        except OSError:
+            pass
+        self.spill_offset = self.spill_end = HEADER_SIZE
+
+    def spill(self, n):
+        """
+            Moves the {n} oldest records of the ring to the
+            spill file. Returns False if they did not fit.
+        """
+        if self.spill_file is None or \
+            (self.spill_end - self.spill_offset) // self.record_size + n > self.spill_size:
+            return False
+        try:
+            with open(self.spill_file, "ab") as f:
+                if self.spill_end == HEADER_SIZE:
+                    f.write(struct.pack(HEADER_FORMAT, HEADER_SIZE))
+                for i in range(n):
+                    f.write(self.record(i))
+        except OSError as e:
+            print(f"The backlog could not be spilled to flash.\nException: {e}")
+            return False
+        self.spill_end += n * self.record_size
+        self.head = (self.head + n) % self.size
+        self.count -= n
+        return True
+
+    def spill_all(self):
+        """
+            Moves the whole ring to the spill file, e.g. before
+            a deep sleep erases the RAM.
+        """
+        if self.count:
+            self.spill(self.count)
+
+    ### Queue Functions:
+    def record(self, i):
+        """
+            Returns the {i}th oldest record of the ring.
+        """
+        start = (self.head + i) % self.size * self.record_size
+        return bytes(self.ring[start:start + self.record_size])
+
+    def append(self, record):
+        """
+            Adds a record to the backlog. When both the ring and
+            the spill file are full, the oldest record of the ring
+            is dropped.
+        """
+        if self.count == self.size and not self.spill(max(self.size // 2, 1)):
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+            self.dropped += 1
+        start = (self.head + self.count) % self.size * self.record_size
+        self.ring[start:start + self.record_size] = record
+        self.count += 1
+
+    def peek(self, n):
+        """
+            Returns up to {n} of the oldest records, concatenated.
+        """
+        records = []
+        spilled = (self.spill_end - self.spill_offset) // self.record_size
+        if spilled:
+            with open(self.spill_file, "rb") as f:
+                f.seek(self.spill_offset)
+                records.append(f.read(min(n, spilled) * self.record_size))
+        for i in range(min(n - spilled, self.count)):
+            records.append(self.record(i))
+        return b"".join(records)
+
+    def drop(self, n):
+        """
+            Removes the {n} oldest records, once they were sent.
+        """
+        spilled = (self.spill_end - self.spill_offset) // self.record_size
+        if spilled:
+            self.spill_offset += min(n, spilled) * self.record_size
+            if self.spill_offset == self.spill_end:
+                self.reset_spill()
+            else:
+                with open(self.spill_file, "r+b") as f:
+                    f.write(struct.pack(HEADER_FORMAT, self.spill_offset))
+            n -= min(n, spilled)
+        n = min(n, self.count)
+        self.head = (self.head + n) % self.size
+        self.count -= n
@@ -0,0 +1,279 @@
+# Benchmarks of the HUJI-Lib server, in-process and over
+# loopback, at several transmission log sizes. Writes the
+# results as JSON and compares them against a stored baseline,
+# flagging every metric that got worse by more than the
+# threshold (and exiting with status 1).
+#
+# The baseline is the results of this script on the tree before
+# a change: run it with --save-baseline, make the change, and run
+# it again with --baseline. Both runs need this script, so it is
+# not possible to compare against commits from before it.
+#
+# Example: python benchmark.py --save-baseline              (before the change)
+#          python benchmark.py --baseline benchmark_baseline.json
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+from threading import Thread
+from time import perf_counter
+import protocol
+import server
+
+BASELINE = "benchmark_baseline.json"
+LOG_SIZES = [0, 10000, 100000] # Transmissions in the log.
+REGRESSION_THRESHOLD = 0.10 # Relative change that is flagged.
+REPEATS = 5
+REQUESTS = 2000 # Per loopback benchmark.
+CLIENTS = 4 # Concurrent loopback clients.
+MIXED_WRITES = 0.1 # Share of POSTs in the mixed workload.
+STATIC_ASSET = "/css/styles.css"
+SERVER_FILES = ["webpage.html", "css", "js", "assets"]
+
+class QuietHandler(server.hujilib_http):
+    def log_message(self, format, *args):
+        pass
+
+### Setup:
+def synthetic_transmissions(count: int, rng: random.Random) -> list:
+    """ Returns transmissions of random locations and times
+        within the opening hours."""
+    transmissions = []
+    for _ in range(count):
+        # 7/1/2024 was a Sunday:
+        ts = protocol.wall_clock(2024, 1, 7 + rng.randrange(5), rng.randrange(server.OPENING_HOUR, server.CLOSING_HOUR), rng.randrange(60))
+        entrances = rng.randrange(500)
+        transmissions.append(protocol.to_transmission({ "v": protocol.VERSION, "sn": 1,
+                                                        "location": rng.choice(server.LOCATION_LIST),
+                                                        "entrances": entrances, "exits": rng.randrange(entrances + 1), "ts": ts}))
+    return transmissions
+
+def setup_server_dir(source: str, backend: str, log_size: int, logger: logging.Logger) -> str:
+    """ Creates a server directory with fresh DBs and a log of
+        {log_size} transmissions that were recorded after the
+        last snapshot, makes it the working directory and loads
+        the server's state from it. Returns the directory."""
+    directory = tempfile.mkdtemp(prefix="hujilib-bench-")
+    for name in SERVER_FILES:
+        path = os.path.join(source, name)
+        (shutil.copytree if os.path.isdir(path) else shutil.copy)(path, os.path.join(directory, name))
+    os.chdir(directory)
+    server.create_dbs(logger)
+    server.ASSETS = server.AssetStore()
+    server.ASSETS.load(logger)
+    server.PAGE_CACHE = server.PageCache()
+    server.STORE = server.make_store(backend)
+    server.STORE.load(logger)
+    # A snapshot of the empty state, so the startup replays the log:
+    server.STORE.touch()
+    server.STORE.snapshot(logger)
+    transmissions = synthetic_transmissions(log_size, random.Random(log_size))
+    for i in range(0, log_size, 1000):
+        server.STORE.record_many(transmissions[i:i + 1000], logger)
+    return directory
+
+### Measurement:
+def timed(func, repeats: int) -> list:
+    """ Returns the run times of a function, in seconds."""
+    times = []
+    for _ in range(repeats):
+        started = perf_counter()
+        func()
+        times.append(perf_counter() - started)
+    return times
+
+def metric(value: float, unit: str, better: str) -> dict:
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+def bench_recovery(backend: str, logger: logging.Logger, repeats: int) -> dict:
+    """ The time to load the state at startup, replaying the log
+        since the last snapshot."""
+    def load():
+        store = server.make_store(backend)
+        store.load(logger)
+        # A snapshot would leave the next repeats nothing to replay:
+        store.close(logger, snapshot=False)
+    return metric(1000 * statistics.median(timed(load, repeats)), "ms", "lower")
+
+def bench_ingest(count: int, batch: int) -> dict:
+    """ Transmissions recorded per second through route_POST, one
+        per request or in batches."""
+    rng = random.Random(count)
+    ts = protocol.wall_clock(2024, 1, 9, 11, 0)
+    bodies = [b"".join(protocol.encode_binary(2, rng.choice(server.LOCATION_LIST), rng.randrange(100), 0, ts) for _ in range(batch))
+              for _ in range(count // batch)]
+    path = "/batch" if batch > 1 else "/"
+    headers = {'Content-Type': protocol.BINARY_TYPE}
+    started = perf_counter()
+    for body in bodies:
+        status = server.route_POST(path, headers, body)[0]
+        assert status == 200, status
+    return metric(len(bodies) * batch / (perf_counter() - started), "transmissions/s", "higher")
+
+def bench_render(repeats: int) -> dict:
+    """ The time to render the homepage with file_to_string_html."""
+    times = timed(lambda: server.file_to_string_html(server.HOMEPAGE_FILENAME, server.HEBREW_ENCODING, server.STORE), repeats)
+    return metric(1000 * statistics.median(times), "ms", "lower")
+
+def run_clients(port: int, requests: int, make_request) -> tuple:
+    """ Sends {requests} requests from {CLIENTS} keep-alive
+        clients, and returns (requests per second, latencies in
+        seconds). make_request(rng) returns a (method, path,
+        body, headers) tuple."""
+    latencies = [[] for _ in range(CLIENTS)]
+    def client(i: int) -> None:
+        rng = random.Random(i)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        for _ in range(requests // CLIENTS):
+            method, path, body, headers = make_request(rng)
+            started = perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            reply = conn.getresponse()
+            reply.read()
+            latencies[i].append(perf_counter() - started)
+            if reply.status >= 400:
+                raise RuntimeError(f"{method} {path} returned {reply.status}.")
+        conn.close()
+    threads = [Thread(target=client, args=(i,)) for i in range(CLIENTS)]
+    started = perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = perf_counter() - started
+    latencies = sorted(sum(latencies, []))
+    return len(latencies) / elapsed, latencies
+
+def bench_loopback(port: int, name: str, requests: int, make_request) -> dict:
+    """ Returns the throughput and latency metrics of a loopback
+        workload."""
+    rps, latencies = run_clients(port, requests, make_request)
+    return {f"{name}_rps": metric(rps, "requests/s", "higher"),
+            f"{name}_p50": metric(1000 * latencies[len(latencies) // 2], "ms", "lower"),
+            f"{name}_p99": metric(1000 * latencies[int(len(latencies) * 0.99)], "ms", "lower")}
+
+def post_request(rng: random.Random) -> tuple:
+    ts = protocol.wall_clock(2024, 1, 9, 11, rng.randrange(60))
+    body = protocol.encode_binary(3, rng.choice(server.LOCATION_LIST), rng.randrange(100), 0, ts)
+    return "POST", "/", body, {'Content-Type': protocol.BINARY_TYPE}
+
+def mixed_request(rng: random.Random) -> tuple:
+    if rng.random() < MIXED_WRITES:
+        return post_request(rng)
+    path = rng.choice(["/", "/api/state", "/api/stats", STATIC_ASSET])
+    return "GET", path, None, {'Accept-Encoding': 'gzip'}
+
+def run_benchmarks(args: argparse.Namespace, logger: logging.Logger) -> dict:
+    """ Runs every benchmark at every log size and returns the
+        metrics, named "log=<size>/<benchmark>"."""
+    source = os.path.dirname(os.path.abspath(__file__))
+    metrics = {}
+    for log_size in args.log_sizes:
+        print(f"Log of {log_size} transmissions:", file=sys.stderr)
+        directory = setup_server_dir(source, args.backend, log_size, logger)
+        results = {}
+        try:
+            results['recovery'] = bench_recovery(args.backend, logger, args.repeats)
+            results['render'] = bench_render(args.repeats)
+            results['ingest'] = bench_ingest(args.requests, 1)
+            results['ingest_batch'] = bench_ingest(args.requests * 8, 64)
+
+            httpd = server.make_server(args.mode, "127.0.0.1", 0, QuietHandler)
+            Thread(target=httpd.serve_forever, daemon=True).start()
+            port = httpd.server_address[1]
+            try:
+                results.update(bench_loopback(port, "ingest_loopback", args.requests, post_request))
+                results.update(bench_loopback(port, "page_loopback", args.requests,
+                                              lambda rng: ("GET", "/", None, {'Accept-Encoding': 'gzip'})))
+                results.update(bench_loopback(port, "static_loopback", args.requests,
+                                              lambda rng: ("GET", STATIC_ASSET, None, {'Accept-Encoding': 'gzip'})))
+                results.update(bench_loopback(port, "mixed_loopback", args.requests, mixed_request))
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+        finally:
+            server.STORE.close(logger)
+            os.chdir(source)
+            shutil.rmtree(directory, ignore_errors=True)
+        for name, value in results.items():
+            metrics[f"log={log_size}/{name}"] = value
+            print(f"  {name}: {value['value']} {value['unit']}", file=sys.stderr)
+    return metrics
+
+### Comparison:
+def compare(metrics: dict, baseline: dict, threshold: float) -> list:
+    """ Returns the (name, baseline value, value, change) of the
+        metrics that got worse than the baseline by more than the
+        threshold."""
+    regressions = []
+    for name, current in metrics.items():
+        base = baseline.get(name)
+        if base is None or base['value'] == 0:
+            continue
+        change = (current['value'] - base['value']) / base['value']
+        worse = -change if current['better'] == "higher" else change
+        if worse > threshold:
+            regressions.append((name, base['value'], current['value'], change))
+    return regressions
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the HUJI-Lib server.")
+    parser.add_argument('--backend', choices=["csv", "sqlite"], default=server.STORAGE_BACKEND)
+    parser.add_argument('--mode', choices=["single", "threaded", "pool"], default=server.CONCURRENCY_MODE)
+    parser.add_argument('--log-sizes', default=",".join(map(str, LOG_SIZES)), help="Comma separated.")
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--requests', type=int, default=REQUESTS, help="Per benchmark.")
+    parser.add_argument('--quick', action='store_true', help="A small run, for a smoke test.")
+    parser.add_argument('--output', help="Where to write the results as JSON.")
+    parser.add_argument('--baseline', help="Results to compare against.")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Write the results to {BASELINE}.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    args.log_sizes = [int(size) for size in args.log_sizes.split(',')]
+    if args.quick:
+        args.log_sizes, args.repeats, args.requests = [0, 1000], 2, 200
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    logger = logging.getLogger()
+    server.logger = logger
+
+    results = { 'meta': {   'date': datetime.now().isoformat(timespec='seconds'),
+                            'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'backend': args.backend,
+                            'mode': args.mode,
+                            'clients': CLIENTS,
+                            'requests': args.requests,
+                            'repeats': args.repeats},
+                'metrics': run_benchmarks(args, logger)}
+
+    output = BASELINE if args.save_baseline else args.output
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"The results were written to {output}.", file=sys.stderr)
+    else:
+        print(json.dumps(results, indent=4))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        for key in ['backend', 'mode', 'clients', 'requests']:
+            if baseline['meta'].get(key) != results['meta'][key]:
+                print(f"Warning: the baseline's {key} was {baseline['meta'].get(key)}, not {results['meta'][key]}.", file=sys.stderr)
+        regressions = compare(results['metrics'], baseline['metrics'], args.threshold)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before} -> {after} ({change:+.1%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.", file=sys.stderr)
@@ -0,0 +1,81 @@
+# Builds resized and recompressed variants (JPEG, WebP and
+# AVIF) of the images in the assets directory, for the
+# homepage's srcset. Variants are named by the hash of their
+# source, so only new or changed images are rebuilt.
+# Requires Pillow (pip install Pillow).
+
+import hashlib
+import json
+import logging
+import os
+from os.path import exists, join, splitext
+from PIL import Image, ImageOps, features
+from static_assets import DERIVED_DIR, DERIVED_MANIFEST
+
+SOURCE_DIR = "assets"
+SOURCE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+WIDTHS = [320, 640, 1280] # In pixels
+FORMATS = [ ("JPEG", "image/jpeg", ".jpg", {"quality": 80, "optimize": True, "progressive": True}),
+            ("WEBP", "image/webp", ".webp", {"quality": 75, "method": 6}),
+            ("AVIF", "image/avif", ".avif", {"quality": 60}),
+        ]
+
+def file_digest(filename: str) -> str:
+    """ Returns a short SHA-256 digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def build_variants(source: str, logger: logging.Logger) -> list:
+    """ Recieves an image's path and writes its variants to the
+        derived assets directory, skipping variants that were
+        already built from the same source. Returns the
+        variants' manifest entries."""
+    digest = file_digest(source)
+    stem = splitext(os.path.basename(source))[0]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        # Never upscale, but always offer the source's own width:
+        widths = [w for w in WIDTHS if w < image.width] or [image.width]
+
+        variants = []
+        for image_format, content_type, extension, options in FORMATS:
+            if image_format != "JPEG" and not features.check(image_format.lower()):
+                logger.warning(f"Pillow has no {image_format} support, skipping it.")
+                continue
+            for width in widths:
+                path = f"{DERIVED_DIR}/{stem}-{digest}-{width}{extension}"
+                if not exists(path):
+                    height = round(image.height * width / image.width)
+                    image.resize((width, height), Image.LANCZOS).save(path, image_format, **options)
+                    logger.info(f"Built {path}.")
+                variants.append({"path": path, "width": width, "type": content_type})
+    return variants
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO,
+                        )
+    logger = logging.getLogger()
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+
+    # Build the variants of every source image:
+    manifest = {}
+    for name in sorted(os.listdir(SOURCE_DIR)):
+        source = join(SOURCE_DIR, name).replace(os.sep, '/')
+        if splitext(name)[1].lower() in SOURCE_EXTENSIONS:
+            manifest[source] = build_variants(source, logger)
+
+    # Remove variants of old versions of the sources:
+    current = {variant["path"] for variants in manifest.values() for variant in variants}
+    for name in os.listdir(DERIVED_DIR):
+        path = f"{DERIVED_DIR}/{name}"
+        if path not in current and path != DERIVED_MANIFEST:
+            os.remove(path)
+            logger.info(f"Removed {path}.")
+
+    with open(DERIVED_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    logger.info(f"The manifest was written to {DERIVED_MANIFEST}.")
@@ -0,0 +1,217 @@
+# Exports the transmission history to a typed, columnar format for
+# analytics, so it is not parsed from CSV text on every load: the
+# Location and Weekday dictionary encoded (small integer codes and
+# a dictionary of their values), and the Date and Time as an
+# integer epoch timestamp (of the local time, as in the SQLite DB).
+#
+# The export is written as Parquet if pyarrow is installed, and
+# otherwise as a raw file per column, which NumPy memory-maps. It
+# is incremental: every run appends only the whole days that were
+# logged since the last run, i.e. the rotated (and compressed)
+# segments of the transmission log, or the SQLite transmissions
+# logged before the first of today's. The active day is exported
+# by the first run after it has ended.
+#
+# Example: python export_history.py [csv|sqlite] [directory]
+#          columns = load_history("history_export")
+#          pd.DataFrame(columns['columns']) # Or pyarrow's to_pandas().
+
+import json
+import logging
+import os
+import sqlite3
+import numpy as np
+from datetime import datetime
+from os.path import exists, join
+from sys import argv
+from typing import Dict, Sequence
+from load_stats import codes
+from storage import SQLITE_DB, STORAGE_BACKEND, TRANSMISSION_FIELDS, TRANSMISSION_LOG_DB, log_columns, transmission_timestamp
+from transmission_log import TransmissionLog
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_DIR = "history_export"
+MANIFEST = "_manifest.json" # Skipped by Parquet readers, as it starts with "_".
+TEMP_PREFIX = "_" # Of the files being written, for the same reason.
+BATCH_ROWS = 100000 # SQLite transmissions read at a time.
+COLUMNS = { "sn": "<i4",
+            "location": "<u2",      # A code of the location dictionary.
+            "weekday": "<u1",       # A code of the weekday dictionary.
+            "timestamp": "<i8",     # In epoch seconds.
+            "entrances": "<i4",
+            "exits": "<i4",
+        }
+DICTIONARIES = {"location": "Location", "weekday": "Weekday"}
+
+### The manifest:
+def read_manifest(directory: str) -> Dict:
+    """ Returns the manifest of an export directory, or that of
+        a new, empty export."""
+    filename = join(directory, MANIFEST)
+    if exists(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    return {'format': "parquet" if pyarrow is not None else "numpy",
+            'columns': COLUMNS,
+            'dictionaries': {name: [] for name in DICTIONARIES},
+            'rows': 0,
+            'parts': 0,     # Parquet files.
+            'segment': 0,   # The last exported segment of the transmission log.
+            'last_id': 0}   # The last exported SQLite transmission.
+
+def write_manifest(directory: str, manifest: Dict) -> None:
+    """ Atomically writes the manifest, which commits the rows
+        appended before it."""
+    filename = join(directory, MANIFEST)
+    temp = join(directory, TEMP_PREFIX + MANIFEST + ".tmp")
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+def part_path(directory: str, number: int) -> str:
+    """ Returns the path of a Parquet file of the export."""
+    return join(directory, f"part-{number:06d}.parquet")
+
+### Encoding:
+def encode(columns: Dict[str, Sequence], manifest: Dict) -> Dict[str, np.ndarray]:
+    """ Recieves the columns of transmissions (of the log's
+        fields) and returns them as the export's typed columns,
+        adding new values to the manifest's dictionaries."""
+    encoded = {}
+    for name, field in DICTIONARIES.items():
+        dictionary = manifest['dictionaries'][name]
+        index = {value: i for i, value in enumerate(dictionary)}
+        for value in dict.fromkeys(columns[field]):
+            if value not in index:
+                index[value] = len(dictionary)
+                dictionary.append(value)
+        encoded[name] = codes(columns[field], index.__getitem__)
+    encoded['timestamp'] = codes(list(zip(columns['Date'], columns['Time'])),
+                                 lambda moment: transmission_timestamp({'Date': moment[0], 'Time': moment[1]}))
+    encoded['sn'] = np.asarray(columns['S.N.'], dtype=np.int64)
+    encoded['entrances'] = np.asarray(columns['Entrances'], dtype=np.int64)
+    encoded['exits'] = np.asarray(columns['Exits'], dtype=np.int64)
+    return {name: encoded[name].astype(dtype) for name, dtype in COLUMNS.items()}
+
+### Writing:
+def append(directory: str, manifest: Dict, encoded: Dict[str, np.ndarray]) -> None:
+    """ Appends encoded columns to the export. Rows appended
+        after the manifest (by a crashed run) are overwritten."""
+    rows = len(encoded['sn'])
+    if rows == 0:
+        return
+    if manifest['format'] == "parquet":
+        arrays = [pyarrow.DictionaryArray.from_arrays(encoded[name].astype(np.int32), manifest['dictionaries'][name])
+                  if name in DICTIONARIES else pyarrow.array(encoded[name])
+                  for name in COLUMNS]
+        filename = part_path(directory, manifest['parts'])
+        temp = join(directory, TEMP_PREFIX + os.path.basename(filename) + ".tmp")
+        pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names=list(COLUMNS)), temp)
+        os.replace(temp, filename)
+        manifest['parts'] += 1
+    else:
+        for name, dtype in COLUMNS.items():
+            filename = join(directory, f"{name}.bin")
+            with open(filename, 'ab') as f:
+                f.truncate(manifest['rows'] * np.dtype(dtype).itemsize)
+                f.write(encoded[name].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+    manifest['rows'] += rows
+
+def export_log(directory: str, manifest: Dict, log_db: str, logger: logging.Logger) -> int:
+    """ Appends the transmission log's segments that were
+        rotated and compressed since the last export, a segment
+        at a time. Returns how many rows were appended."""
+    log = TransmissionLog(log_db, TRANSMISSION_FIELDS)
+    appended = 0
+    for number, path in log.segments():
+        if number <= manifest['segment']:
+            continue
+        if not path.endswith(".gz"): # Still being compressed.
+            break
+        columns = log_columns([row for _, _, _, rows in log.blocks(path) for row in rows])
+        append(directory, manifest, encode(columns, manifest))
+        manifest['segment'] = number
+        write_manifest(directory, manifest)
+        appended += len(columns['S.N.'])
+        logger.info(f"{path} was exported.")
+    return appended
+
+def export_sqlite(directory: str, manifest: Dict, filename: str, logger: logging.Logger) -> int:
+    """ Appends the SQLite DB's transmissions that were logged
+        since the last export and before the first of today's.
+        Returns how many rows were appended."""
+    conn = sqlite3.connect(filename)
+    midnight = int(datetime.combine(datetime.now().date(), datetime.min.time()).timestamp())
+    end = conn.execute("SELECT MIN(id) FROM transmissions WHERE timestamp >= ?", (midnight,)).fetchone()[0]
+    if end is None:
+        end = (conn.execute("SELECT MAX(id) FROM transmissions").fetchone()[0] or 0) + 1
+    cursor = conn.execute(  "SELECT id, sn, location, weekday, date, time, entrances, exits FROM transmissions "
+                            "WHERE id > ? AND id < ? ORDER BY id", (manifest['last_id'], end))
+    appended = 0
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        append(directory, manifest, encode(log_columns(row[1:] for row in rows), manifest))
+        manifest['last_id'] = rows[-1][0]
+        write_manifest(directory, manifest)
+        appended += len(rows)
+    conn.close()
+    return appended
+
+### Reading:
+def load_history(directory: str=EXPORT_DIR) -> Dict:
+    """ Returns the exported history as {'columns': {name:
+        array}, 'dictionaries': {name: values}}, with the
+        columns memory-mapped rather than read. A Parquet export
+        is returned as a pyarrow Table instead, its Location and
+        Weekday as dictionary arrays. Only the rows that the
+        manifest has committed are returned."""
+    manifest = read_manifest(directory)
+    if manifest['format'] == "parquet":
+        if pyarrow is None:
+            raise ImportError(f"{directory} was exported as Parquet, which requires pyarrow.")
+        if manifest['parts'] == 0:
+            return pyarrow.table({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()})
+        return pyarrow.concat_tables([pyarrow.parquet.read_table(part_path(directory, number), memory_map=True)
+                                      for number in range(manifest['parts'])])
+    columns = {}
+    for name, dtype in manifest['columns'].items():
+        if manifest['rows'] == 0: # An empty file cannot be mapped.
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(join(directory, f"{name}.bin"), dtype=dtype, mode='r', shape=(manifest['rows'],))
+    return {'columns': columns, 'dictionaries': manifest['dictionaries']}
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO,
+                        )
+    logger = logging.getLogger()
+
+    # The storage backend and the export directory can be given
+    # as the first and second arguments:
+    backend = argv[1] if len(argv) > 1 else STORAGE_BACKEND
+    directory = argv[2] if len(argv) > 2 else EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    if manifest['format'] == "parquet" and pyarrow is None:
+        raise SystemExit(f"{directory} was exported as Parquet, which requires pyarrow.")
+
+    if backend == "csv":
+        appended = export_log(directory, manifest, TRANSMISSION_LOG_DB, logger)
+    elif backend == "sqlite":
+        appended = export_sqlite(directory, manifest, SQLITE_DB, logger)
+    else:
+        raise SystemExit(f"Unknown storage backend {backend}.")
+    write_manifest(directory, manifest)
+    logger.info(f"{appended} transmissions were exported to {directory} ({manifest['format']}), {manifest['rows']} in total.")
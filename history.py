@@ -0,0 +1,239 @@
+# Time range queries over the transmission history: the occupancy
+# (amount of people) of a location between two times, in buckets
+# of a given resolution, as each bucket's count of transmissions
+# and their average, min, max and last amounts.
+#
+# The transmission log is indexed sparsely, by block (see
+# transmission_log.py): the min and max clock of the block's
+# transmissions, and for every location in the block its hourly
+# and daily rollups (pre-aggregated buckets). A query skips the
+# blocks out of its range or without its location, and serves a
+# range of whole hours or days from the rollups alone, reading no
+# transmissions. Only finer queries decompress their blocks.
+#
+# A rotated segment's index is kept next to it, e.g.
+# transmission_log.000001.csv.idx.json. The segments are indexed
+# when the server starts and by the thread that rotates and
+# compresses them, not by queries. The active file's index is kept
+# in memory, and catches up with the appends on every query.
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+from load_stats import clock, datetime_clock
+from schedule import DAY_MINUTES
+from transmission_log import BLOCK_ROWS, TransmissionLog
+
+HOUR_MINUTES = 60
+ROLLUPS = {"daily": DAY_MINUTES, "hourly": HOUR_MINUTES} # Coarsest first.
+DEFAULT_RESOLUTION = HOUR_MINUTES # In minutes.
+MAX_BUCKETS = 10000 # Per query.
+QUERY_ATTEMPTS = 2 # A query is retried once if the log was rotated
+                   # or compressed under it.
+INDEX_SUFFIX = ".idx.json"
+
+### Aggregates:
+# An aggregate is [count, sum, min, max, last clock, last amount].
+def aggregate(minute: int, amount: int) -> List[int]:
+    return [1, amount, amount, amount, minute, amount]
+
+def merge(target: List[int], source: List[int]) -> None:
+    """ Adds the source aggregate's transmissions to the
+        target's."""
+    target[0] += source[0]
+    target[1] += source[1]
+    target[2] = min(target[2], source[2])
+    target[3] = max(target[3], source[3])
+    if source[4] >= target[4]:
+        target[4], target[5] = source[4], source[5]
+
+def add(buckets: Dict[int, List[int]], key: int, source: List[int]) -> None:
+    if key in buckets:
+        merge(buckets[key], source)
+    else:
+        buckets[key] = list(source)
+
+def aggregate_samples(samples: Iterable[Tuple[int, int]], begin: int, finish: int, resolution: int) -> Dict[int, List[int]]:
+    """ Returns the aggregates of the buckets of (clock, amount)
+        samples from begin (inclusive) to finish (exclusive)."""
+    buckets = {}
+    for minute, amount in samples:
+        if begin <= minute < finish:
+            add(buckets, begin + (minute - begin) // resolution * resolution, aggregate(minute, amount))
+    return buckets
+
+def format_time(minute: int) -> str:
+    """ Formats a clock as an ISO "yyyy-mm-ddTHH:MM" time."""
+    moment = datetime.fromordinal(minute // DAY_MINUTES) + timedelta(minutes=minute % DAY_MINUTES)
+    return moment.isoformat(timespec='minutes')
+
+def bucket_rows(buckets: Dict[int, List[int]]) -> List[Dict]:
+    """ Returns the buckets in time order, as the rows of a
+        query's result."""
+    return [{   'start': format_time(key),
+                'count': count,
+                'average': round(total / count, 2),
+                'min': low,
+                'max': high,
+                'last': last}
+            for key, (count, total, low, high, _, last) in sorted(buckets.items())]
+
+def query_range(start: datetime, end: datetime, resolution: int) -> Tuple[int, int]:
+    """ Returns the clocks of a query's range, or raises
+        ValueError if the query is invalid."""
+    begin, finish = datetime_clock(start), datetime_clock(end)
+    if resolution <= 0:
+        raise ValueError("The resolution must be a positive number of minutes.")
+    if finish <= begin:
+        raise ValueError("The range must end after it starts.")
+    if (finish - begin) // resolution > MAX_BUCKETS:
+        raise ValueError(f"The range has more than {MAX_BUCKETS} buckets of the resolution.")
+    return begin, finish
+
+class HistoryIndex:
+    """ The sparse time index of a transmission log, and the
+        queries it answers."""
+
+    def __init__(self, log: TransmissionLog) -> None:
+        self.log = log
+        self.lock = Lock()
+        self.segments = {}  # {number: (path, blocks)} of the rotated segments.
+        self.active = []    # The blocks of the active file.
+        self.active_number = None
+        self.columns = [log.fields.index(field) for field in ["Location", "Date", "Time", "Entrances", "Exits"]]
+
+    ### Indexing:
+    def index_block(self, offset: int, end: int, lines: int, rows: List[List[str]]) -> Dict:
+        """ Returns the index entry of a block: its offsets and
+            lines, the min and max clock of its transmissions and
+            the rollups of every location in it."""
+        block = {'offset': offset, 'end': end, 'lines': lines, 'min': None, 'max': None, 'locations': {}}
+        for row in rows:
+            location, date, time, entrances, exits = (row[i] for i in self.columns)
+            try:
+                minute, amount = clock(date, time), int(entrances) - int(exits)
+            except ValueError:
+                continue
+            if block['min'] is None or minute < block['min']:
+                block['min'] = minute
+            if block['max'] is None or minute > block['max']:
+                block['max'] = minute
+            rollups = block['locations'].get(location)
+            if rollups is None:
+                rollups = block['locations'][location] = {name: {} for name in ROLLUPS}
+            for name, size in ROLLUPS.items():
+                add(rollups[name], minute - minute % size, aggregate(minute, amount))
+        return block
+
+    def load_segment(self, path: str, logger: logging.Logger) -> List[Dict]:
+        """ Returns the index of a rotated segment, read from next
+            to it, or built (and written next to it, once it is
+            compressed)."""
+        filename = path[:-len(".gz")] + INDEX_SUFFIX if path.endswith(".gz") else None
+        if filename is not None:
+            try:
+                with open(filename, 'r') as f:
+                    blocks = json.load(f)
+                for block in blocks:
+                    for rollups in block['locations'].values():
+                        for name in ROLLUPS:
+                            rollups[name] = {int(key): value for key, value in rollups[name].items()}
+                return blocks
+            except (OSError, ValueError, KeyError):
+                pass
+        blocks = [self.index_block(*block) for block in self.log.blocks(path)]
+        if filename is not None:
+            try:
+                with open(filename + ".tmp", 'w') as f:
+                    json.dump(blocks, f, separators=(',', ':'))
+                os.replace(filename + ".tmp", filename)
+            except OSError:
+                logger.error(f"An I/O error has occurred when writing {filename}.")
+        return blocks
+
+    def refresh(self, logger: logging.Logger) -> None:
+        """ Indexes the segments that were rotated or compressed
+            since, and the appends to the active file."""
+        with self.lock:
+            for number, path in self.log.segments():
+                if self.segments.get(number, (None,))[0] != path: # New, or compressed since.
+                    self.segments[number] = (path, self.load_segment(path, logger))
+            number, end = self.log.position()
+            if number != self.active_number:
+                self.active, self.active_number = [], number
+            self.extend(end)
+
+    def catch_up(self) -> None:
+        """ Indexes the appends to the active file, unless it was
+            rotated since the last refresh."""
+        with self.lock:
+            number, end = self.log.position()
+            if number == self.active_number:
+                self.extend(end)
+
+    def extend(self, end: int) -> None:
+        """ Indexes the active file up to an offset. The last
+            block is indexed again if it was not full."""
+        if self.active and self.active[-1]['lines'] < BLOCK_ROWS:
+            self.active.pop()
+        offset = self.active[-1]['end'] if self.active else 0
+        self.active.extend(self.index_block(*block) for block in self.log.blocks(self.log.filename, offset, end))
+
+    ### Querying:
+    def query(self, location: str, start: datetime, end: datetime, resolution: int, logger: logging.Logger) -> List[Dict]:
+        """ Returns the occupancy of a location from start
+            (inclusive) to end (exclusive), in buckets of
+            {resolution} minutes (see bucket_rows()). Raises
+            ValueError if the query is invalid, and OSError if
+            the log cannot be read."""
+        begin, finish = query_range(start, end, resolution)
+        self.catch_up()
+        for attempt in range(QUERY_ATTEMPTS):
+            with self.lock:
+                sources = list(self.segments.values()) + [(self.log.filename, list(self.active))]
+                number = self.active_number
+            try:
+                buckets = self.scan(sources, location, begin, finish, resolution)
+            except OSError:
+                if attempt == QUERY_ATTEMPTS - 1:
+                    raise
+            else:
+                if self.log.position()[0] == number or attempt == QUERY_ATTEMPTS - 1:
+                    return bucket_rows(buckets)
+            # A segment was compressed, or the active file was
+            # rotated, since they were indexed:
+            self.refresh(logger)
+
+    def scan(self, sources: List[Tuple[str, List[Dict]]], location: str, begin: int, finish: int, resolution: int) -> Dict[int, List[int]]:
+        """ Returns the aggregates of a location's buckets from
+            the (path, blocks) of the indexed files."""
+        # The coarsest rollup whose periods fit in the buckets:
+        rollup = next((name for name, size in ROLLUPS.items()
+                       if resolution % size == 0 and begin % size == 0 and finish % size == 0), None)
+        buckets = {}
+        for path, blocks in sources:
+            for block in blocks:
+                if block['min'] is None or block['max'] < begin or block['min'] >= finish or location not in block['locations']:
+                    continue
+                if rollup is not None:
+                    for key, source in block['locations'][location][rollup].items():
+                        if begin <= key < finish:
+                            add(buckets, begin + (key - begin) // resolution * resolution, source)
+                    continue
+                rows = self.log.read_block(path, block['offset'], block['lines'])
+                samples = self.samples(row for row in rows if row[self.columns[0]] == location)
+                for key, source in aggregate_samples(samples, begin, finish, resolution).items():
+                    add(buckets, key, source)
+        return buckets
+
+    def samples(self, rows: Iterable[List[str]]) -> Iterable[Tuple[int, int]]:
+        """ Yields the (clock, amount) of the rows."""
+        _, date, time, entrances, exits = self.columns
+        for row in rows:
+            try:
+                yield clock(row[date], row[time]), int(row[entrances]) - int(row[exits])
+            except ValueError:
+                continue
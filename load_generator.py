@@ -0,0 +1,288 @@
+# Simulates many sensors posting to a HUJI-Lib server, for
+# capacity planning. Every simulated sensor counts people in
+# one of the rooms (entrances arrive as a Poisson process and
+# every person inside leaves after an exponential stay), and
+# transmits on a fixed schedule whether or not the server
+# keeps up, so latencies include the server's queueing.
+# Reports the achieved throughput and latency percentiles.
+#
+# Example: python load_generator.py --sensors 2000 --interval 10 --duration 60 --processes 4
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import socket
+from multiprocessing import Pipe, Process
+from time import localtime, perf_counter, time
+import protocol
+
+SERVER_ADDR = "127.0.0.1"
+PORT = 80
+SENSORS = 100
+TRANSMIT_INTERVAL = 60 # In seconds, per sensor.
+DURATION = 60 # In seconds
+ARRIVAL_RATE = 2.0 # Entrances per minute, per sensor.
+MEAN_STAY = 45.0 # In minutes
+REQUEST_TIMEOUT = 10 # In seconds
+FORMATS = ["binary", "json", "legacy"]
+PERCENTILES = [50, 90, 99, 99.9]
+
+class SimulatedSensor:
+    """ The entrance and exit counters of one simulated sensor."""
+
+    def __init__(self, sn: int, location: str, rng: random.Random, arrival_rate: float, mean_stay: float) -> None:
+        self.sn = sn
+        self.location = location
+        self.rng = rng
+        self.arrival_rate = arrival_rate / 60 # Per second
+        self.mean_stay = mean_stay * 60 # In seconds
+        self.entrances = 0
+        self.exits = 0
+
+    def advance(self, seconds: float) -> None:
+        """ Advances the counters by the given time."""
+        leave = 1 - math.exp(-seconds / self.mean_stay)
+        self.exits += binomial(self.rng, self.entrances - self.exits, leave)
+        self.entrances += poisson(self.rng, self.arrival_rate * seconds)
+
+    def reading(self, ts: int, payload: str) -> bytes:
+        """ Returns the sensor's current reading in a payload
+            format."""
+        if payload == "binary":
+            return protocol.encode_binary(self.sn, self.location, self.entrances, self.exits, ts)
+        if payload == "json":
+            return protocol.encode_json(self.sn, self.location, self.entrances, self.exits, ts)
+        return str(protocol.to_transmission({   "v": protocol.VERSION, "sn": self.sn, "location": self.location,
+                                                "entrances": self.entrances, "exits": self.exits, "ts": ts})).encode()
+
+class Connection:
+    """ An HTTP/1.1 client connection to the server, reopened
+        when the server closes it."""
+
+    def __init__(self, addr: str, port: int, keep_alive: bool) -> None:
+        self.addr = addr
+        self.port = port
+        self.keep_alive = keep_alive
+        self.reader = None
+        self.writer = None
+
+    async def post(self, path: str, content_type: str, body: bytes) -> int:
+        """ Sends a POST request and returns the reply's status.
+            Like the sensors, retries once on a new connection if
+            the server has closed a kept one before replying."""
+        reused = self.writer is not None
+        try:
+            return await self.exchange(path, content_type, body)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.close()
+            if not reused or getattr(e, 'partial', b'') != b'':
+                raise
+        return await self.exchange(path, content_type, body)
+
+    async def exchange(self, path: str, content_type: str, body: bytes) -> int:
+        """ Sends a POST request on the connection and returns
+            the reply's status."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.addr, self.port)
+        self.writer.write(( f"POST {path} HTTP/1.1\r\n"
+                            f"Host: {self.addr}\r\n"
+                            f"Content-Type: {content_type}\r\n"
+                            f"Content-Length: {len(body)}\r\n"
+                            f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n"
+                            "\r\n").encode() + body)
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        length, close = 0, not self.keep_alive
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                close = True
+        if length:
+            await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+### Random Processes:
+def poisson(rng: random.Random, mean: float) -> int:
+    """ Returns a Poisson distributed count."""
+    if mean > 30: # The normal approximation is close enough.
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    limit, k, p = math.exp(-mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+def binomial(rng: random.Random, n: int, p: float) -> int:
+    """ Returns a binomially distributed count."""
+    if n > 100:
+        return min(n, max(0, round(rng.gauss(n * p, math.sqrt(n * p * (1 - p))))))
+    return sum(rng.random() < p for _ in range(n))
+
+### Load Generation:
+async def run_sensor(sensor: SimulatedSensor, args: argparse.Namespace, addr: str, clock_offset: int, results: dict) -> None:
+    """ Transmits a simulated sensor's readings until the end of
+        the run, and records every request's outcome."""
+    loop = asyncio.get_running_loop()
+    connection = Connection(addr, args.port, args.keep_alive)
+    # Spread the sensors' transmissions over the interval:
+    next_at = loop.time() + sensor.rng.uniform(0, args.interval)
+    end = loop.time() + args.duration
+    pending = []
+    try:
+        while next_at < end:
+            await asyncio.sleep(max(0, next_at - loop.time()))
+            sensor.advance(args.interval)
+            t = localtime(int(time()) + clock_offset)
+            pending.append(sensor.reading(protocol.wall_clock(t[0], t[1], t[2], t[3], t[4], t[5]), args.payload))
+            next_at += args.interval
+            if len(pending) < args.batch:
+                continue
+
+            path, content_type, body = request_body(pending, args.payload)
+            started = perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.post(path, content_type, body), REQUEST_TIMEOUT)
+                key = str(status)
+                if status == 200:
+                    results['latencies'].append(perf_counter() - started)
+                    results['readings'] += len(pending)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, IndexError) as e:
+                key = type(e).__name__
+                connection.close()
+            results['outcomes'][key] = results['outcomes'].get(key, 0) + 1
+            pending = []
+    finally:
+        connection.close()
+
+def request_body(readings: list, payload: str) -> tuple:
+    """ Returns the (path, Content-Type, body) of a request that
+        carries the given readings."""
+    if len(readings) == 1:
+        content_type = { "binary": protocol.BINARY_TYPE,
+                         "json": protocol.JSON_TYPE,
+                         "legacy": "text/plain"}[payload]
+        return "/", content_type, readings[0]
+    if payload == "binary":
+        return "/batch", protocol.BINARY_TYPE, b"".join(readings)
+    return "/batch", protocol.NDJSON_TYPE, b"\n".join(readings)
+
+async def generate_load(args: argparse.Namespace, addr: str, sensor_ids: range) -> dict:
+    """ Runs the simulated sensors of the given serial numbers
+        and returns their results."""
+    results = {'latencies': [], 'readings': 0, 'outcomes': {}}
+    clock_offset = 0
+    if args.start is not None:
+        clock_offset = int(protocol.wall_clock(*args.start) - protocol.wall_clock(*localtime()[:6]))
+    sensors = [ SimulatedSensor(sn, protocol.LOCATION_IDS[sn % len(protocol.LOCATION_IDS)],
+                                random.Random(args.seed * 100003 + sn), args.arrival_rate, args.mean_stay)
+                for sn in sensor_ids]
+    await asyncio.gather(*(run_sensor(sensor, args, addr, clock_offset, results) for sensor in sensors))
+    return results
+
+def worker(args: argparse.Namespace, addr: str, sensor_ids: range, conn) -> None:
+    """ Runs a share of the sensors in a child process and sends
+        its results back through the pipe."""
+    conn.send(asyncio.run(generate_load(args, addr, sensor_ids)))
+    conn.close()
+
+def percentile(values: list, p: float) -> float:
+    """ Returns the p-th percentile of sorted values."""
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+def report(args: argparse.Namespace, results: dict, elapsed: float) -> dict:
+    """ Summarizes the merged results of a run."""
+    latencies = sorted(results['latencies'])
+    requests = sum(results['outcomes'].values())
+    return {'sensors': args.sensors,
+            'processes': args.processes,
+            'payload': args.payload,
+            'batch': args.batch,
+            'keep_alive': args.keep_alive,
+            'target_rps': round(args.sensors / args.interval / args.batch, 2),
+            'achieved_rps': round(requests / elapsed, 2),
+            'readings_per_second': round(results['readings'] / elapsed, 2),
+            'requests': requests,
+            'outcomes': results['outcomes'],
+            'latency_ms': {f"p{p:g}": round(1000 * percentile(latencies, p), 3) for p in PERCENTILES + [100]}}
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simulates HUJI-Lib sensors posting to a server.")
+    parser.add_argument('--addr', default=SERVER_ADDR)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--sensors', type=int, default=SENSORS, help="Simulated sensors, spread over all the rooms.")
+    parser.add_argument('--interval', type=float, default=TRANSMIT_INTERVAL, help="Seconds between a sensor's readings.")
+    parser.add_argument('--rate', type=float, help="Total readings per second, overrides --interval.")
+    parser.add_argument('--duration', type=float, default=DURATION, help="In seconds.")
+    parser.add_argument('--payload', choices=FORMATS, default="binary")
+    parser.add_argument('--batch', type=int, default=1, help="Readings per request, sent to /batch when above 1.")
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false', help="Open a connection per request.")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--arrival-rate', type=float, default=ARRIVAL_RATE, help="Entrances per minute, per sensor.")
+    parser.add_argument('--mean-stay', type=float, default=MEAN_STAY, help="In minutes.")
+    parser.add_argument('--start', help="Simulated wall clock start, YYYY-MM-DDTHH:MM (default: now).")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+    args = parser.parse_args()
+    if args.rate:
+        args.interval = args.sensors / args.rate
+    if args.sensors > protocol.MAX_SN:
+        parser.error(f"At most {protocol.MAX_SN} sensors can be simulated.")
+    if args.payload == "legacy" and args.batch > 1:
+        parser.error("Legacy payloads cannot be batched.")
+    if args.start is not None:
+        date, _, clock = args.start.partition('T')
+        args.start = tuple(int(x) for x in date.split('-') + (clock or "0:0").split(':')) + (0,)
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Resolve once here, asyncio would resolve every connection
+    # on a thread pool:
+    addr = socket.gethostbyname(args.addr)
+
+    started = perf_counter()
+    if args.processes == 1:
+        results = asyncio.run(generate_load(args, addr, range(1, args.sensors + 1)))
+    else:
+        workers = []
+        for i in range(args.processes):
+            parent, child = Pipe(duplex=False)
+            process = Process(target=worker, args=(args, addr, range(1 + i, args.sensors + 1, args.processes), child))
+            process.start()
+            workers.append((process, parent))
+        results = {'latencies': [], 'readings': 0, 'outcomes': {}}
+        for process, parent in workers:
+            part = parent.recv()
+            process.join()
+            results['latencies'] += part['latencies']
+            results['readings'] += part['readings']
+            for key, count in part['outcomes'].items():
+                results['outcomes'][key] = results['outcomes'].get(key, 0) + count
+    summary = report(args, results, perf_counter() - started)
+
+    if args.json:
+        print(json.dumps(summary, indent=4))
+    else:
+        print(f"{summary['sensors']} sensors ({summary['payload']}, batches of {summary['batch']}, "
+              f"keep-alive {'on' if summary['keep_alive'] else 'off'}, {summary['processes']} processes)")
+        print(f"Requests: {summary['requests']}, {summary['achieved_rps']}/s of {summary['target_rps']}/s targeted, "
+              f"{summary['readings_per_second']} readings/s")
+        print("Latency (ms): " + ", ".join(f"{name} {value}" for name, value in summary['latency_ms'].items()))
+        print("Outcomes: " + ", ".join(f"{key}: {count}" for key, count in sorted(summary['outcomes'].items())))
@@ -0,0 +1,223 @@
+# The server's load stats engine: the average load of every
+# (location, weekday, time slot), held as NumPy arrays of the
+# loads' sums and counts. A transmission adds to a single cell,
+# so an average is always the exact mean of its loads (no
+# rounded running means), and the stats can be recomputed from
+# the whole transmission log in one vectorized pass.
+#
+# Every cell also keeps an exponentially decayed average, where
+# a load weighs half as much for every {half life} that passed
+# since it was measured. It takes O(1) memory per cell: the
+# decayed sum and weight of the loads as of the cell's latest
+# load. Times are in minutes of the (naive) local clock.
+
+import numpy as np
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+from schedule import DAY_MINUTES
+DATE_FORMAT = "%d/%m/%Y" # The transmission log's Date.
+NEVER = 0 # The last update of a cell with no loads.
+
+def minutes(time: str) -> int:
+    """ Returns the minutes since midnight of an "HH:MM"
+        time."""
+    hour, minute = time.split(':')
+    return int(hour) * 60 + int(minute)
+
+@lru_cache(maxsize=64) # Transmissions come from a few dates.
+def day_minutes(date: str) -> int:
+    """ Returns the clock (in minutes) of a "dd/mm/yyyy" date's
+        midnight."""
+    return datetime.strptime(date, DATE_FORMAT).toordinal() * DAY_MINUTES
+
+def clock(date: str, time: str) -> int:
+    """ Returns the clock (in minutes) of a date and time."""
+    return day_minutes(date) + minutes(time)
+
+def datetime_clock(moment: datetime) -> int:
+    """ Returns the clock (in minutes) of a datetime."""
+    return moment.toordinal() * DAY_MINUTES + moment.hour * 60 + moment.minute
+
+def clock_now() -> int:
+    """ Returns the clock (in minutes) of the current time."""
+    return datetime_clock(datetime.now())
+
+def format_clock(minute: int) -> str:
+    """ Formats a clock as "dd/mm/yyyy H:MM", or "" if it is
+        NEVER."""
+    if minute == NEVER:
+        return ""
+    day = datetime.fromordinal(minute // DAY_MINUTES)
+    return f"{day.strftime(DATE_FORMAT)} {slot_time(minute % DAY_MINUTES)}"
+
+def parse_clock(text: str) -> int:
+    """ Parses a clock formatted by format_clock."""
+    if not text:
+        return NEVER
+    date, time = text.split(' ')
+    return clock(date, time)
+
+def slot_time(minute: int) -> str:
+    """ Formats the minutes since midnight as a load stats DB
+        "H:MM" time."""
+    return f"{minute // 60}:{minute % 60:02d}"
+
+def decay(decayed_sum: float, weight: float, last: int, load: float, minute: int, half_life: float) -> Tuple[float, float, int]:
+    """ Returns a cell's (decayed sum, decayed weight, last
+        update) after adding a load measured at the given
+        clock. A load older than the cell's last update is
+        added with its decayed weight instead."""
+    if minute >= last:
+        factor = 0.5 ** ((minute - last) / half_life)
+        return decayed_sum * factor + load, weight * factor + 1, minute
+    factor = 0.5 ** ((last - minute) / half_life)
+    return decayed_sum + load * factor, weight + factor, last
+
+class LoadStats:
+    """ The sums and counts, and decayed sums and weights, of
+        the loads (in percent) of every location, weekday and
+        time slot. Slots are given as (start minute, end minute)
+        and a transmission belongs to the slot of its time."""
+
+    def __init__(self, locations: List[str], weekdays: List[str], slots: List[Tuple[int, int]], half_life: float) -> None:
+        self.locations = list(locations)
+        self.weekdays = list(weekdays)
+        self.slots = list(slots)
+        self.half_life = half_life # In minutes.
+        self.location_index = {location: i for i, location in enumerate(self.locations)}
+        self.weekday_index = {weekday: i for i, weekday in enumerate(self.weekdays)}
+        # The slot of every minute of the day, -1 out of the slots:
+        self.minute_slot = np.full(DAY_MINUTES, -1, dtype=np.intp)
+        for i, (start, end) in enumerate(self.slots):
+            self.minute_slot[start:end] = i
+        self.shape = (len(self.locations), len(self.weekdays), len(self.slots))
+        self.clear()
+
+    def clear(self) -> None:
+        self.sums = np.zeros(self.shape)
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.decayed_sums = np.zeros(self.shape)
+        self.decayed_weights = np.zeros(self.shape)
+        self.last = np.full(self.shape, NEVER, dtype=np.int64)
+
+    ### Updating:
+    def cell(self, location: str, weekday: str, time: str) -> Tuple[int, int, int]:
+        """ Returns the index of the cell of a location, weekday
+            and "HH:MM" time, or None if it has none."""
+        i, j = self.location_index.get(location), self.weekday_index.get(weekday)
+        minute = minutes(time)
+        if i is None or j is None or not 0 <= minute < DAY_MINUTES or self.minute_slot[minute] < 0:
+            return None
+        return i, j, int(self.minute_slot[minute])
+
+    def add(self, location: str, weekday: str, date: str, time: str, load: float) -> bool:
+        """ Adds a load measured at a date and time to its
+            cell's averages. Returns False if it does not belong
+            to any cell."""
+        cell = self.cell(location, weekday, time)
+        if cell is None:
+            return False
+        self.sums[cell] += load
+        self.counts[cell] += 1
+        self.decayed_sums[cell], self.decayed_weights[cell], self.last[cell] = \
+            decay(self.decayed_sums[cell], self.decayed_weights[cell], int(self.last[cell]), load, clock(date, time), self.half_life)
+        return True
+
+    def recompute(self, columns: Dict[str, Sequence], max_amounts: Dict[str, int]) -> int:
+        """ Replaces the stats with those of the transmissions
+            in the given columns (of the transmission log's
+            fields), in one vectorized pass. A transmission's
+            load is relative to its location's max amount.
+            Returns how many transmissions did not belong to
+            any cell."""
+        i = codes(columns['Location'], lambda location: self.location_index.get(location, -1))
+        j = codes(columns['Weekday'], lambda weekday: self.weekday_index.get(weekday, -1))
+        time = codes(columns['Time'], minutes)
+        k = np.where((time >= 0) & (time < DAY_MINUTES), self.minute_slot[np.clip(time, 0, DAY_MINUTES - 1)], -1)
+        max_amount = codes(columns['Location'], lambda location: max_amounts.get(location, 0))
+        valid = (i >= 0) & (j >= 0) & (k >= 0) & (max_amount > 0)
+
+        amounts = np.asarray(columns['Entrances'], dtype=np.int64) - np.asarray(columns['Exits'], dtype=np.int64)
+        loads = amounts[valid] / max_amount[valid] * 100
+        cells = np.ravel_multi_index((i[valid], j[valid], k[valid]), self.shape)
+        size = self.sums.size
+        # bincount adds the loads in order, as add() would have:
+        self.sums = np.bincount(cells, weights=loads, minlength=size).astype(float).reshape(self.shape)
+        self.counts = np.bincount(cells, minlength=size).astype(np.int64).reshape(self.shape)
+
+        # Every load decays from its time to its cell's latest:
+        clocks = codes(columns['Date'], day_minutes)[valid] + time[valid]
+        last = np.full(size, NEVER, dtype=np.int64)
+        np.maximum.at(last, cells, clocks)
+        factors = 0.5 ** ((last[cells] - clocks) / self.half_life)
+        self.decayed_sums = np.bincount(cells, weights=loads * factors, minlength=size).astype(float).reshape(self.shape)
+        self.decayed_weights = np.bincount(cells, weights=factors, minlength=size).astype(float).reshape(self.shape)
+        self.last = last.reshape(self.shape)
+        return int(len(valid) - np.count_nonzero(valid))
+
+    ### Reading and writing rows:
+    def averages(self) -> np.ndarray:
+        """ Returns the average of every cell, 0 for cells with
+            no loads."""
+        return np.divide(self.sums, self.counts, out=np.zeros_like(self.sums), where=self.counts > 0)
+
+    def decayed_averages(self) -> np.ndarray:
+        """ Returns the decayed average of every cell, 0 for
+            cells with no loads."""
+        return np.divide(self.decayed_sums, self.decayed_weights, out=np.zeros_like(self.decayed_sums), where=self.decayed_weights > 0)
+
+    def cells(self) -> Iterator[Tuple]:
+        """ Yields every cell as (location, weekday, start
+            minute, end minute, average, count, decayed average,
+            decayed weight, last update clock)."""
+        averages, counts = self.averages().tolist(), self.counts.tolist()
+        decayed, weights, last = self.decayed_averages().tolist(), self.decayed_weights.tolist(), self.last.tolist()
+        for i, location in enumerate(self.locations):
+            for j, weekday in enumerate(self.weekdays):
+                for k, (start, end) in enumerate(self.slots):
+                    yield location, weekday, start, end, averages[i][j][k], counts[i][j][k], decayed[i][j][k], weights[i][j][k], last[i][j][k]
+
+    def rows(self) -> List[Dict]:
+        """ Returns the stats as load stats DB rows, with float
+            averages and weights and int counts."""
+        return [{   'Location': location,
+                    'Weekday': weekday,
+                    'Start Time': slot_time(start),
+                    'End Time': slot_time(end),
+                    'Average': average,
+                    'No. of Occurences': count,
+                    'Decayed Average': decayed,
+                    'Decayed Weight': weight,
+                    'Last Update': format_clock(last)}
+                for location, weekday, start, end, average, count, decayed, weight, last in self.cells()]
+
+    def set_rows(self, dicts: List[Dict]) -> int:
+        """ Replaces the stats with load stats DB rows. Rows
+            without decayed averages (from before they were
+            kept) start decaying from now. Returns how many rows
+            did not match any cell."""
+        self.clear()
+        unmatched = 0
+        now = clock_now()
+        for d in dicts:
+            cell = self.cell(d['Location'], d['Weekday'], d['Start Time'])
+            if cell is None or self.slots[cell[2]] != (minutes(d['Start Time']), minutes(d['End Time'])):
+                unmatched += 1
+                continue
+            self.counts[cell] = int(d['No. of Occurences'])
+            self.sums[cell] = float(d['Average']) * self.counts[cell]
+            if d.get('Decayed Weight') in (None, ''):
+                self.decayed_sums[cell], self.decayed_weights[cell] = self.sums[cell], self.counts[cell]
+                self.last[cell] = now if self.counts[cell] else NEVER
+            else:
+                self.decayed_weights[cell] = float(d['Decayed Weight'])
+                self.decayed_sums[cell] = float(d['Decayed Average']) * self.decayed_weights[cell]
+                self.last[cell] = parse_clock(d['Last Update'])
+        return unmatched
+
+def codes(values: Sequence[str], code: Callable[[str], int]) -> np.ndarray:
+    """ Returns the code of every value as an array. Every
+        distinct value is coded once."""
+    table = {value: code(value) for value in dict.fromkeys(values)}
+    return np.fromiter(map(table.__getitem__, values), dtype=np.intp, count=len(values))
@@ -0,0 +1,35 @@
+# One-shot migration of the CSV DBs into the SQLite DB used by
+# the server's "sqlite" storage backend.
+
+import logging
+from os.path import exists
+from sys import argv
+from server import SQLiteStore, SQLITE_DB, CURRENT_STATE_DB, LOAD_STATS_DB, TRANSMISSION_FIELDS, TRANSMISSION_LOG_DB
+from transmission_log import TransmissionLog
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO,
+                        )
+    logger = logging.getLogger()
+
+    # The target DB can be given as the first argument:
+    target = argv[1] if len(argv) > 1 else SQLITE_DB
+    if exists(target):
+        logger.warning(f"{target} already exists, its transmissions will be appended to.")
+
+    # The log's history may be in its rotated segments only, e.g.
+    # right after a daily rotation:
+    has_log = exists(TRANSMISSION_LOG_DB) or bool(TransmissionLog(TRANSMISSION_LOG_DB, TRANSMISSION_FIELDS).segments())
+    store = SQLiteStore(target)
+    store.import_csv(   logger,
+                        current_state_db=CURRENT_STATE_DB if exists(CURRENT_STATE_DB) else None,
+                        stats_db=LOAD_STATS_DB if exists(LOAD_STATS_DB) else None,
+                        log_db=TRANSMISSION_LOG_DB if has_log else None,
+                        )
+    conn = store.connection()
+    for table in ["transmissions", "current_state", "load_stats"]:
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        logger.info(f"{table}: {count} rows.")
+    store.close(logger)
+    logger.info(f"The CSV DBs were migrated to {target}.")
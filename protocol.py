@@ -0,0 +1,159 @@
+# Wire format of the sensors' transmissions, shared by the
+# server and the sensors (runs on Python and Micropython).
+#
+# Version 1 comes in two forms, chosen by the Content-Type:
+# JSON -    {"v": 1, "sn": 1, "location": "CSE Aquarium C100",
+#           "entrances": 30, "exits": 20, "ts": 1700000000}
+# Binary -  16 bytes, network byte order: version (B), S.N. (H),
+#           location ID (B), entrances (I), exits (I),
+#           timestamp (I).
+# Batches of transmissions are a JSON array of objects, newline
+# delimited JSON objects (application/x-ndjson) or concatenated
+# binary transmissions.
+# Timestamps are the sensor's wall clock time in seconds since
+# 1/1/1970, with no time zone, so any board epoch works.
+
+import json
+import struct
+
+VERSION = 1
+JSON_TYPE = "application/json"
+BINARY_TYPE = "application/vnd.hujilib.transmission"
+NDJSON_TYPE = "application/x-ndjson"
+BINARY_FORMAT = "!BHBIII"
+BINARY_SIZE = struct.calcsize(BINARY_FORMAT)
+MAX_JSON_SIZE = 512 # In bytes
+MAX_BATCH = 4096 # Transmissions per batch.
+MAX_SN = 0xFFFF
+MAX_COUNT = 0xFFFFFFFF
+LOCATION_IDS = [    "CSE Aquarium C100",    # Append only, a location's
+                    "CSE Aquarium B100",    # index is its ID on the
+                    "CSE Aquarium A100",    # wire.
+                    "Einstein Institute Math Library",
+                    "Harman Science Library - Floor 2 (Quiet)",
+                    "Harman Science Library - Floor 2 (Loud)",
+                    "Harman Science Library - Floor -1",
+                ]
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+### Time Functions:
+def wall_clock(year, month, day, hour, minute, second=0):
+    """ Returns the seconds since 1/1/1970 of a wall clock
+        date and time."""
+    # Days from the civil date (Howard Hinnant's algorithm):
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+def from_wall_clock(ts):
+    """ Returns the (year, month, day, hour, minute, weekday)
+        of a wall clock timestamp. Weekday 0 is Monday."""
+    days, seconds = divmod(ts, 86400)
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + (3 if mp < 10 else -9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day, seconds // 3600, seconds % 3600 // 60, (days + 3) % 7
+
+### Encoding:
+def encode_json(sn, location, entrances, exits, ts):
+    """ Returns a transmission in the JSON form."""
+    return json.dumps({ "v": VERSION, "sn": sn, "location": location,
+                        "entrances": entrances, "exits": exits, "ts": ts}).encode()
+
+def encode_binary(sn, location, entrances, exits, ts):
+    """ Returns a transmission in the binary form."""
+    return struct.pack(BINARY_FORMAT, VERSION, sn, LOCATION_IDS.index(location), entrances, exits, ts)
+
+### Decoding:
+def decode(body, content_type):
+    """ Recieves a transmission's body and Content-Type and
+        returns it as a transmission dictionary (S.N.,
+        Location, Weekday, Date, Time, Entrances, Exits).
+        Raises ValueError if the body is not a valid
+        transmission."""
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == BINARY_TYPE:
+        if len(body) != BINARY_SIZE:
+            raise ValueError("A binary transmission must be " + str(BINARY_SIZE) + " bytes long.")
+        version, sn, location_id, entrances, exits, ts = struct.unpack(BINARY_FORMAT, body)
+        if location_id >= len(LOCATION_IDS):
+            raise ValueError("Unknown location ID " + str(location_id) + ".")
+        fields = {"v": version, "sn": sn, "location": LOCATION_IDS[location_id],
+                  "entrances": entrances, "exits": exits, "ts": ts}
+    elif content_type == JSON_TYPE:
+        if len(body) > MAX_JSON_SIZE:
+            raise ValueError("A JSON transmission must be at most " + str(MAX_JSON_SIZE) + " bytes long.")
+        fields = json.loads(body.decode("utf-8"))
+        if not isinstance(fields, dict):
+            raise ValueError("A JSON transmission must be an object.")
+    else:
+        raise ValueError("Unsupported Content-Type " + content_type + ".")
+    return to_transmission(fields)
+
+def decode_batch(body, content_type):
+    """ Recieves a batch of transmissions and its Content-Type
+        and returns a list with the transmission dictionary of
+        every record, or the ValueError it was rejected with.
+        Raises ValueError if the batch itself is malformed."""
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == BINARY_TYPE:
+        if len(body) % BINARY_SIZE:
+            raise ValueError("A binary batch must be a multiple of " + str(BINARY_SIZE) + " bytes long.")
+        records = [body[i:i + BINARY_SIZE] for i in range(0, len(body), BINARY_SIZE)]
+    elif content_type == JSON_TYPE:
+        records = json.loads(body.decode("utf-8"))
+        if not isinstance(records, list):
+            raise ValueError("A JSON batch must be an array.")
+    elif content_type == NDJSON_TYPE:
+        records = [line for line in body.split(b"\n") if line.strip()]
+    else:
+        raise ValueError("Unsupported Content-Type " + content_type + ".")
+    if len(records) > MAX_BATCH:
+        raise ValueError("A batch must have at most " + str(MAX_BATCH) + " transmissions.")
+
+    results = []
+    for record in records:
+        try:
+            if content_type == BINARY_TYPE:
+                results.append(decode(record, BINARY_TYPE))
+            elif content_type == NDJSON_TYPE:
+                results.append(decode(record, JSON_TYPE))
+            elif isinstance(record, dict):
+                results.append(to_transmission(record))
+            else:
+                raise ValueError("A JSON transmission must be an object.")
+        except ValueError as e:
+            results.append(e)
+    return results
+
+def to_transmission(fields):
+    """ Validates the fields of a version 1 transmission and
+        returns the matching transmission dictionary.
+        Raises ValueError if a field is missing or invalid."""
+    if fields.get("v") != VERSION:
+        raise ValueError("Unsupported transmission version " + str(fields.get("v")) + ".")
+    for key, maximum in [("sn", MAX_SN), ("entrances", MAX_COUNT), ("exits", MAX_COUNT), ("ts", MAX_COUNT)]:
+        value = fields.get(key)
+        if type(value) is not int or not 0 <= value <= maximum:
+            raise ValueError("The field " + key + " must be an integer between 0 and " + str(maximum) + ".")
+    location = fields.get("location")
+    if not isinstance(location, str) or not 0 < len(location) <= 100:
+        raise ValueError("The field location must be a non-empty string.")
+    year, month, day, hour, minute, weekday = from_wall_clock(fields["ts"])
+    return {"S.N.": fields["sn"],
+            "Location": location,
+            "Weekday": WEEKDAY_NAMES[weekday],
+            "Date": "{:02d}/{:02d}/{}".format(day, month, year),
+            "Time": "{:02d}:{:02d}".format(hour, minute),
+            "Entrances": fields["entrances"],
+            "Exits": fields["exits"]}
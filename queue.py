@@ -8,25 +8,104 @@ class QueueEmpty(Exception):
 class QueueFull(Exception):
     pass
 
+# Capacity of the ring of an unbounded queue, doubled when it fills up.
+INITIAL_CAPACITY = 16
+# Capacity of the rings of blocked tasks, doubled when one fills up.
+INITIAL_WAITERS = 4
+
+# A blocked task's event, and the item handed to (or taken from) it.
+# Waiters are pooled and reused, so blocking does not allocate.
+class _Waiter:
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.item = None
+
+# A FIFO of waiters on a preallocated ring.
+class _WaiterRing:
+
+    def __init__(self):
+        self.slots = [None] * INITIAL_WAITERS
+        self.head = 0
+        self.count = 0
+
+    def append(self, waiter):
+        capacity = len(self.slots)
+        if self.count == capacity:
+            self.slots = [self.slots[(self.head + i) % capacity] for i in range(capacity)] + [None] * capacity
+            self.head = 0
+            capacity *= 2
+        self.slots[(self.head + self.count) % capacity] = waiter
+        self.count += 1
+
+    def popleft(self):
+        waiter = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % len(self.slots)
+        self.count -= 1
+        return waiter
+
+    def remove(self, waiter):  # Return True if the waiter was still waiting.
+        # O(n), but only a cancelled task removes itself.
+        capacity = len(self.slots)
+        for i in range(self.count):
+            if self.slots[(self.head + i) % capacity] is waiter:
+                for j in range(i, self.count - 1):
+                    self.slots[(self.head + j) % capacity] = self.slots[(self.head + j + 1) % capacity]
+                self.count -= 1
+                self.slots[(self.head + self.count) % capacity] = None
+                return True
+        return False
+
 class Queue:
 
     def __init__(self, maxsize=0):
         self.maxsize = maxsize
-        self._queue = []
-        self._evput = asyncio.Event()  # Triggered by put, tested by get
-        self._evget = asyncio.Event()  # Triggered by get, tested by put
+        # A preallocated ring, so puts and gets do not allocate:
+        self._ring = [None] * (maxsize if maxsize > 0 else INITIAL_CAPACITY)
+        self._head = 0  # Index of the oldest item
+        self._count = 0
+        # Blocked tasks' waiters in FIFO order. An item is handed to (or
+        # taken from) the first waiter directly, which wakes that task only.
+        self._getters = _WaiterRing()
+        self._putters = _WaiterRing()
+        self._idle = []  # Waiters of no blocked task, for reuse
 
     def _get(self):
-        self._evget.set()  # Schedule all tasks waiting on get
-        self._evget.clear()
-        return self._queue.pop(0)
+        val = self._ring[self._head]
+        self._ring[self._head] = None
+        self._head = (self._head + 1) % len(self._ring)
+        self._count -= 1
+        if self._putters.count:  # Take the first blocked put's item
+            waiter = self._putters.popleft()
+            self._append(waiter.item)
+            waiter.event.set()
+        return val
+
+    def _waiter(self):
+        return self._idle.pop() if self._idle else _Waiter()
+
+    def _release(self, waiter):
+        waiter.item = None
+        waiter.event.clear()
+        self._idle.append(waiter)
 
     async def get(self):  #  Usage: item = await queue.get()
-        while self.empty():  # May be multiple tasks waiting on get()
-            # Queue is empty, suspend task until a put occurs
-            # 1st of N tasks gets, the rest loop again
-            await self._evput.wait()
-        return self._get()
+        if self._count:
+            return self._get()
+        # Queue is empty, suspend task until a put hands it an item
+        waiter = self._waiter()
+        self._getters.append(waiter)
+        try:
+            await waiter.event.wait()
+        except BaseException:  # Cancelled
+            if not self._getters.remove(waiter) and waiter.event.is_set():
+                self._put_front(waiter.item)  # An item was already handed over
+            self._release(waiter)
+            raise
+        val = waiter.item
+        self._release(waiter)
+        return val
 
     def get_nowait(self):  # Remove and return an item from the queue.
         # Return an item if one is immediately available, else raise QueueEmpty.
@@ -34,31 +113,79 @@ class Queue:
             raise QueueEmpty()
         return self._get()
 
+    async def get_many(self, n):  # Usage: items = await queue.get_many(n)
+        # Wait for an item, then return it with up to n - 1 more available items.
+        items = [await self.get()]
+        while len(items) < n and self._count:
+            items.append(self._get())
+        return items
+
+    def _append(self, val):
+        if self._count == len(self._ring):  # Only an unbounded queue fills its ring
+            self._grow()
+        self._ring[(self._head + self._count) % len(self._ring)] = val
+        self._count += 1
+
+    def _put_front(self, val):  # Return an item to the head of the queue.
+        if self._getters.count:
+            self._put(val)
+            return
+        if self._count == len(self._ring):
+            self._grow()
+        self._head = (self._head - 1) % len(self._ring)
+        self._ring[self._head] = val
+        self._count += 1
+
+    def _grow(self):
+        capacity = len(self._ring)
+        self._ring = [self._ring[(self._head + i) % capacity] for i in range(self._count)] + \
+                     [None] * (2 * capacity - self._count)
+        self._head = 0
+
     def _put(self, val):
-        self._evput.set()  # Schedule tasks waiting on put
-        self._evput.clear()
-        self._queue.append(val)
+        if self._getters.count:  # Hand the item to the first blocked get
+            waiter = self._getters.popleft()
+            waiter.item = val
+            waiter.event.set()
+        else:
+            self._append(val)
 
     async def put(self, val):  # Usage: await queue.put(item)
-        while self.full():
-            # Queue full
-            await self._evget.wait()
-            # Task(s) waiting to get from queue, schedule first Task
-        self._put(val)
+        if not self.full() and not self._putters.count:
+            self._put(val)
+            return
+        # Queue full, suspend task until a get takes its item
+        waiter = self._waiter()
+        waiter.item = val
+        self._putters.append(waiter)
+        try:
+            await waiter.event.wait()
+        except BaseException:  # Cancelled
+            self._putters.remove(waiter)
+            self._release(waiter)
+            raise
+        self._release(waiter)
 
     def put_nowait(self, val):  # Put an item into the queue without blocking.
         if self.full():
             raise QueueFull()
         self._put(val)
 
+    async def put_many(self, vals):  # Usage: await queue.put_many(items)
+        # Put the items in order, waiting for room only when the queue is full.
+        for val in vals:
+            if self.full() or self._putters.count:
+                await self.put(val)
+            else:
+                self._put(val)
+
     def qsize(self):  # Number of items in the queue.
-        return len(self._queue)
+        return self._count
 
     def empty(self):  # Return True if the queue is empty, False otherwise.
-        return len(self._queue) == 0
+        return self._count == 0
 
     def full(self):  # Return True if there are maxsize items in the queue.
         # Note: if the Queue was initialized with maxsize=0 (the default) or
         # any negative number, then full() is never True.
         return self.maxsize > 0 and self.qsize() >= self.maxsize
-    
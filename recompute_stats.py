@@ -0,0 +1,28 @@
+# One-shot recomputation of the load stats from the whole
+# transmission log, e.g. after fixing the log of a faulty
+# sensor. Run it while the server is stopped, so the server
+# does not write its stats over the recomputed ones.
+
+import logging
+from sys import argv
+from time import perf_counter
+from server import create_dbs, make_store, STORAGE_BACKEND
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO,
+                        )
+    logger = logging.getLogger()
+
+    # The storage backend can be given as the first argument:
+    backend = argv[1] if len(argv) > 1 else STORAGE_BACKEND
+    create_dbs(logger)
+    store = make_store(backend)
+    store.load(logger)
+
+    started = perf_counter()
+    counted = store.recompute_stats(logger)
+    logger.info(f"The load stats were recomputed from {counted} transmissions in {perf_counter() - started:.2f} seconds.")
+
+    # Writes the stats to the snapshot and the CSV DBs:
+    store.close(logger)
@@ -0,0 +1,59 @@
+# Weekly operating hours of the sensors (runs on Python and
+# Micropython). A timetable maps a weekday name to its
+# ((opening hour, minute), (closing hour, minute)), days that
+# are missing are closed. Times are localtime() tuples.
+#
+# Also the server's load stats time slots, which the server and
+# the sensors share: a sensor transmits at the start of every
+# slot.
+
+from protocol import WEEKDAY_NAMES
+
+DAY_MINUTES = 24 * 60
+OPENING_HOUR = 8
+CLOSING_HOUR = 20
+SLOT_MINUTES = 120 # The length of a load stats time slot, e.g.
+                   # 15, 30, 60 or 120. Changing it recomputes
+                   # the server's load stats from the transmission
+                   # log, flash the sensors with it too.
+
+def minutes(t):
+    """ Returns the minutes since midnight of a localtime()
+        tuple."""
+    return t[3] * 60 + t[4]
+
+def is_open(timetable, t):
+    """ Returns True if the time is within the operating hours
+        of its weekday."""
+    hours = timetable.get(WEEKDAY_NAMES[t[6]])
+    if hours is None:
+        return False
+    (open_h, open_m), (close_h, close_m) = hours
+    return open_h * 60 + open_m <= minutes(t) < close_h * 60 + close_m
+
+def seconds_until_open(timetable, t):
+    """ Returns the seconds from the time until the next
+        opening, or None if the timetable has no open days."""
+    now = minutes(t)
+    for days in range(8):
+        hours = timetable.get(WEEKDAY_NAMES[(t[6] + days) % 7])
+        if hours is None:
+            continue
+        opening = days * DAY_MINUTES + hours[0][0] * 60 + hours[0][1]
+        if opening > now:
+            return (opening - now) * 60 - t[5]
+    return None
+
+def seconds_to_slot(t):
+    """ Returns the seconds from the time until the next load
+        stats slot starts."""
+    seconds = minutes(t) * 60 + t[5] - OPENING_HOUR * 3600
+    return SLOT_MINUTES * 60 - seconds % (SLOT_MINUTES * 60)
+
+def seconds_until_close(timetable, t):
+    """ Returns the seconds from the time until the day's
+        closing, or 0 if it is not within operating hours."""
+    if not is_open(timetable, t):
+        return 0
+    close_h, close_m = timetable[WEEKDAY_NAMES[t[6]]][1]
+    return (close_h * 60 + close_m - minutes(t)) * 60 - t[5]
@@ -1,30 +1,70 @@
 # Module Imports:
 import network
+import ntptime
+import protocol
 import queue
-from machine import Pin, deepsleep
+import schedule
+import struct
+from array import array
+from backlog import Backlog
+from errno import ECONNRESET
+from machine import Pin, RTC, SLEEP, DEEPSLEEP_RESET, deepsleep, lightsleep, reset_cause
 import uasyncio as asyncio
-from time import sleep, localtime, time
+from time import localtime, time, ticks_ms, ticks_diff
 
 ### Network Constants:
 SERVER_ADDR = "192.168.170.34"
 SERVER_PORT = 80
 WLAN_SSID = "HUJI-guest"
 WLAN_PW = ""
+NTP_HOST = "pool.ntp.org" # Any NTP server on the LAN works too.
+UTC_OFFSET = 2 * 3600 # In seconds, Israel Standard Time (3 * 3600 in summer).
 
 ### Operation Constants:
 _SN_VAL = 1
 _LOC_VAL = "Harman Science Library - Floor 2 (Quiet)"
-TRANSMIT_INTERVAL = 60 # In seconds
+TRANSMIT_INTERVAL = 60 # In seconds, while the counts are changing.
+HEARTBEAT_INTERVAL = 15 * 60 # In seconds, while they are not.
+CHANGE_THRESHOLD = 5    # Occupancy change that is transmitted right
+                        # away, at most every MIN_TRANSMIT_GAP.
+MIN_TRANSMIT_GAP = 10 # In seconds
 TRANSMIT_TIMEOUT = 5 # In seconds
+WIRE_FORMAT = "binary" # "binary" or "json", see protocol.py.
+BATCH_PATH = "/batch"
+BATCH_SIZE = 64 # Transmissions per request when flushing the backlog.
 LAN_TIMEOUT = 15 # In seconds
 MOTION_ON = 0
 MOTION_OFF = 1
 MOTION_TIMEOUT = 2  # The timout duration to cancel an 
                     # entrance or exit if only one sensor was
                     # activated.
+EDGE_QUEUE_SIZE = 32 # Motion sensor edges waiting for the motion task.
+LEFT = 0
+RIGHT = 1
 BLINK_TIME = 0.25 # In seconds
-WAKEUP_TIME = (8, 0) # (Hours, Minutes)
-SLEEP_TIME = (19, 0) # (Hours, Minutes)
+CONSUMER_BATCH = 8 # Queue items the consumer takes at once.
+
+### Power Constants:
+TIMETABLE = {   "Sun": ((8, 0), (20, 0)),   # Operating hours, (Hours, 
+                "Mon": ((8, 0), (20, 0)),   # Minutes), matching the
+                "Tue": ((8, 0), (20, 0)),   # server's WEEKDAYS. The 
+                "Wed": ((8, 0), (20, 0)),   # sensor deep sleeps the 
+                "Thu": ((8, 0), (20, 0)),   # rest of the week.
+            }
+LIGHT_SLEEP = True # Light sleep between motion events.
+MIN_LIGHT_SLEEP = 5 # In seconds, shorter idle times are not slept.
+IDLE_CHECK = 1 # In seconds
+RTC_FORMAT = "!4sII" # Magic, entrances, exits, kept in RTC memory
+RTC_MAGIC = b"HLib"  # through deep sleep.
+
+### Backlog Constants:
+BACKLOG_SIZE = 512  # Unsent transmissions held in RAM (16 bytes 
+                    # each), 8.5 hours at TRANSMIT_INTERVAL.
+BACKLOG_FILE = "backlog.bin" # Flash spill of the backlog, None to disable.
+BACKLOG_FILE_SIZE = 4096    # Unsent transmissions held in flash 
+                            # (64KB), 2.8 days at TRANSMIT_INTERVAL.
+MIN_BACKOFF = 30 # In seconds, after the first failed transmission.
+MAX_BACKOFF = 15 * 60 # In seconds
 
 ### Component Constants:
 YELLOW_LED_PIN = 23 # Yellow: Lights if successfully 
@@ -48,8 +88,6 @@ TIME = "Time"
 ### Queue Put Values:
 TRANSMIT = "Transmit"
 BLINK = "Blink"
-CHECK_ENTER = "Check Enter"
-CHECK_EXIT = "Check Exit"
 
 class Sensor:
     def __init__(self) -> None:
@@ -65,9 +103,21 @@ class Sensor:
         self.transmission[ENTRANCES] = 0
         self.transmission[EXITS] = 0
         self.update_time()
+        self.backlog = Backlog( protocol.BINARY_SIZE, BACKLOG_SIZE, 
+                                BACKLOG_FILE, BACKLOG_FILE_SIZE)
+        self.backoff = MIN_BACKOFF
+        self.retry_at = 0 # Time of the next transmission attempt.
+        self.sent_counts = None # (Entrances, Exits) of the last transmission.
+        self.sent_at = 0 # Time of the last transmission.
+        self.next_due = 0 # Time of the next scheduled transmission.
+        self.count_changed = asyncio.Event()
+        self.working = False # The consumer is handling items.
+        self.restore_counters()
 
         # System Attributes:
         self.station = network.WLAN(network.STA_IF)
+        self.input_stream = None    # The connection to the server, 
+        self.output_stream = None   # kept open between transmissions.
 
         # Component Attributes:
         self.yellow_led = Pin(YELLOW_LED_PIN, Pin.OUT)
@@ -76,25 +126,44 @@ class Sensor:
         self.blue_led = Pin(BLUE_LED_PIN, Pin.OUT)
         self.motion_L = Pin(MOTION_L_PIN, Pin.IN)
         self.motion_R = Pin(MOTION_R_PIN, Pin.IN)
-        self.prev_L = MOTION_OFF
-        self.prev_R = MOTION_OFF
+
+        # Motion Attributes:
+        # A ring of the motion sensors' edges, written at the
+        # tail by the IRQ handlers and read at the head by the
+        # motion task:
+        self.edge_times = array('i', [0] * EDGE_QUEUE_SIZE)
+        self.edge_values = bytearray(EDGE_QUEUE_SIZE) # Side << 1 | value
+        self.edge_head = 0
+        self.edge_tail = 0
+        self.lost_edges = 0 # Edges dropped while the ring was full.
+        self.edge_flag = asyncio.ThreadSafeFlag()
+        self.direction = None # The side that started a direction,
+        self.direction_start = 0 # and the time it started.
 
     ### Runtime Functions:
     async def run(self) -> None:
         print(f"HUJI-Lib Sensor {self.transmission[SN]} has started running...")
 
+        # Set the clock once per wake:
+        if await self.connect():
+            self.sync_time()
+
         # Create the Consumer-Producer shared queue:
         self.q = queue.Queue()
 
-        # Run the producer and consumer:
-        await asyncio.gather(   self.producer(self.q), 
-                                self.consumer(self.q))
+        # Run the producer, consumer and motion detection:
+        tasks = [   self.producer(self.q), 
+                    self.consumer(self.q),
+                    self.detect_motion(self.q)]
+        if LIGHT_SLEEP:
+            tasks.append(self.idle())
+        await asyncio.gather(*tasks)
 
     async def producer(self, q: queue.Queue) -> None:
         """
-            Measures entrances and exits. Works for 
-            {TRNSMT_INTERVAL} seconds, then updates the 
-            'self.entrances' and `self.exits`.
+            Flags a transmission when the schedule calls for
+            one, while entrances and exits are counted by the
+            motion task.
         """
 
         print("Producer has started running.")
@@ -107,28 +176,30 @@ class Sensor:
             if self.is_operating_hours():
                 print("Sensor is now awake.")
                 if not self.station.isconnected(): 
-                    self.connect()
-                start = time()
-                while time() - start <= TRANSMIT_INTERVAL:
-                    # Check entrances and exits 
-                    # simultaneously with gather:
-                    await asyncio.gather(
-                        self.check_enter(self.q),
-                         self.check_exit(self.q))
-                    
-                    # Update sensors' previous values:
-                    self.prev_R = self.motion_R.value()
-                    self.prev_L = self.motion_L.value()
+                    await self.connect()
+                # The loop is idle until motion or the schedule:
+                await self.wait_for_transmit()
 
                 # Transmit to server:
+                self.sent_counts = (self.transmission[ENTRANCES], self.transmission[EXITS])
+                self.sent_at = time()
                 await q.put(TRANSMIT)
 
             # If the sensor should go to deep sleep:
             else:
-                print(f"Entering deep sleep mode for {self.get_sleep_time()} seconds...")
+                # Let the day's last transmission be sent:
+                while not q.empty() or self.working:
+                    await asyncio.sleep(IDLE_CHECK)
+                sleep_time = self.get_sleep_time()
+                print(f"Entering deep sleep mode for {sleep_time} seconds...")
+                self.close_connection()
                 if self.station.isconnected(): 
                     self.disconnect()
-                deepsleep(1000 * self.get_sleep_time())
+                # Keep the unsent transmissions and the counters 
+                # through the sleep:
+                self.backlog.spill_all()
+                self.save_counters()
+                deepsleep(1000 * sleep_time)
 
 
     async def consumer(self, q: queue.Queue):
@@ -139,26 +210,79 @@ class Sensor:
 
         print("Consumer has started running.")
         
-        while True:
-            # Wait for work:
-            item = await q.get()
+        running = True
+        while running:
+            # Wait for work, and take the rest of a burst with it:
+            items = await q.get_many(CONSUMER_BATCH)
+            self.working = True
+            blinked = False
+            for item in items:
+                # Check for stop signal:
+                if item is None:
+                    running = False
+                    break
+
+                # Continue to the corresponding function:
+                if item == TRANSMIT:
+                    await self.transmit()
+                
+                elif item == BLINK and not blinked: 
+                    # Could only blink blue LED for motion, once
+                    # for a burst of motions:
+                    await self.blink(self.blue_led)
+                    blinked = True
+            self.working = False
 
-            # Check for stop signal:
-            if item is None:
-                break
+        print("Consumer has finished running.")
 
-            # Continue to the corresponding function:
-            if item == TRANSMIT:
-                await self.transmit()
-            
-            elif item == BLINK: 
-                # Could only blink blue LED for motion
-                await self.blink(self.blue_led)
+    ### Scheduling Functions:
+    async def wait_for_transmit(self) -> None:
+        """
+            Waits until the next transmission is due:
+            - Right away if the occupancy has changed by more than
+              {CHANGE_THRESHOLD}, at most every {MIN_TRANSMIT_GAP}
+              seconds.
+            - Every {TRANSMIT_INTERVAL} seconds while the counts
+              are changing.
+            - Every {HEARTBEAT_INTERVAL} seconds while they are
+              not, and at the start of every load stats slot.
+            - At closing time.
+        """
+        t = localtime()
+        slot_start = time() + self.seconds_to_slot()
+        closing = time() + schedule.seconds_until_close(TIMETABLE, t)
+        while True:
+            now = time()
+            since = now - self.sent_at
+            due = min(self.sent_at + HEARTBEAT_INTERVAL, slot_start, closing)
+            if self.sent_counts is None or now >= due:
+                return
+            entrances, exits = self.transmission[ENTRANCES], self.transmission[EXITS]
+            if (entrances, exits) != self.sent_counts:
+                change = abs((entrances - exits) - (self.sent_counts[0] - self.sent_counts[1]))
+                if change > CHANGE_THRESHOLD and since >= MIN_TRANSMIT_GAP:
+                    return
+                if since >= TRANSMIT_INTERVAL:
+                    return
+                due = min(due, self.sent_at + (MIN_TRANSMIT_GAP if change > CHANGE_THRESHOLD else TRANSMIT_INTERVAL))
+
+            # Sleep until the next deadline or count change:
+            self.next_due = due
+            self.count_changed.clear()
+            try:
+                await asyncio.wait_for(self.count_changed.wait(), due - now)
+            except asyncio.TimeoutError:
+                pass
 
-        print("Consumer has finished running.")
+    def seconds_to_slot(self) -> int:
+        """
+            Returns the seconds until the next load stats slot
+            starts.
+        """
+        return schedule.seconds_to_slot(localtime())
 
     ### Connectibility Functions:
-    def connect(self) -> bool:
+    async def connect(self) -> bool:
         """
             Connect to WiFi network. Blinks yellow LED while 
             attempting to connect, solid yellow when 
@@ -184,7 +308,7 @@ class Sensor:
             else:
                 self.yellow_led.value(1)
             print(f"\r({time()-start}s) Connecting{((time()-start) % 4) * '.'}   ", end='')
-            sleep(.25)
+            await asyncio.sleep(.25)
 
         # Connection attempt passed timeout:
         if time()-start > LAN_TIMEOUT:
@@ -223,64 +347,152 @@ class Sensor:
 
     async def transmit(self):
         """
-            Sends the transmission dict to the server.
+            Adds the transmission to the backlog and sends the
+            backlog to the server in batches, oldest first.
+            After a failure, waits an exponentially growing
+            backoff before the next attempt, and keeps the
+            transmissions until they are sent. Reports the
+            motion edges and transmissions lost since boot, if
+            any.
             Lights green LED and returns True if succeeded,
             Lights red LED and returns False else.
         """
 
         self.update_time()
+        self.backlog.append(self.encode_transmission())
+        if self.lost_edges or self.backlog.dropped:
+            print(  f"Lost since boot: {self.lost_edges} motion edges (the edge queue was full), "
+                    f"{self.backlog.dropped} transmissions (the backlog was full).")
+        if time() < self.retry_at:
+            print(f"Transmission postponed, {len(self.backlog)} transmissions are waiting.")
+            return False
 
         try:
-            print("Transmitting to server...")
-            wrap = asyncio.open_connection(SERVER_ADDR, SERVER_PORT)
-            try: # Wrap-around for the open connection function to add timeout:
-                self.input_stream, self.output_stream = \
-                    yield from asyncio.wait_for(wrap,
-                                    timeout=TRANSMIT_TIMEOUT)
-            except asyncio.TimeoutError:
-                print("Connection attempt has reached its timeout.")
-                
-                # Set lights to failure and return from function:
-                self.red_led.value(1)
-                self.green_led.value(0)
-                return
-
-            template = \
-                "POST / HTTP/1.1\r\n" \
-                "Host: {ip}\r\n" \
-                "User-Agent: python-requests/2.28.1\r\n" \
-                "Accept-Encoding: gzip, deflate\r\n" \
-                "Accept: */*\r\n" \
-                "Content-Type: application/text\r\n" \
-                "Connection: keep-alive\r\n" \
-                "Content-Length: {length}\r\n" \
-                "\r\n" \
-                "{body}"
-            
-            # Add the request output stream buffer:
-            self.output_stream.write(template.format(ip=SERVER_ADDR, length=len(str(self.transmission)), body=str(self.transmission)))
-            # Drain output stream buffer (send through socket):
-            await self.output_stream.drain()
+            # The WiFi may have dropped during a light sleep:
+            if not self.station.isconnected() and not await self.connect():
+                raise OSError("The sensor is not connected to WiFi.")
+            print(f"Transmitting {len(self.backlog)} transmissions to server...")
+            while len(self.backlog):
+                batch = self.backlog.peek(BATCH_SIZE)
+                content_type, body = self.encode_batch(batch)
+                status, reply = await self.post(BATCH_PATH, content_type, body)
+                if status == 400:
+                    # The server will never accept these:
+                    print(f"The server rejected a batch.\n Reply: {reply}")
+                elif status != 200:
+                    raise OSError(f"The server replied with status {status}.")
+                self.backlog.drop(len(batch) // protocol.BINARY_SIZE)
 
             print(f"Transmission sent at {self.transmission['Date']}, {self.transmission['Time']}")
 
             # Set lights to success:
             self.red_led.value(0)
             self.green_led.value(1)
+            self.backoff = MIN_BACKOFF
+            self.retry_at = 0
+            return True
 
         except Exception as e:
-            print(f"Transmission failed.\n Exception: {e}")
+            print(f"Transmission failed, retrying in {self.backoff} seconds.\n Exception: {e}")
 
             # Set lights to failure:
             self.green_led.value(0)
             self.red_led.value(1)
+            self.retry_at = time() + self.backoff
+            self.backoff = min(2 * self.backoff, MAX_BACKOFF)
+            return False
 
-        finally:
-            # Close connections after every attempt:
-            if hasattr(self, 'output_stream'): 
+    async def post(self, path, content_type, body):
+        """
+            Sends a POST request to the server on the kept open
+            connection and returns the reply's (status, body).
+            Opens a new connection if there is none, or if the
+            server has closed the kept one while it was idle.
+            Raises an exception if the server could not be
+            reached.
+        """
+        while True:
+            reused = self.output_stream is not None
+            if not reused:
+                self.input_stream, self.output_stream = await asyncio.wait_for(
+                    asyncio.open_connection(SERVER_ADDR, SERVER_PORT), timeout=TRANSMIT_TIMEOUT)
+            try:
+                return await self.request(path, content_type, body)
+            except EOFError:
+                self.close_connection()
+                # A kept connection that was closed by the server 
+                # has not handled the request, retry it on a new
+                # connection. Any other failure, e.g. a timeout,
+                # may have been handled and is not retried:
+                if not reused:
+                    raise
+            except Exception:
+                self.close_connection()
+                raise
+
+    async def request(self, path, content_type, body):
+        """
+            Sends a POST request on the open connection and 
+            returns the reply's (status, body). Closes the 
+            connection if the server asked to.
+            Raises EOFError if the connection was closed or 
+            reset before the reply has started.
+        """
+        template = \
+            "POST {path} HTTP/1.1\r\n" \
+            "Host: {ip}\r\n" \
+            "User-Agent: HUJI-Lib-Sensor\r\n" \
+            "Accept: */*\r\n" \
+            "Content-Type: {content_type}\r\n" \
+            "Connection: keep-alive\r\n" \
+            "Content-Length: {length}\r\n" \
+            "\r\n"
+
+        # Send the request through the socket:
+        self.output_stream.write(template.format(path=path, ip=SERVER_ADDR, content_type=content_type, length=len(body)).encode() + body)
+        await self.output_stream.drain()
+
+        # Read the reply's status line and headers:
+        try:
+            status_line = await asyncio.wait_for(self.input_stream.readline(), timeout=TRANSMIT_TIMEOUT)
+        except asyncio.TimeoutError: # An OSError on CPython.
+            raise
+        except OSError as e:
+            if e.args and e.args[0] == ECONNRESET:
+                raise EOFError("The server has reset the connection.")
+            raise
+        if not status_line:
+            raise EOFError("The server has closed the connection.")
+        status = int(status_line.split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await asyncio.wait_for(self.input_stream.readline(), timeout=TRANSMIT_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                keep_alive = False
+        reply = await asyncio.wait_for(self.input_stream.readexactly(length), timeout=TRANSMIT_TIMEOUT) if length else b""
+
+        if not keep_alive:
+            self.close_connection()
+        return status, reply
+
+    def close_connection(self):
+        """
+            Closes the connection to the server, if open.
+        """
+        if self.output_stream is not None:
+            # The streams share the connection:
+            try:
                 self.output_stream.close()
-            if hasattr(self, 'input_stream'): 
-                self.input_stream.close()
+            except Exception:
+                pass
+        self.input_stream = self.output_stream = None
 
     ### Data Proccessing Functions:
     def __str__(self) -> str:
@@ -301,6 +513,30 @@ class Sensor:
                     f"Motion Sensor (R): {self.motion_R.value()}\n" + \
                 "\n### End of Report ###\n"
 
+    def encode_transmission(self):
+        """
+            Returns the transmission in the binary wire format,
+            the form it is kept in the backlog.
+        """
+        t = localtime()
+        ts = protocol.wall_clock(t[0], t[1], t[2], t[3], t[4], t[5])
+        return protocol.encode_binary(  self.transmission[SN], self.transmission[LOCATION],
+                                        self.transmission[ENTRANCES], self.transmission[EXITS], ts)
+
+    def encode_batch(self, batch):
+        """
+            Returns the Content-Type and body of a batch of
+            binary transmissions in the wire format.
+        """
+        if WIRE_FORMAT == "json":
+            lines = []
+            for i in range(0, len(batch), protocol.BINARY_SIZE):
+                _, sn, location_id, entrances, exits, ts = \
+                    struct.unpack(protocol.BINARY_FORMAT, batch[i:i + protocol.BINARY_SIZE])
+                lines.append(protocol.encode_json(sn, protocol.LOCATION_IDS[location_id], entrances, exits, ts))
+            return protocol.NDJSON_TYPE, b"\n".join(lines)
+        return protocol.BINARY_TYPE, batch
+
     def update_time(self) -> None:
         """
             Update Weekday, date and time in 
@@ -331,47 +567,89 @@ class Sensor:
         self.transmission[TIME] = tstamp
 
     ### Motion Detection Functions:
-    async def check_enter(self, q) -> bool:
-        """
-            Checks if someone entered the room. Returns 1 if 
-            someone entered, 0 if not.
-            Entrance direction is R -> L.
-        """
-        if  self.motion_R.value() == MOTION_ON and \
-            self.prev_R == MOTION_OFF:
-            start = time()
-            while time() - start <= MOTION_TIMEOUT:
-                l_val = self.motion_L.value()
-                r_val = self.motion_R.value()
-                if  l_val == MOTION_ON and \
-                    r_val == MOTION_OFF:
-                    self.prev_L, self.prev_R = l_val, r_val
-                    print("Entrance!")
-                    self.transmission[ENTRANCES] += 1
-                    await q.put(BLINK)
-                    return True
-        return False
-
-    async def check_exit(self, q) -> bool:
-        """
-            Checks if someone has left the room. Returns 1 if 
-            someone left, 0 if not.
-            Exit direction is L -> R.
-        """
-        if  self.motion_L.value() == MOTION_ON and \
-            self.prev_L == MOTION_OFF:
-            start = time()
-            while time() - start <= MOTION_TIMEOUT:
-                l_val = self.motion_L.value()
-                r_val = self.motion_R.value()
-                if  r_val == MOTION_ON and \
-                    l_val == MOTION_OFF:
-                    self.prev_L, self.prev_R = l_val, r_val
-                    print("Exit!")
-                    self.transmission[EXITS] += 1
+    def on_motion_L(self, pin):
+        """
+            IRQ handler of the left motion sensor.
+        """
+        self.push_edge(LEFT, pin.value())
+
+    def on_motion_R(self, pin):
+        """
+            IRQ handler of the right motion sensor.
+        """
+        self.push_edge(RIGHT, pin.value())
+
+    def motion_pending(self):
+        """
+            Returns True if a direction has started and has not
+            timed out yet.
+        """
+        return  self.direction is not None and \
+                ticks_diff(ticks_ms(), self.direction_start) <= MOTION_TIMEOUT * 1000
+
+    def watch_motion(self):
+        """
+            Sets the motion sensors' pin change IRQs.
+        """
+        trigger = Pin.IRQ_RISING | Pin.IRQ_FALLING
+        self.motion_L.irq(trigger=trigger, handler=self.on_motion_L)
+        self.motion_R.irq(trigger=trigger, handler=self.on_motion_R)
+
+    def push_edge(self, side, value):
+        """
+            Adds a timestamped edge to the edge queue and wakes
+            the motion task. Runs in IRQ context, so it does not
+            allocate, and only the handlers move the tail.
+        """
+        tail = (self.edge_tail + 1) % EDGE_QUEUE_SIZE
+        if tail == self.edge_head:
+            self.lost_edges += 1
+        else:
+            self.edge_times[self.edge_tail] = ticks_ms()
+            self.edge_values[self.edge_tail] = side << 1 | value
+            self.edge_tail = tail
+        self.edge_flag.set()
+
+    async def detect_motion(self, q) -> None:
+        """
+            Counts entrances and exits from the edge queue.
+            Entrance direction is R -> L: the right sensor is
+            activated, then the left one while the right one is
+            not. Exit direction is L -> R. A direction that was
+            not completed within {MOTION_TIMEOUT} seconds is
+            cancelled.
+        """
+        # Detect motion by the sensors' pin changes:
+        levels = [self.motion_L.value(), self.motion_R.value()]
+        self.watch_motion()
+
+        while True:
+            await self.edge_flag.wait()
+            while self.edge_head != self.edge_tail:
+                t = self.edge_times[self.edge_head]
+                side, value = self.edge_values[self.edge_head] >> 1, self.edge_values[self.edge_head] & 1
+                self.edge_head = (self.edge_head + 1) % EDGE_QUEUE_SIZE
+                if value == levels[side]:
+                    continue # A bounce.
+                levels[side] = value
+
+                # Cancel the direction if it has timed out:
+                if self.direction is not None and ticks_diff(t, self.direction_start) > MOTION_TIMEOUT * 1000:
+                    self.direction = None
+
+                if self.direction is None:
+                    if value == MOTION_ON:
+                        self.direction, self.direction_start = side, t
+                elif levels[self.direction] == MOTION_OFF and levels[1 - self.direction] == MOTION_ON:
+                    if self.direction == RIGHT:
+                        print("Entrance!")
+                        self.transmission[ENTRANCES] += 1
+                    else:
+                        print("Exit!")
+                        self.transmission[EXITS] += 1
+                    self.direction = None
+                    self.count_changed.set()
                     await q.put(BLINK)
-                    return True
-        return False
 
     # Other Functions:
     async def blink(self, led):
@@ -382,47 +660,96 @@ class Sensor:
         await asyncio.sleep(BLINK_TIME)
         led.value(0)
 
-    def get_time(self):
+    ### Power Functions:
+    async def idle(self) -> None:
         """
-            Returns a tuple format (Day, Hours, Minutes) of 
-            the current time.
+            Light sleeps whenever the sensor is idle: no motion
+            or work is pending, and the next transmission is at
+            least {MIN_LIGHT_SLEEP} seconds away. Motion wakes 
+            it up early.
         """
-        t = localtime()
-        return (t[3], t[4])
+        while True:
+            await asyncio.sleep(IDLE_CHECK)
+            remaining = self.next_due - time()
+            if  remaining >= MIN_LIGHT_SLEEP and not self.working and \
+                self.q.empty() and self.edge_head == self.edge_tail and \
+                not self.motion_pending() and \
+                self.motion_L.value() == MOTION_OFF and \
+                self.motion_R.value() == MOTION_OFF:
+                self.light_sleep(1000 * remaining)
+
+    def light_sleep(self, ms):
+        """
+            Light sleeps for up to {ms} milliseconds, or until
+            either motion sensor is activated. Edges are not
+            seen while asleep, so the sensors' levels are fed to
+            the motion task on waking.
+        """
+        wake = Pin.WAKE_LOW if MOTION_ON == 0 else Pin.WAKE_HIGH
+        self.motion_L.irq(trigger=wake, wake=SLEEP)
+        self.motion_R.irq(trigger=wake, wake=SLEEP)
+        lightsleep(ms)
+        self.watch_motion()
+        self.push_edge(LEFT, self.motion_L.value())
+        self.push_edge(RIGHT, self.motion_R.value())
+
+    def sync_time(self, source=None) -> bool:
+        """
+            Sets the RTC to the local time from NTP, or from 
+            {source} (a function that returns the local time in
+            seconds), a stand-in for tests.
+            Returns True if succeeded, False otherwise.
+        """
+        try:
+            if source is None:
+                ntptime.host = NTP_HOST
+                seconds = ntptime.time() + UTC_OFFSET
+            else:
+                seconds = source()
+        except Exception as e:
+            print(f"The time could not be synced.\nException: {e}")
+            return False
+        t = localtime(seconds)
+        RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+        print(f"The time was synced to {t[2]:02d}/{t[1]:02d}/{t[0]} {t[3]:02d}:{t[4]:02d}.")
+        return True
+
+    def save_counters(self):
+        """
+            Keeps the entrances and exits in RTC memory, which
+            survives deep sleep.
+        """
+        RTC().memory(struct.pack(RTC_FORMAT, RTC_MAGIC, 
+                                self.transmission[ENTRANCES], self.transmission[EXITS]))
+
+    def restore_counters(self):
+        """
+            Restores the entrances and exits kept in RTC memory,
+            if waking from deep sleep.
+        """
+        if reset_cause() != DEEPSLEEP_RESET:
+            return
+        memory = RTC().memory()
+        if len(memory) == struct.calcsize(RTC_FORMAT):
+            magic, entrances, exits = struct.unpack(RTC_FORMAT, memory)
+            if magic == RTC_MAGIC:
+                self.transmission[ENTRANCES] = entrances
+                self.transmission[EXITS] = exits
 
     def is_operating_hours(self):
         """
             Returns a boolean which represents if the current
             time is within the operating hours.
         """
-        return True # Debugging only
-        # current_day = self.transmission[WEEKDAY]
-        # current_hour, current_minute = self.get_time()
-        # if  current_day in \
-        #     ["Sun", "Mon", "Tue", "Wed", "Thu"] and \
-        #     WAKEUP_TIME[0] <= current_hour <= SLEEP_TIME[0] \
-        #     and \
-        #     WAKEUP_TIME[1] <= current_minute <= SLEEP_TIME[1]:
-        #     return True
-        
-        # return False
+        return schedule.is_open(TIMETABLE, localtime())
 
     def get_sleep_time(self):
         """
             Returns the remaining sleep time (of sensor) in
-            seconds.
+            seconds, until the next opening.
         """
-        current_hour, current_minute = self.get_time()
-        opening_hour, opening_minute = WAKEUP_TIME
-        if opening_minute < current_minute:
-            opening_hour -= 1
-            opening_minute += 60
-        
-        if opening_hour < current_hour:
-            opening_hour += 24
-
-        return  (opening_hour-current_hour)*3600 + \
-                (opening_minute-current_minute+1)*60
+        seconds = schedule.seconds_until_open(TIMETABLE, localtime())
+        return seconds if seconds is not None else 24 * 3600
 
 if __name__ == '__main__':
     sensor = Sensor()
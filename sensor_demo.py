@@ -1,5 +1,6 @@
 # This code SHOULD be simulated on Micropython
 
+import protocol
 from requests import post # Should be changed to urequests on Micropython
 from time import sleep, localtime
 
@@ -8,6 +9,7 @@ PORT = 80
 SENSOR_NO = 1
 LOCATION = "Harman Science Library - Floor -1"
 SLEEP_INTERVAL = 10
+WIRE_FORMAT = "binary" # "binary" or "json", see protocol.py.
 
 if __name__ == "__main__":
     # Get data from sensors
@@ -69,9 +71,18 @@ if __name__ == "__main__":
                         "Exits": exits}
         print(data_dict)
 
+        # Encode data in the wire format (the weekday follows the
+        # date on the wire, so only the debugging hour is kept):
+        ts = protocol.wall_clock(t.tm_year, t.tm_mon, t.tm_mday, 11, t.tm_min) # debugging only
+        fields = (SENSOR_NO, LOCATION, entrances, exits, ts)
+        if WIRE_FORMAT == "json":
+            content_type, body = protocol.JSON_TYPE, protocol.encode_json(*fields)
+        else:
+            content_type, body = protocol.BINARY_TYPE, protocol.encode_binary(*fields)
+
         # Send data
         try:
-            post("http://"+SERVER_ADDR, data=str(data_dict))
+            post("http://"+SERVER_ADDR, data=body, headers={"Content-Type": content_type})
             print("Sent successfully.")
             # Make green LED light up or something            
 
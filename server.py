@@ -1,20 +1,69 @@
+import asyncio
 import logging
 import csv
+import gc
+import json
+import os
+import selectors
+import socket
+import sqlite3
 from ast import literal_eval
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from os.path import splitext
-from typing import Dict, List
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from collections import deque
+from http import HTTPStatus
+from http.client import parse_headers
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO, StringIO
+from os.path import exists
+from select import select
+from threading import Condition, Event, Lock, RLock, Thread, local
+from time import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
 from jinja2 import Template
+from static_assets import AssetStore, FileBody
+from transmission_log import TransmissionLog
+from history import DEFAULT_RESOLUTION, HistoryIndex, aggregate_samples, bucket_rows, query_range
+from load_stats import LoadStats, clock, decay, format_clock, slot_time
+from schedule import CLOSING_HOUR, DAY_MINUTES, OPENING_HOUR, SLOT_MINUTES # The load stats slots, shared with the sensors.
+from storage import CURRENT_STATE_DB, LOAD_STATS_DB, SQLITE_DB, STATE_SNAPSHOT, STORAGE_BACKEND, TRANSMISSION_FIELDS, TRANSMISSION_LOG_DB, log_columns, transmission_timestamp # The DBs, shared with the tools.
+import protocol
 
 HOST = "192.168.111.34"
 PORT = 80
 MAX_CONNECTIONS = 5
 REQ_SIZE = 1024
+MAX_BODY_SIZE = 64 * REQ_SIZE
+ACCEPT_LEGACY_PAYLOADS = True   # Accept the Python dict repr sent
+                                # by sensors from before the wire
+                                # format (see protocol.py).
+KEEP_ALIVE_TIMEOUT = 75 # In seconds, between requests on a connection.
+KEEP_ALIVE_TICK = 0.05  # In seconds, how often an idle pool 
+                        # connection checks if its worker is
+                        # needed elsewhere.
+EVENTS_PATH = "/events" # Server-Sent Events of occupancy updates.
+BATCH_PATH = "/batch" # Batches of transmissions, see protocol.py.
+EVENTS_HEARTBEAT = 15 # In seconds
+EVENTS_BACKLOG = 256 # Events kept for lagging subscribers.
+EVENTS_MAX_PENDING = 64 * 1024 # In bytes, unsent events after which
+                               # a stalled subscriber is dropped.
 HEBREW_ENCODING = "iso-8859-1" # An encoding that supports Hebrew on HTML)
-CURRENT_STATE_DB = 'current_state.csv'
-TRANSMISSION_LOG_DB = 'transmission_log.csv'
-LOAD_STATS_DB = "load_stats.csv"
+SNAPSHOT_INTERVAL = 30 # In seconds
+LOG_SEGMENT_SIZE = 64 * 1024 * 1024 # In bytes, the transmission log
+                                    # is rotated into a compressed 
+                                    # segment from this size, and 
+                                    # daily.
+LOG_FSYNC = True # Reply to a transmission only once it was synced
+                 # to disk, by a group commit.
 HOMEPAGE_FILENAME = 'webpage.html'
+SERVER_ENGINE = "legacy"    # "legacy" - http.server with 
+                            # {CONCURRENCY_MODE}, "async" - 
+                            # the asyncio engine.
+CONCURRENCY_MODE = "pool"    # "single" - one request at a time, 
+                            # "threaded" - a thread per request,
+                            # "pool" - up to {MAX_CONNECTIONS} 
+                            # worker threads.
 RESET_LOAD_STATS = False # Change to True if to reset load 
                          # stats with every rest of the server.
 LOCATION_LIST = [   "CSE Aquarium C100",
@@ -25,14 +74,28 @@ LOCATION_LIST = [   "CSE Aquarium C100",
                     "Harman Science Library - Floor 2 (Loud)",
                     "Harman Science Library - Floor -1",
                 ]
-TRANSMISSION_FIELDS = [ "S.N.",
-                        "Location",
-                        "Weekday",
-                        "Date",
-                        "Time",
-                        "Entrances",
-                        "Exits",
-                    ]
+# The webpage's gauges and charts, by library and the labels of
+# its rooms:
+LIBRARIES = [   {   'name': "Harman Science Library",
+                    'picture': "assets/herman_library.jpg",
+                    'picture_class': "circ1",
+                    'rooms': {  "Harman Science Library - Floor 2 (Loud)": "Top Floor, Main Room",
+                                "Harman Science Library - Floor 2 (Quiet)": "Top Floor, Quiet Room",
+                                "Harman Science Library - Floor -1": "Lower Floor, Main Room",
+                            }},
+                {   'name': "Mathematics and Computer Science Library",
+                    'picture': "assets/mtmtyqh.jpg",
+                    'picture_class': "circ",
+                    'rooms': {  "Einstein Institute Math Library": "Main Room (Quiet Only)",
+                            }},
+                {   'name': "Rothberg CSE Aquarium",
+                    'picture': "assets/aquarium.jpg",
+                    'picture_class': "circ1",
+                    'rooms': {  "CSE Aquarium C100": "C100",
+                                "CSE Aquarium B100": "B100",
+                                "CSE Aquarium A100": "A100",
+                            }},
+            ]
 CURRENT_STATE_DEFAULTS = [  "CSE Aquarium C100,64,90",
                             "CSE Aquarium B100,45,55",
                             "CSE Aquarium A100,19,55",
@@ -51,6 +114,9 @@ LOAD_STATS_FIELDS = [   "Location",
                         "End Time",
                         "Average",
                         "No. of Occurences",
+                        "Decayed Average",
+                        "Decayed Weight",
+                        "Last Update",
                     ]
 WEEKDAYS = [    "Sun",
                 "Mon",
@@ -58,356 +124,694 @@ WEEKDAYS = [    "Sun",
                 "Wed",
                 "Thu",
             ]
+WEEKDAY_NAMES = {   "Sun": "Sunday", # The charts' titles.
+                    "Mon": "Monday",
+                    "Tue": "Tuesday",
+                    "Wed": "Wednesday",
+                    "Thu": "Thursday",
+                }
+DECAY_HALF_LIFE = 8 * 7 # In days, the age at which a load weighs
+                        # half in the decayed load averages.
+CHART_AVERAGES = "averages" # "averages" - the webpage's charts 
+                            # show the all-time load averages,
+                            # "decayed" - the decayed ones.
+SLOTS = [(minute, min(minute + SLOT_MINUTES, CLOSING_HOUR * 60)) 
+            for minute in range(OPENING_HOUR * 60, CLOSING_HOUR * 60, SLOT_MINUTES)]
+TIME_SLOTS = [(slot_time(start), slot_time(end)) for start, end in SLOTS]
+SLOT_INDEX = {start: i for i, (start, end) in enumerate(TIME_SLOTS)}
+SLOT_LABELS = [f"{start:0>5}-{end:0>5}" for start, end in TIME_SLOTS]
+BAR_COLORS = ["#2d2d3b", "gray"]
+
+DB_LOCK = RLock() # Guards the CSV DBs from concurrent handlers.
+BOOT_ID = f"{int(time()):x}" # Keeps ETags unique across restarts.
+
+class PooledHTTPServer(HTTPServer):
+    """ An HTTP server that handles requests on a fixed pool
+        of {MAX_CONNECTIONS} worker threads. When all workers
+        are busy the accept loop waits, and new connections 
+        queue up in the listen backlog instead of spawning 
+        new threads.
+        The pool is built on a deque and a condition rather
+        than concurrent.futures, since the sensor's queue.py 
+        shadows the standard queue module in this directory."""
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers: int=MAX_CONNECTIONS) -> None:
+        super().__init__(server_address, handler_class)
+        self.max_workers = max_workers
+        self.pending = deque()
+        self.cond = Condition()
+        self.idle = max_workers
+        self.waiting = 0 # Connections waiting for a worker.
+        self.closing = False
+        self.workers = [Thread(target=self.worker, daemon=True) for _ in range(max_workers)]
+        for t in self.workers: t.start()
+
+    def process_request(self, request, client_address) -> None:
+        with self.cond:
+            # Block the accept loop while all workers are busy:
+            self.waiting += 1
+            while self.idle == 0:
+                self.cond.wait()
+            self.waiting -= 1
+            self.idle -= 1
+            self.pending.append((request, client_address))
+            self.cond.notify_all()
+
+    def worker(self) -> None:
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                request, client_address = self.pending.popleft()
+            
+            # A None request is the stop signal:
+            if request is None:
+                break
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.cond:
+                    self.idle += 1
+                    self.cond.notify_all()
+
+    def needs_workers(self) -> bool:
+        """ Returns True if idle keep-alive connections should
+            release their workers."""
+        return self.waiting > 0 or self.closing
+
+    def server_close(self) -> None:
+        self.closing = True
+        super().server_close()
+        with self.cond:
+            self.pending.extend([(None, None)] * self.max_workers)
+            self.cond.notify_all()
+        for t in self.workers: t.join()
+
+def make_server(mode: str=CONCURRENCY_MODE, host: str=HOST, port: int=PORT, handler_class: type=None) -> HTTPServer:
+    """ Recieves a concurrency mode, a host and a port and 
+        returns an HTTP server of the matching type bound to
+        the address, handling requests with hujilib_http (or
+        the given handler class)."""
+    handler_class = handler_class or hujilib_http
+    if mode == "single":
+        return HTTPServer((host, port), handler_class)
+    elif mode == "threaded":
+        return ThreadingHTTPServer((host, port), handler_class)
+    elif mode == "pool":
+        return PooledHTTPServer((host, port), handler_class)
+    raise ValueError(f"Unknown concurrency mode {mode}.")
 
 class hujilib_http(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Replies are written whole, so Nagle's algorithm would only
+    # hold a reply's last packet until the client's delayed ACK:
+    disable_nagle_algorithm = True
+
+    def handle(self) -> None:
+        """ Handles the requests of a connection for as long as
+            the client keeps it alive and a next request comes
+            within {KEEP_ALIVE_TIMEOUT} seconds."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self) -> bool:
+        """ Waits for the next request on a kept alive connection.
+            Returns False if the client closed the connection, it
+            was idle for too long, or its worker is needed for a
+            waiting connection in "pool" mode."""
+        needs_workers = getattr(self.server, 'needs_workers', lambda: False)
+        deadline = time() + KEEP_ALIVE_TIMEOUT
+        timeout = self.connection.gettimeout()
+        readable = False
+        while not needs_workers():
+            # Check the buffer without blocking, a request may 
+            # already have been read into it:
+            self.connection.setblocking(False)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            except OSError:
+                return False
+            finally:
+                self.connection.settimeout(timeout)
+            # Readable but empty means the client has disconnected:
+            if readable or time() >= deadline:
+                return False
+            readable = bool(select([self.connection], [], [], min(KEEP_ALIVE_TICK, deadline - time()))[0])
+        return False
+
+    def can_keep_alive(self) -> bool:
+        """ Returns True if the connection may be kept open after
+            the current request."""
+        # A single threaded server serves one connection at a time:
+        if not isinstance(self.server, (ThreadingHTTPServer, PooledHTTPServer)):
+            return False
+        return not getattr(self.server, 'needs_workers', lambda: False)()
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Accept-Language', 'he-IL')
-       
-        # If a specific file was requested:
-        if len(self.path[1:]): 
-            extension = splitext(self.path[1:])[1]
-            if extension == '.css':
-                self.send_header('Content-Type', 'text/css')
-                self.end_headers()
-                self.wfile.write(file_to_string(self.path[1:]))
-            elif extension == '.js':
-                self.send_header('Content-Type', 'application/javascript')
-                self.end_headers()
-                self.wfile.write(file_to_string(self.path[1:]))
-            elif extension == '.jpg':
-                self.send_header('Content-Type', 'image/jpg')
-                self.end_headers()
-                self.wfile.write(open_image(self.path[1:]))
-
-        # If no file was specified, send the mainpage html:
+        if urlsplit(self.path).path == EVENTS_PATH:
+            self.stream_events()
         else:
-            self.send_header('Content-Type', 'text/html')
-            self.end_headers()
-            self.wfile.write(file_to_string_html(HOMEPAGE_FILENAME))
+            self.send_reply(*route_GET(self.path, self.headers))
 
     def do_POST(self):
         # Get data dictionary from request and send response:
-        content_length = int(self.headers['Content-Length'])
+        try:
+            content_length = parse_content_length(self.headers)
+        except ValueError:
+            # The body cannot be told apart from the next request:
+            self.close_connection = True
+            self.send_reply(400, {}, b'')
+            return
+        if content_length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self.send_reply(413, {}, b'')
+            return
         post_data = self.rfile.read(content_length)
-        # print(post_data.decode())
+        self.send_reply(*route_POST(self.path, self.headers, post_data))
+
+    def send_reply(self, status: int, headers: Dict[str, str], body: bytes) -> None:
+        """ Sends a routed response's status line, headers and
+            body to the client."""
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        if self.close_connection or not self.can_keep_alive():
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Keep-Alive', f"timeout={KEEP_ALIVE_TIMEOUT}")
+        self.end_headers()
+        if isinstance(body, FileBody):
+            body.send(self.connection)
+        else:
+            self.wfile.write(body)
+
+    def stream_events(self) -> None:
+        """ Sends the headers of an event stream and hands the
+            connection over to the event streamer thread, so 
+            the stream does not hold this handler (or a "pool"
+            worker) for as long as the page is open."""
         self.send_response(200)
-        self.send_header('Content-Type', 'text/html')
+        for key, value in EVENTS_HEADERS.items():
+            self.send_header(key, value)
+        # The stream has no length, it ends when the connection does:
+        self.send_header('Connection', 'close')
         self.end_headers()
+        self.close_connection = True
+        last_id = EVENTS.resume_id(self.headers.get('Last-Event-ID'))
+        # Detached, the server's shutdown of the request is a no-op:
+        EVENT_STREAMER.add(socket.socket(fileno=self.connection.detach()), last_id)
 
-        # Update transmission log:
-        data_dict = literal_eval(str(post_data)[2:-1])
-        logger.info("Sensor " + str(data_dict['S.N.']) + " has transmitted.")
-        insert_to_csv(TRANSMISSION_LOG_DB, data_dict, TRANSMISSION_FIELDS, logger)
+### Routes (shared by the legacy and the asyncio engines):
+def parse_content_length(headers) -> int:
+    """ Recieves the request headers and returns the length of
+        the request's body. Raises ValueError if the 
+        Content-Length is malformed or negative."""
+    value = headers.get('Content-Length', '0').strip()
+    if not value.isdigit():
+        raise ValueError(f"Invalid Content-Length {value!r}.")
+    return int(value)
 
-        # Update current state data:
-        update_current_state(data_dict, logger)
+def route_GET(path: str, headers) -> Tuple[int, Dict[str, str], bytes]:
+    """ Recieves a request path and the request headers and 
+        returns the response as a (status, headers, body) 
+        tuple."""
+    reply_headers = {'Accept-Language': 'he-IL'}
+    path, query = urlsplit(path)[2:4]
 
-        # Update load stats:
-        update_load_stats(data_dict, logger)
+    # If the API was requested:
+    if path.startswith('/api/'):
+        return route_api(path, parse_qs(query), headers)
 
-def file_to_string(filename: str, encoder: str=HEBREW_ENCODING) -> bytes:
-    """ Recieves a filename and an encoder and returns the file 
-        as a binary stream with the requested encoding.
-        Writes to the logger if an error has occurred."""
-    try:
-        with open(filename, 'r', encoding=encoder) as f:
-            buffer = f.read()
-            return buffer.encode(encoder)
+    # If a specific file was requested:
+    if len(path[1:]): 
+        reply = ASSETS.respond(path[1:], parse_qs(query), headers, logger)
+        if reply is None:
+            return 404, reply_headers, b''
+        status, asset_headers, body = reply
+        reply_headers.update(asset_headers)
+        return status, reply_headers, body
 
-    except IOError:
-        logger.error(f"An I/O error has occurred when opening {filename}.")
-
-def file_to_string_html(html: str, encoder: str=HEBREW_ENCODING, current_state: str=CURRENT_STATE_DB, stats: str=LOAD_STATS_DB) -> bytes:
-    """ Recieves the filenames of the webpage's HTML, the 
-        current state csv file and an encoder, build the html
-        according to the current state in the studyrooms, and
-        returns the HTML as a binary stream with the 
-        requested encoding.
-        Writes to the logger if an error has occurred."""
-    
-    # Read current state DB:
-    current_state_dicts = []
-    try:
-        with open(current_state, 'r', newline='') as cs:
-            reader = csv.DictReader(cs)
-            for d in reader: current_state_dicts.append(d)
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {current_state}.")
-    
-    # Read load stats DB and make a dictionary with the averages in load percentage:
-    load_averages = {}
+    # If no file was specified, send the mainpage html:
+    reply_headers['Content-Type'] = 'text/html'
+    return 200, reply_headers, PAGE_CACHE.page(HOMEPAGE_FILENAME) or b''
+
+def route_api(path: str, query: Dict[str, List[str]], headers) -> Tuple[int, Dict[str, str], bytes]:
+    """ Recieves an API path, its parsed query and the request
+        headers and returns the current state or the load stats
+        as compact JSON:
+        /api/state - The current state of every location.
+        /api/stats?location=&weekday= - The load stats, 
+                                        optionally filtered,
+                                        with the all-time and
+                                        the decayed averages
+                                        of every time slot.
+        /api/history?location=&from=&to=&resolution= - The 
+                                        occupancy of a location
+                                        between two ISO times,
+                                        in buckets of the
+                                        resolution (in minutes,
+                                        an hour by default).
+        Replies 304 with no body if the client's copy (by ETag
+        or Last-Modified) is still up to date."""
+    # Check the client's copy before building anything:
+    version, modified = STORE.version, int(STORE.modified)
+    reply_headers = {   'Content-Type': 'application/json',
+                        'Cache-Control': 'no-cache',
+                        'ETag': f'"{BOOT_ID}-{version}"',
+                        'Last-Modified': formatdate(modified, usegmt=True)}
+    if is_not_modified(headers, reply_headers['ETag'], modified):
+        return 304, reply_headers, b''
+
+    if path == '/api/state':
+        data = [{   'location': d['Location'],
+                    'current': int(d['Current Amount']),
+                    'max': int(d['Max Amount'])}
+                for d in STORE.current_state_rows()]
+
+    elif path == '/api/stats':
+        location = query.get('location', [None])[0]
+        weekday = query.get('weekday', [None])[0]
+        if location is not None and location not in LOCATION_LIST or \
+            weekday is not None and weekday not in WEEKDAYS:
+            return 404, {'Content-Type': 'application/json'}, b'{"error":"unknown location or weekday"}'
+        data = [{   'location': d['Location'],
+                    'weekday': d['Weekday'],
+                    'start': d['Start Time'],
+                    'end': d['End Time'],
+                    'average': float(d['Average']),
+                    'occurences': int(d['No. of Occurences']),
+                    'decayed': float(d['Decayed Average'])}
+                for d in STORE.load_stats_rows()
+                if location in (None, d['Location']) and weekday in (None, d['Weekday'])]
+
+    elif path == '/api/history':
+        location = query.get('location', [None])[0]
+        if location not in LOCATION_LIST:
+            return 404, {'Content-Type': 'application/json'}, b'{"error":"unknown location"}'
+        try:
+            start = datetime.fromisoformat(query['from'][0])
+            end = datetime.fromisoformat(query['to'][0])
+            resolution = int(query.get('resolution', [DEFAULT_RESOLUTION])[0])
+            buckets = STORE.history(location, start, end, resolution, logger)
+        except (KeyError, ValueError) as e:
+            error = f"missing {e}" if isinstance(e, KeyError) else str(e)
+            return 400, {'Content-Type': 'application/json'}, json.dumps({'error': error}, separators=(',', ':')).encode()
+        except (OSError, sqlite3.Error):
+            logger.error(f"An I/O error has occurred when querying the history of {location}.")
+            return 503, {'Content-Type': 'application/json', 'Retry-After': '1'}, b'{"error":"history unavailable"}'
+        data = {'location': location, 'resolution': resolution, 'buckets': buckets}
+
+    else:
+        return 404, {'Content-Type': 'application/json'}, b'{"error":"unknown endpoint"}'
+
+    return 200, reply_headers, json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+
+def is_not_modified(headers, etag: str, modified: int) -> bool:
+    """ Recieves the request headers and the current ETag and
+        modification time of a resource, and returns True if 
+        the client's cached copy is still valid."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or \
+            etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            return modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def route_POST(path: str, headers, post_data: bytes) -> Tuple[int, Dict[str, str], bytes]:
+    """ Recieves a request path, the request headers and the 
+        body of a sensor's transmission, updates the DBs and
+        returns the response as a (status, headers, body) 
+        tuple."""
+    if urlsplit(path).path == BATCH_PATH:
+        return route_batch(headers, post_data)
     try:
-        with open(stats, 'r', newline='') as ls:
-            reader = csv.DictReader(ls)
-            for d in reader: 
-                key = d['Location'].replace(" ","").replace("-",'_').replace('(','').replace(')','')
-                key += d['Weekday']
-                key += d['Start Time'].split(':')[0]
-                value = d['Average']
-                load_averages[key] = value
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {stats}.")
+        data_dict = decode_transmission(post_data, headers.get('Content-Type', ''))
+    except ValueError as e:
+        logger.warning(f"An invalid transmission was rejected: {e}")
+        return 400, {'Content-Type': 'text/plain'}, str(e).encode()
+    logger.info("Sensor " + str(data_dict['S.N.']) + " has transmitted.")
+
+    # Log the transmission and update the current state and
+    # the load stats:
+    STORE.record(data_dict, logger)
 
-    # Read load stats DB:
-    load_stats_dicts = []
+    return 200, {'Content-Type': 'text/html'}, b''
+
+def route_batch(headers, post_data: bytes) -> Tuple[int, Dict[str, str], bytes]:
+    """ Recieves the request headers and a batch of 
+        transmissions, logs and applies the valid ones in one 
+        storage transaction, and returns a JSON acknowledgement
+        with the result of every record, in order: "ok" or the
+        reason it was rejected."""
+    content_type = headers.get('Content-Type', '')
     try:
-        with open(stats, 'r', newline='') as ls:
-            reader = csv.DictReader(ls)
-            for d in reader: load_stats_dicts.append(d)
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {stats}.")
-    
-    # Read webpage file HTML:
+        records = protocol.decode_batch(post_data, content_type)
+    except ValueError as e:
+        logger.warning(f"An invalid batch was rejected: {e}")
+        return 400, {'Content-Type': 'text/plain'}, str(e).encode()
+
+    results, transmissions = [], []
+    for record in records:
+        if isinstance(record, dict) and record['Location'] not in LOCATION_LIST:
+            record = ValueError(f"Unknown location {record['Location']}.")
+        if isinstance(record, ValueError):
+            results.append(str(record))
+        else:
+            results.append("ok")
+            transmissions.append(record)
+    STORE.record_many(transmissions, logger)
+    logger.info(f"A batch of {len(transmissions)} transmissions was recorded ({len(records) - len(transmissions)} rejected).")
+
+    body = {'accepted': len(transmissions),
+            'rejected': len(records) - len(transmissions),
+            'results': results}
+    return 200, {'Content-Type': 'application/json'}, json.dumps(body, separators=(',', ':'), ensure_ascii=False).encode()
+
+def decode_transmission(post_data: bytes, content_type: str) -> Dict:
+    """ Recieves the body of a transmission and its 
+        Content-Type, and returns the transmission dictionary.
+        Raises ValueError if it is not a valid transmission of
+        a known location."""
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type in (protocol.JSON_TYPE, protocol.BINARY_TYPE):
+        data_dict = protocol.decode(post_data, media_type)
+    elif ACCEPT_LEGACY_PAYLOADS:
+        data_dict = decode_legacy_transmission(post_data)
+    else:
+        raise ValueError(f"Unsupported Content-Type {media_type}.")
+    if data_dict['Location'] not in LOCATION_LIST:
+        raise ValueError(f"Unknown location {data_dict['Location']}.")
+    return data_dict
+
+def decode_legacy_transmission(post_data: bytes) -> Dict:
+    """ Recieves the body of a legacy transmission (a Python 
+        dict repr) and returns the transmission dictionary.
+        Raises ValueError if it is not a valid transmission of
+        a known location."""
+    if len(post_data) > REQ_SIZE:
+        raise ValueError(f"A legacy transmission must be at most {REQ_SIZE} bytes long.")
     try:
-        with open(html, 'r', encoding=encoder) as f:
-            buffer = f.read()
-            tm = Template(buffer)
-
-            # Create a new dict in which each item is {Location: *Ratio between current amount and max amount*}
-            ratio_dict = {}
-            for d in current_state_dicts:
-                ratio_dict[d['Location']] = int(d['Current Amount']) / int(d['Max Amount'])
-            sub = str(tm.render(HarmanScienceLibraryFloor2LoudP = str(int(ratio_dict["Harman Science Library - Floor 2 (Loud)"] * 100)),
-                                HarmanScienceLibraryFloor2LoudD = str(int(ratio_dict["Harman Science Library - Floor 2 (Loud)"] * 180)),
-                                HarmanScienceLibraryFloor2QuietP = str(int(ratio_dict["Harman Science Library - Floor 2 (Quiet)"] * 100)),
-                                HarmanScienceLibraryFloor2QuietD = str(int(ratio_dict["Harman Science Library - Floor 2 (Quiet)"] * 180)),
-                                HarmanScienceLibraryFloor_1P = str(int(ratio_dict["Harman Science Library - Floor -1"] * 100)),
-                                HarmanScienceLibraryFloor_1D = str(int(ratio_dict["Harman Science Library - Floor -1"] * 180)),
-                                CSEAquariumC100P = str(int(ratio_dict["CSE Aquarium C100"] * 100)),
-                                CSEAquariumC100D = str(int(ratio_dict["CSE Aquarium C100"] * 180)),
-                                CSEAquariumB100P = str(int(ratio_dict["CSE Aquarium B100"] * 100)),
-                                CSEAquariumB100D = str(int(ratio_dict["CSE Aquarium B100"] * 180)),
-                                CSEAquariumA100P = str(int(ratio_dict["CSE Aquarium A100"] * 100)),
-                                CSEAquariumA100D = str(int(ratio_dict["CSE Aquarium A100"] * 180)),
-                                EinsteinInstituteMathLibraryP = str(int(ratio_dict["Einstein Institute Math Library"] * 100)),
-                                EinsteinInstituteMathLibraryD = str(int(ratio_dict["Einstein Institute Math Library"] * 180)),
-                                CSEAquariumC100Sun8 = str(load_averages['CSEAquariumC100Sun8']),
-                                CSEAquariumC100Sun10 = str(load_averages['CSEAquariumC100Sun10']),
-                                CSEAquariumC100Sun12 = str(load_averages['CSEAquariumC100Sun12']),
-                                CSEAquariumC100Sun14 = str(load_averages['CSEAquariumC100Sun14']),
-                                CSEAquariumC100Sun16 = str(load_averages['CSEAquariumC100Sun16']),
-                                CSEAquariumC100Sun18 = str(load_averages['CSEAquariumC100Sun18']),
-                                CSEAquariumC100Mon8 = str(load_averages['CSEAquariumC100Mon8']),
-                                CSEAquariumC100Mon10 = str(load_averages['CSEAquariumC100Mon10']),
-                                CSEAquariumC100Mon12 = str(load_averages['CSEAquariumC100Mon12']),
-                                CSEAquariumC100Mon14 = str(load_averages['CSEAquariumC100Mon14']),
-                                CSEAquariumC100Mon16 = str(load_averages['CSEAquariumC100Mon16']),
-                                CSEAquariumC100Mon18 = str(load_averages['CSEAquariumC100Mon18']),
-                                CSEAquariumC100Tue8 = str(load_averages['CSEAquariumC100Tue8']),
-                                CSEAquariumC100Tue10 = str(load_averages['CSEAquariumC100Tue10']),
-                                CSEAquariumC100Tue12 = str(load_averages['CSEAquariumC100Tue12']),
-                                CSEAquariumC100Tue14 = str(load_averages['CSEAquariumC100Tue14']),
-                                CSEAquariumC100Tue16 = str(load_averages['CSEAquariumC100Tue16']),
-                                CSEAquariumC100Tue18 = str(load_averages['CSEAquariumC100Tue18']),
-                                CSEAquariumC100Wed8 = str(load_averages['CSEAquariumC100Wed8']),
-                                CSEAquariumC100Wed10 = str(load_averages['CSEAquariumC100Wed10']),
-                                CSEAquariumC100Wed12 = str(load_averages['CSEAquariumC100Wed12']),
-                                CSEAquariumC100Wed14 = str(load_averages['CSEAquariumC100Wed14']),
-                                CSEAquariumC100Wed16 = str(load_averages['CSEAquariumC100Wed16']),
-                                CSEAquariumC100Wed18 = str(load_averages['CSEAquariumC100Wed18']),
-                                CSEAquariumC100Thu8 = str(load_averages['CSEAquariumC100Thu8']),
-                                CSEAquariumC100Thu10 = str(load_averages['CSEAquariumC100Thu10']),
-                                CSEAquariumC100Thu12 = str(load_averages['CSEAquariumC100Thu12']),
-                                CSEAquariumC100Thu14 = str(load_averages['CSEAquariumC100Thu14']),
-                                CSEAquariumC100Thu16 = str(load_averages['CSEAquariumC100Thu16']),
-                                CSEAquariumC100Thu18 = str(load_averages['CSEAquariumC100Thu18']),
-                                CSEAquariumB100Sun8 = str(load_averages['CSEAquariumB100Sun8']),
-                                CSEAquariumB100Sun10 = str(load_averages['CSEAquariumB100Sun10']),
-                                CSEAquariumB100Sun12 = str(load_averages['CSEAquariumB100Sun12']),
-                                CSEAquariumB100Sun14 = str(load_averages['CSEAquariumB100Sun14']),
-                                CSEAquariumB100Sun16 = str(load_averages['CSEAquariumB100Sun16']),
-                                CSEAquariumB100Sun18 = str(load_averages['CSEAquariumB100Sun18']),
-                                CSEAquariumB100Mon8 = str(load_averages['CSEAquariumB100Mon8']),
-                                CSEAquariumB100Mon10 = str(load_averages['CSEAquariumB100Mon10']),
-                                CSEAquariumB100Mon12 = str(load_averages['CSEAquariumB100Mon12']),
-                                CSEAquariumB100Mon14 = str(load_averages['CSEAquariumB100Mon14']),
-                                CSEAquariumB100Mon16 = str(load_averages['CSEAquariumB100Mon16']),
-                                CSEAquariumB100Mon18 = str(load_averages['CSEAquariumB100Mon18']),
-                                CSEAquariumB100Tue8 = str(load_averages['CSEAquariumB100Tue8']),
-                                CSEAquariumB100Tue10 = str(load_averages['CSEAquariumB100Tue10']),
-                                CSEAquariumB100Tue12 = str(load_averages['CSEAquariumB100Tue12']),
-                                CSEAquariumB100Tue14 = str(load_averages['CSEAquariumB100Tue14']),
-                                CSEAquariumB100Tue16 = str(load_averages['CSEAquariumB100Tue16']),
-                                CSEAquariumB100Tue18 = str(load_averages['CSEAquariumB100Tue18']),
-                                CSEAquariumB100Wed8 = str(load_averages['CSEAquariumB100Wed8']),
-                                CSEAquariumB100Wed10 = str(load_averages['CSEAquariumB100Wed10']),
-                                CSEAquariumB100Wed12 = str(load_averages['CSEAquariumB100Wed12']),
-                                CSEAquariumB100Wed14 = str(load_averages['CSEAquariumB100Wed14']),
-                                CSEAquariumB100Wed16 = str(load_averages['CSEAquariumB100Wed16']),
-                                CSEAquariumB100Wed18 = str(load_averages['CSEAquariumB100Wed18']),
-                                CSEAquariumB100Thu8 = str(load_averages['CSEAquariumB100Thu8']),
-                                CSEAquariumB100Thu10 = str(load_averages['CSEAquariumB100Thu10']),
-                                CSEAquariumB100Thu12 = str(load_averages['CSEAquariumB100Thu12']),
-                                CSEAquariumB100Thu14 = str(load_averages['CSEAquariumB100Thu14']),
-                                CSEAquariumB100Thu16 = str(load_averages['CSEAquariumB100Thu16']),
-                                CSEAquariumB100Thu18 = str(load_averages['CSEAquariumB100Thu18']),
-                                CSEAquariumA100Sun8 = str(load_averages['CSEAquariumA100Sun8']),
-                                CSEAquariumA100Sun10 = str(load_averages['CSEAquariumA100Sun10']),
-                                CSEAquariumA100Sun12 = str(load_averages['CSEAquariumA100Sun12']),
-                                CSEAquariumA100Sun14 = str(load_averages['CSEAquariumA100Sun14']),
-                                CSEAquariumA100Sun16 = str(load_averages['CSEAquariumA100Sun16']),
-                                CSEAquariumA100Sun18 = str(load_averages['CSEAquariumA100Sun18']),
-                                CSEAquariumA100Mon8 = str(load_averages['CSEAquariumA100Mon8']),
-                                CSEAquariumA100Mon10 = str(load_averages['CSEAquariumA100Mon10']),
-                                CSEAquariumA100Mon12 = str(load_averages['CSEAquariumA100Mon12']),
-                                CSEAquariumA100Mon14 = str(load_averages['CSEAquariumA100Mon14']),
-                                CSEAquariumA100Mon16 = str(load_averages['CSEAquariumA100Mon16']),
-                                CSEAquariumA100Mon18 = str(load_averages['CSEAquariumA100Mon18']),
-                                CSEAquariumA100Tue8 = str(load_averages['CSEAquariumA100Tue8']),
-                                CSEAquariumA100Tue10 = str(load_averages['CSEAquariumA100Tue10']),
-                                CSEAquariumA100Tue12 = str(load_averages['CSEAquariumA100Tue12']),
-                                CSEAquariumA100Tue14 = str(load_averages['CSEAquariumA100Tue14']),
-                                CSEAquariumA100Tue16 = str(load_averages['CSEAquariumA100Tue16']),
-                                CSEAquariumA100Tue18 = str(load_averages['CSEAquariumA100Tue18']),
-                                CSEAquariumA100Wed8 = str(load_averages['CSEAquariumA100Wed8']),
-                                CSEAquariumA100Wed10 = str(load_averages['CSEAquariumA100Wed10']),
-                                CSEAquariumA100Wed12 = str(load_averages['CSEAquariumA100Wed12']),
-                                CSEAquariumA100Wed14 = str(load_averages['CSEAquariumA100Wed14']),
-                                CSEAquariumA100Wed16 = str(load_averages['CSEAquariumA100Wed16']),
-                                CSEAquariumA100Wed18 = str(load_averages['CSEAquariumA100Wed18']),
-                                CSEAquariumA100Thu8 = str(load_averages['CSEAquariumA100Thu8']),
-                                CSEAquariumA100Thu10 = str(load_averages['CSEAquariumA100Thu10']),
-                                CSEAquariumA100Thu12 = str(load_averages['CSEAquariumA100Thu12']),
-                                CSEAquariumA100Thu14 = str(load_averages['CSEAquariumA100Thu14']),
-                                CSEAquariumA100Thu16 = str(load_averages['CSEAquariumA100Thu16']),
-                                CSEAquariumA100Thu18 = str(load_averages['CSEAquariumA100Thu18']),
-                                EinsteinInstituteMathLibrarySun8 = str(load_averages['EinsteinInstituteMathLibrarySun8']),
-                                EinsteinInstituteMathLibrarySun10 = str(load_averages['EinsteinInstituteMathLibrarySun10']),
-                                EinsteinInstituteMathLibrarySun12 = str(load_averages['EinsteinInstituteMathLibrarySun12']),
-                                EinsteinInstituteMathLibrarySun14 = str(load_averages['EinsteinInstituteMathLibrarySun14']),
-                                EinsteinInstituteMathLibrarySun16 = str(load_averages['EinsteinInstituteMathLibrarySun16']),
-                                EinsteinInstituteMathLibrarySun18 = str(load_averages['EinsteinInstituteMathLibrarySun18']),
-                                EinsteinInstituteMathLibraryMon8 = str(load_averages['EinsteinInstituteMathLibraryMon8']),
-                                EinsteinInstituteMathLibraryMon10 = str(load_averages['EinsteinInstituteMathLibraryMon10']),
-                                EinsteinInstituteMathLibraryMon12 = str(load_averages['EinsteinInstituteMathLibraryMon12']),
-                                EinsteinInstituteMathLibraryMon14 = str(load_averages['EinsteinInstituteMathLibraryMon14']),
-                                EinsteinInstituteMathLibraryMon16 = str(load_averages['EinsteinInstituteMathLibraryMon16']),
-                                EinsteinInstituteMathLibraryMon18 = str(load_averages['EinsteinInstituteMathLibraryMon18']),
-                                EinsteinInstituteMathLibraryTue8 = str(load_averages['EinsteinInstituteMathLibraryTue8']),
-                                EinsteinInstituteMathLibraryTue10 = str(load_averages['EinsteinInstituteMathLibraryTue10']),
-                                EinsteinInstituteMathLibraryTue12 = str(load_averages['EinsteinInstituteMathLibraryTue12']),
-                                EinsteinInstituteMathLibraryTue14 = str(load_averages['EinsteinInstituteMathLibraryTue14']),
-                                EinsteinInstituteMathLibraryTue16 = str(load_averages['EinsteinInstituteMathLibraryTue16']),
-                                EinsteinInstituteMathLibraryTue18 = str(load_averages['EinsteinInstituteMathLibraryTue18']),
-                                EinsteinInstituteMathLibraryWed8 = str(load_averages['EinsteinInstituteMathLibraryWed8']),
-                                EinsteinInstituteMathLibraryWed10 = str(load_averages['EinsteinInstituteMathLibraryWed10']),
-                                EinsteinInstituteMathLibraryWed12 = str(load_averages['EinsteinInstituteMathLibraryWed12']),
-                                EinsteinInstituteMathLibraryWed14 = str(load_averages['EinsteinInstituteMathLibraryWed14']),
-                                EinsteinInstituteMathLibraryWed16 = str(load_averages['EinsteinInstituteMathLibraryWed16']),
-                                EinsteinInstituteMathLibraryWed18 = str(load_averages['EinsteinInstituteMathLibraryWed18']),
-                                EinsteinInstituteMathLibraryThu8 = str(load_averages['EinsteinInstituteMathLibraryThu8']),
-                                EinsteinInstituteMathLibraryThu10 = str(load_averages['EinsteinInstituteMathLibraryThu10']),
-                                EinsteinInstituteMathLibraryThu12 = str(load_averages['EinsteinInstituteMathLibraryThu12']),
-                                EinsteinInstituteMathLibraryThu14 = str(load_averages['EinsteinInstituteMathLibraryThu14']),
-                                EinsteinInstituteMathLibraryThu16 = str(load_averages['EinsteinInstituteMathLibraryThu16']),
-                                EinsteinInstituteMathLibraryThu18 = str(load_averages['EinsteinInstituteMathLibraryThu18']),
-                                HarmanScienceLibrary_Floor2QuietSun8 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun8']),
-                                HarmanScienceLibrary_Floor2QuietSun10 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun10']),
-                                HarmanScienceLibrary_Floor2QuietSun12 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun12']),
-                                HarmanScienceLibrary_Floor2QuietSun14 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun14']),
-                                HarmanScienceLibrary_Floor2QuietSun16 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun16']),
-                                HarmanScienceLibrary_Floor2QuietSun18 = str(load_averages['HarmanScienceLibrary_Floor2QuietSun18']),
-                                HarmanScienceLibrary_Floor2QuietMon8 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon8']),
-                                HarmanScienceLibrary_Floor2QuietMon10 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon10']),
-                                HarmanScienceLibrary_Floor2QuietMon12 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon12']),
-                                HarmanScienceLibrary_Floor2QuietMon14 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon14']),
-                                HarmanScienceLibrary_Floor2QuietMon16 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon16']),
-                                HarmanScienceLibrary_Floor2QuietMon18 = str(load_averages['HarmanScienceLibrary_Floor2QuietMon18']),
-                                HarmanScienceLibrary_Floor2QuietTue8 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue8']),
-                                HarmanScienceLibrary_Floor2QuietTue10 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue10']),
-                                HarmanScienceLibrary_Floor2QuietTue12 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue12']),
-                                HarmanScienceLibrary_Floor2QuietTue14 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue14']),
-                                HarmanScienceLibrary_Floor2QuietTue16 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue16']),
-                                HarmanScienceLibrary_Floor2QuietTue18 = str(load_averages['HarmanScienceLibrary_Floor2QuietTue18']),
-                                HarmanScienceLibrary_Floor2QuietWed8 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed8']),
-                                HarmanScienceLibrary_Floor2QuietWed10 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed10']),
-                                HarmanScienceLibrary_Floor2QuietWed12 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed12']),
-                                HarmanScienceLibrary_Floor2QuietWed14 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed14']),
-                                HarmanScienceLibrary_Floor2QuietWed16 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed16']),
-                                HarmanScienceLibrary_Floor2QuietWed18 = str(load_averages['HarmanScienceLibrary_Floor2QuietWed18']),
-                                HarmanScienceLibrary_Floor2QuietThu8 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu8']),
-                                HarmanScienceLibrary_Floor2QuietThu10 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu10']),
-                                HarmanScienceLibrary_Floor2QuietThu12 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu12']),
-                                HarmanScienceLibrary_Floor2QuietThu14 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu14']),
-                                HarmanScienceLibrary_Floor2QuietThu16 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu16']),
-                                HarmanScienceLibrary_Floor2QuietThu18 = str(load_averages['HarmanScienceLibrary_Floor2QuietThu18']),
-                                HarmanScienceLibrary_Floor2LoudSun8 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun8']),
-                                HarmanScienceLibrary_Floor2LoudSun10 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun10']),
-                                HarmanScienceLibrary_Floor2LoudSun12 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun12']),
-                                HarmanScienceLibrary_Floor2LoudSun14 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun14']),
-                                HarmanScienceLibrary_Floor2LoudSun16 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun16']),
-                                HarmanScienceLibrary_Floor2LoudSun18 = str(load_averages['HarmanScienceLibrary_Floor2LoudSun18']),
-                                HarmanScienceLibrary_Floor2LoudMon8 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon8']),
-                                HarmanScienceLibrary_Floor2LoudMon10 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon10']),
-                                HarmanScienceLibrary_Floor2LoudMon12 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon12']),
-                                HarmanScienceLibrary_Floor2LoudMon14 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon14']),
-                                HarmanScienceLibrary_Floor2LoudMon16 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon16']),
-                                HarmanScienceLibrary_Floor2LoudMon18 = str(load_averages['HarmanScienceLibrary_Floor2LoudMon18']),
-                                HarmanScienceLibrary_Floor2LoudTue8 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue8']),
-                                HarmanScienceLibrary_Floor2LoudTue10 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue10']),
-                                HarmanScienceLibrary_Floor2LoudTue12 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue12']),
-                                HarmanScienceLibrary_Floor2LoudTue14 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue14']),
-                                HarmanScienceLibrary_Floor2LoudTue16 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue16']),
-                                HarmanScienceLibrary_Floor2LoudTue18 = str(load_averages['HarmanScienceLibrary_Floor2LoudTue18']),
-                                HarmanScienceLibrary_Floor2LoudWed8 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed8']),
-                                HarmanScienceLibrary_Floor2LoudWed10 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed10']),
-                                HarmanScienceLibrary_Floor2LoudWed12 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed12']),
-                                HarmanScienceLibrary_Floor2LoudWed14 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed14']),
-                                HarmanScienceLibrary_Floor2LoudWed16 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed16']),
-                                HarmanScienceLibrary_Floor2LoudWed18 = str(load_averages['HarmanScienceLibrary_Floor2LoudWed18']),
-                                HarmanScienceLibrary_Floor2LoudThu8 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu8']),
-                                HarmanScienceLibrary_Floor2LoudThu10 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu10']),
-                                HarmanScienceLibrary_Floor2LoudThu12 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu12']),
-                                HarmanScienceLibrary_Floor2LoudThu14 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu14']),
-                                HarmanScienceLibrary_Floor2LoudThu16 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu16']),
-                                HarmanScienceLibrary_Floor2LoudThu18 = str(load_averages['HarmanScienceLibrary_Floor2LoudThu18']),
-                                HarmanScienceLibrary_Floor_1Sun8 = str(load_averages['HarmanScienceLibrary_Floor_1Sun8']),
-                                HarmanScienceLibrary_Floor_1Sun10 = str(load_averages['HarmanScienceLibrary_Floor_1Sun10']),
-                                HarmanScienceLibrary_Floor_1Sun12 = str(load_averages['HarmanScienceLibrary_Floor_1Sun12']),
-                                HarmanScienceLibrary_Floor_1Sun14 = str(load_averages['HarmanScienceLibrary_Floor_1Sun14']),
-                                HarmanScienceLibrary_Floor_1Sun16 = str(load_averages['HarmanScienceLibrary_Floor_1Sun16']),
-                                HarmanScienceLibrary_Floor_1Sun18 = str(load_averages['HarmanScienceLibrary_Floor_1Sun18']),
-                                HarmanScienceLibrary_Floor_1Mon8 = str(load_averages['HarmanScienceLibrary_Floor_1Mon8']),
-                                HarmanScienceLibrary_Floor_1Mon10 = str(load_averages['HarmanScienceLibrary_Floor_1Mon10']),
-                                HarmanScienceLibrary_Floor_1Mon12 = str(load_averages['HarmanScienceLibrary_Floor_1Mon12']),
-                                HarmanScienceLibrary_Floor_1Mon14 = str(load_averages['HarmanScienceLibrary_Floor_1Mon14']),
-                                HarmanScienceLibrary_Floor_1Mon16 = str(load_averages['HarmanScienceLibrary_Floor_1Mon16']),
-                                HarmanScienceLibrary_Floor_1Mon18 = str(load_averages['HarmanScienceLibrary_Floor_1Mon18']),
-                                HarmanScienceLibrary_Floor_1Tue8 = str(load_averages['HarmanScienceLibrary_Floor_1Tue8']),
-                                HarmanScienceLibrary_Floor_1Tue10 = str(load_averages['HarmanScienceLibrary_Floor_1Tue10']),
-                                HarmanScienceLibrary_Floor_1Tue12 = str(load_averages['HarmanScienceLibrary_Floor_1Tue12']),
-                                HarmanScienceLibrary_Floor_1Tue14 = str(load_averages['HarmanScienceLibrary_Floor_1Tue14']),
-                                HarmanScienceLibrary_Floor_1Tue16 = str(load_averages['HarmanScienceLibrary_Floor_1Tue16']),
-                                HarmanScienceLibrary_Floor_1Tue18 = str(load_averages['HarmanScienceLibrary_Floor_1Tue18']),
-                                HarmanScienceLibrary_Floor_1Wed8 = str(load_averages['HarmanScienceLibrary_Floor_1Wed8']),
-                                HarmanScienceLibrary_Floor_1Wed10 = str(load_averages['HarmanScienceLibrary_Floor_1Wed10']),
-                                HarmanScienceLibrary_Floor_1Wed12 = str(load_averages['HarmanScienceLibrary_Floor_1Wed12']),
-                                HarmanScienceLibrary_Floor_1Wed14 = str(load_averages['HarmanScienceLibrary_Floor_1Wed14']),
-                                HarmanScienceLibrary_Floor_1Wed16 = str(load_averages['HarmanScienceLibrary_Floor_1Wed16']),
-                                HarmanScienceLibrary_Floor_1Wed18 = str(load_averages['HarmanScienceLibrary_Floor_1Wed18']),
-                                HarmanScienceLibrary_Floor_1Thu8 = str(load_averages['HarmanScienceLibrary_Floor_1Thu8']),
-                                HarmanScienceLibrary_Floor_1Thu10 = str(load_averages['HarmanScienceLibrary_Floor_1Thu10']),
-                                HarmanScienceLibrary_Floor_1Thu12 = str(load_averages['HarmanScienceLibrary_Floor_1Thu12']),
-                                HarmanScienceLibrary_Floor_1Thu14 = str(load_averages['HarmanScienceLibrary_Floor_1Thu14']),
-                                HarmanScienceLibrary_Floor_1Thu16 = str(load_averages['HarmanScienceLibrary_Floor_1Thu16']),
-                                HarmanScienceLibrary_Floor_1Thu18 = str(load_averages['HarmanScienceLibrary_Floor_1Thu18']),
-                                )
-                    )
-            return sub.encode(encoder)
-    except IOError:
-        logger.error(f"An I/O error has occurred when opening {html}.")
+        data_dict = literal_eval(post_data.decode('utf-8'))
+    except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+        raise ValueError("A legacy transmission must be a dict literal.")
+    if not isinstance(data_dict, dict) or any(field not in data_dict for field in TRANSMISSION_FIELDS):
+        raise ValueError(f"A legacy transmission must have the fields {', '.join(TRANSMISSION_FIELDS)}.")
+    for field in ['S.N.', 'Entrances', 'Exits']:
+        if type(data_dict[field]) is not int or data_dict[field] < 0:
+            raise ValueError(f"The field {field} must be a non-negative integer.")
+    for field in ['Location', 'Weekday', 'Date', 'Time']:
+        if type(data_dict[field]) is not str:
+            raise ValueError(f"The field {field} must be a string.")
+    if data_dict['Weekday'] not in WEEKDAYS:
+        raise ValueError(f"The field Weekday must be one of {', '.join(WEEKDAYS)}.")
+    if data_dict['Location'] not in LOCATION_LIST:
+        raise ValueError(f"Unknown location {data_dict['Location']}.")
+    transmission_timestamp(data_dict) # Raises ValueError on a bad date or time.
+    return {field: data_dict[field] for field in TRANSMISSION_FIELDS}
+
+### Asyncio Engine:
+class WorkerPool:
+    """ A fixed pool of daemon threads that runs blocking calls
+        (file reads and CSV writes) for the asyncio engine, and
+        hands each result back to the calling event loop."""
+
+    def __init__(self, workers: int=MAX_CONNECTIONS) -> None:
+        self.pending = deque()
+        self.cond = Condition()
+        for _ in range(workers):
+            Thread(target=self.worker, daemon=True).start()
+
+    def run(self, func, *args) -> asyncio.Future:
+        """ Schedules func(*args) on the pool and returns an
+            awaitable future of its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.cond:
+            self.pending.append((loop, future, func, args))
+            self.cond.notify()
+        return future
+
+    def worker(self) -> None:
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                loop, future, func, args = self.pending.popleft()
+            try:
+                result = func(*args)
+                loop.call_soon_threadsafe(resolve_future, future, result, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(resolve_future, future, None, e)
+
+def resolve_future(future: asyncio.Future, result, error: Exception) -> None:
+    """ Sets a future's result or exception, unless the 
+        awaiting connection has already gone away."""
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+async def serve_async(host: str=HOST, port: int=PORT) -> None:
+    """ Runs the asyncio engine on the given address until 
+        cancelled. Every connection is a coroutine, so idle
+        keep-alive connections cost no threads."""
+    pool = WorkerPool()
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await handle_async_connection(reader, writer, pool)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.error(f"The asyncio engine failed handling a connection.\nException: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connection, host, port, limit=REQ_SIZE * 8)
+    async with server:
+        await server.serve_forever()
+
+async def handle_async_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pool: WorkerPool) -> None:
+    """ Serves the HTTP requests of a single connection, 
+        keeping it open between requests as long as the
+        client allows it."""
+    while True:
+        # Wait for the request line of the next request:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+        except asyncio.IncompleteReadError:
+            return # The client closed the connection.
+        request_line, _, raw_headers = head.partition(b'\r\n')
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await write_async_reply(writer, 400, {}, b'', False)
+            return
+        headers = parse_headers(BytesIO(raw_headers))
+
+        # Read the body, if any:
+        try:
+            content_length = parse_content_length(headers)
+        except ValueError:
+            await write_async_reply(writer, 400, {}, b'', False)
+            return
+        if content_length > MAX_BODY_SIZE:
+            await write_async_reply(writer, 413, {}, b'', False)
+            return
+        post_data = await reader.readexactly(content_length) if content_length else b''
+
+        # Decide if the connection stays open after the reply:
+        connection = headers.get('Connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        # Route the request, offloading blocking I/O to the pool:
+        if method == 'GET' and urlsplit(path).path == EVENTS_PATH:
+            await stream_async_events(writer, headers)
+            return
+        elif method == 'GET':
+            reply = await pool.run(route_GET, path, headers)
+        elif method == 'POST':
+            reply = await pool.run(route_POST, path, headers, post_data)
+        else:
+            reply = (501, {}, b'')
+        await write_async_reply(writer, *reply, keep_alive)
+        if not keep_alive:
+            return
 
-def open_image(filename: str) -> bytes:
-    """ Recieves an image filename and an encoder and returns
-        the image as a binary stream with the requested 
-        encoding. 
+async def stream_async_events(writer: asyncio.StreamWriter, headers) -> None:
+    """ Streams occupancy updates to an asyncio engine client 
+        until it disconnects."""
+    lines = ["HTTP/1.1 200 OK"] + [f"{key}: {value}" for key, value in EVENTS_HEADERS.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\nretry: 5000\n\n").encode('latin-1'))
+    await writer.drain()
+    last_id = EVENTS.resume_id(headers.get('Last-Event-ID'))
+    while not writer.is_closing():
+        events, last_id = await EVENTS.wait_async(last_id, EVENTS_HEARTBEAT)
+        writer.write(b''.join(events) or b': heartbeat\n\n')
+        await writer.drain()
+
+async def write_async_reply(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str], body: bytes, keep_alive: bool) -> None:
+    """ Writes a routed response to the connection's 
+        stream."""
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{key}: {value}" for key, value in headers.items()]
+    if status != 304:
+        lines.append(f"Content-Length: {len(body)}")
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    if isinstance(body, FileBody):
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+        with open(body.path, 'rb') as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f, body.offset, body.length)
+    else:
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+def file_to_string_html(html: str, encoder: str=HEBREW_ENCODING, store: "StateStore"=None) -> bytes:
+    """ Recieves the filename of the webpage's HTML, an encoder
+        and the state store (the server's store by default),
+        build the html according to the current state in the
+        studyrooms, and returns the HTML as a binary stream 
+        with the requested encoding.
         Writes to the logger if an error has occurred."""
-    try:
-        with open(filename, 'rb') as img:
-            return img.read()
-    except IOError:
-        logger.error(f"An I/O error has occurred when opening {filename}.")
+    # Get the compiled webpage template:
+    tm = PAGE_CACHE.template(html, encoder)
+    if tm is None:
+        return None
+
+    return tm.render(template_context(store or STORE)).encode(encoder)
+
+def template_context(store: "StateStore") -> Dict:
+    """ Recieves the state store and returns the webpage's 
+        template context:
+        rooms - {Location: {'location': Location,
+                            'percent': Load percentage,
+                            'degrees': Gauge rotation,
+                            'averages': {Weekday: [Average per time slot]},
+                            'decayed': {Weekday: [Decayed average per time slot]}}}
+        libraries - [{'name': Library name,
+                      'picture': Picture path,
+                      'picture_class': Picture class,
+                      'rooms': [{'label': Room label,
+                                 'number': Room number on the
+                                           webpage, from 1,
+                                 **The room's rooms entry}]}]
+        weekdays - [(Weekday, Weekday name)] of the charts.
+        chart_averages - The rooms' key of the averages that the
+                         charts show ({CHART_AVERAGES}).
+        asset - Returns the fingerprinted URL of a static 
+                asset.
+        srcset - Returns the srcset of an image's built 
+                 variants of a content type.
+        slot_labels - The time slots' chart labels.
+        bar_colors - The time slots' chart colors.
+        Locations and slots missing from the DBs are shown as
+        empty."""
+    rooms = {}
+    for location in LOCATION_LIST:
+        rooms[location] = { 'location': location,
+                            'percent': 0,
+                            'degrees': 0,
+                            'averages': {day: ['0'] * len(TIME_SLOTS) for day in WEEKDAYS},
+                            'decayed': {day: ['0'] * len(TIME_SLOTS) for day in WEEKDAYS}}
+
+    # Add the ratio between current amount and max amount:
+    for d in store.current_state_rows():
+        room = rooms.get(d['Location'])
+        if room is not None:
+            event = room_event(d['Location'], int(d['Current Amount']), int(d['Max Amount']))
+            room['percent'], room['degrees'] = event['percent'], event['degrees']
+
+    # Add the load averages in load percentage:
+    for d in store.load_stats_rows():
+        room = rooms.get(d['Location'])
+        slot = SLOT_INDEX.get(d['Start Time'])
+        if room is not None and slot is not None and d['Weekday'] in room['averages']:
+            room['averages'][d['Weekday']][slot] = d['Average']
+            room['decayed'][d['Weekday']][slot] = d['Decayed Average']
+
+    libraries, number = [], 0
+    for library in LIBRARIES:
+        libraries.append(dict(library, rooms=[]))
+        for location, label in library['rooms'].items():
+            number += 1
+            libraries[-1]['rooms'].append(dict(rooms[location], label=label, number=number))
+
+    return {'rooms': rooms,
+            'libraries': libraries,
+            'weekdays': [(day, WEEKDAY_NAMES[day]) for day in WEEKDAYS],
+            'chart_averages': CHART_AVERAGES,
+            'asset': ASSETS.url,
+            'srcset': ASSETS.srcset,
+            'slot_labels': SLOT_LABELS,
+            'bar_colors': [BAR_COLORS[i % len(BAR_COLORS)] for i in range(len(TIME_SLOTS))]}
+
+class PageCache:
+    """ Caches the compiled webpage templates for the life of 
+        the process, reloading a template only when its file's
+        mtime changes, and caches the rendered pages until the
+        state store's version changes (i.e. a POST has changed
+        the state) or the template was reloaded."""
+
+    def __init__(self) -> None:
+        self.templates = {} # {(Filename, Encoder): (mtime, Template)}
+        self.pages = {}     # {(Filename, Encoder): (mtime, State version, Page)}
+        self.lock = Lock()
+
+    def template(self, html: str, encoder: str=HEBREW_ENCODING) -> Template:
+        """ Returns the compiled template of an HTML file, or 
+            None if it could not be read.
+            Writes to the logger if an error has occurred."""
+        try:
+            mtime = os.stat(html).st_mtime_ns
+            cached = self.templates.get((html, encoder))
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(html, 'r', encoding=encoder) as f:
+                tm = Template(f.read())
+        except IOError:
+            logger.error(f"An I/O error has occurred when opening {html}.")
+            return None
+        self.templates[(html, encoder)] = (mtime, tm)
+        return tm
+
+    def page(self, html: str, encoder: str=HEBREW_ENCODING, store: "StateStore"=None) -> bytes:
+        """ Returns the rendered page of an HTML file, rendering
+            it only if the state or the file has changed since
+            it was last rendered."""
+        store = store or STORE
+        with self.lock: # Concurrent misses render the page once.
+            version = store.version
+            try:
+                mtime = os.stat(html).st_mtime_ns
+            except IOError:
+                mtime = None
+            cached = self.pages.get((html, encoder))
+            if cached is not None and cached[:2] == (mtime, version):
+                return cached[2]
+            page = file_to_string_html(html, encoder, store)
+            if page is not None:
+                self.pages[(html, encoder)] = (mtime, version, page)
+            return page
 
 def create_csv(filename: str, headers: str, logger: logging.Logger) -> None:
     """ Receives a filename and headers and creates a csv 
@@ -419,107 +823,775 @@ def create_csv(filename: str, headers: str, logger: logging.Logger) -> None:
     except IOError:
         logger.error(f"An I/O error has occurred when writing to {filename}.")
 
-def insert_to_csv(filename: str, data_dict: Dict, fields: List[str], logger: logging.Logger) -> None:
-    """ Recieves the filename of a csv file, a dictionary, a 
-        list of fields and a logger, and appends the 
-        corresponding values of the csv fields in a new row 
-        in the csv file.
-        Writes to the logger if an error has occurred.
+def create_dbs(logger: logging.Logger, reset_load_stats: bool=False) -> None:
+    """ Creates the CSV DBs that are missing, with every 
+        location's default state and empty load stats."""
+    if not exists(TRANSMISSION_LOG_DB):
+        create_csv(TRANSMISSION_LOG_DB, TRANSMISSION_FIELDS, logger)
+
+    if reset_load_stats or not exists(LOAD_STATS_DB):
+        # The snapshot holds the old stats, drop it:
+        if exists(STATE_SNAPSHOT):
+            os.remove(STATE_SNAPSHOT)
+        try:
+            write_csv_atomic(LOAD_STATS_DB, [format_stats_row(d) for d in make_load_stats().rows()], LOAD_STATS_FIELDS)
+        except IOError:
+            logger.error(f"An I/O error has occurred when writing to {LOAD_STATS_DB}.")
+
+    if not exists(CURRENT_STATE_DB):
+        create_csv(CURRENT_STATE_DB, CURRENT_STATE_FIELDS, logger)
+        try:
+            with open(CURRENT_STATE_DB, 'a') as f:
+                for line in CURRENT_STATE_DEFAULTS:
+                    f.write(line + '\n')
+        except IOError:
+            logger.error(f"An I/O error has occurred when writing to {CURRENT_STATE_DB}.")
+
+### Server-Sent Events:
+EVENTS_HEADERS = {  'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'}
+
+class EventHub:
+    """ Fans out occupancy updates to Server-Sent Events 
+        subscribers. Every event is encoded once into a shared
+        backlog that subscribers read by event id, so a publish
+        costs the same for any number of subscribers, and 
+        nothing is read from the DBs per subscriber."""
+
+    def __init__(self, backlog: int=EVENTS_BACKLOG) -> None:
+        self.events = deque(maxlen=backlog) # [(Event id, Encoded event)]
+        self.last_id = 0
+        self.cond = Condition()
+        self.loops = {} # {Event loop: asyncio.Event of its subscribers}
+        self.wakers = [] # Called on every publish, e.g. by EventStreamer.
+
+    def publish(self, data: Dict) -> None:
+        """ Sends an event with the given data to all 
+            subscribers."""
+        with self.cond:
+            self.last_id += 1
+            self.events.append((self.last_id, f"id: {self.last_id}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()))
+            loops = list(self.loops)
+        for wake in self.wakers:
+            wake()
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self.wake_loop, loop)
+            except RuntimeError: # The loop was closed.
+                with self.cond:
+                    self.loops.pop(loop, None)
+
+    def resume_id(self, last_event_id: str) -> int:
+        """ Returns the event id a new subscriber should start 
+            after, given its Last-Event-ID header (if any)."""
+        try:
+            last_id = int(last_event_id)
+        except (TypeError, ValueError):
+            return self.last_id
+        # Ids from before a restart are meaningless:
+        return last_id if 0 <= last_id <= self.last_id else self.last_id
+
+    def since(self, last_id: int) -> Tuple[List[bytes], int]:
+        """ Returns the encoded events after the given id and 
+            the id of the latest event."""
+        with self.cond:
+            return [event for i, event in self.events if i > last_id], self.last_id
+
+    async def wait_async(self, last_id: int, timeout: float) -> Tuple[List[bytes], int]:
+        """ Awaits events after the given id, or the timeout."""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            if self.last_id != last_id:
+                return self.since(last_id)
+            event = self.loops.get(loop)
+            if event is None:
+                event = self.loops[loop] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.since(last_id)
+
+    def wake_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Wakes the subscribers waiting on an event loop. Runs
+            on that loop."""
+        with self.cond:
+            event = self.loops.pop(loop, None)
+        if event is not None:
+            event.set()
+
+class EventStreamer:
+    """ Streams the Server-Sent Events of the legacy engine from
+        a single thread: a selector loop writes every 
+        subscriber's events as its socket can take them, and 
+        drops subscribers that disconnect or fall more than 
+        {EVENTS_MAX_PENDING} bytes behind."""
+
+    def __init__(self, hub: EventHub) -> None:
+        self.hub = hub
+        self.lock = Lock()
+        self.added = [] # [(Socket, Event id)] of new subscribers.
+        self.thread = None
+        self.waker, self.wakeup = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup.setblocking(False)
+        hub.wakers.append(self.wake)
+
+    def add(self, sock: socket.socket, last_id: int) -> None:
+        """ Streams the events after the given id to a connection
+            whose response headers were sent."""
+        sock.setblocking(False)
+        with self.lock:
+            self.added.append((sock, last_id))
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake()
+
+    def wake(self) -> None:
+        try:
+            self.waker.send(b'\0')
+        except OSError: # A wakeup is already pending.
+            pass
+
+    def run(self) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup, selectors.EVENT_READ)
+        subscribers = {} # {Socket: [Event id, Unsent bytes, Last write time]}
+
+        def drop(sock: socket.socket) -> None:
+            selector.unregister(sock)
+            sock.close()
+            del subscribers[sock]
+
+        while True:
+            with self.lock:
+                added, self.added = self.added, []
+            for sock, last_id in added:
+                subscribers[sock] = [last_id, b'retry: 5000\n\n', 0]
+                selector.register(sock, selectors.EVENT_READ)
+
+            # Write what every subscriber's socket can take:
+            now = time()
+            for sock, subscriber in list(subscribers.items()):
+                events, subscriber[0] = self.hub.since(subscriber[0])
+                subscriber[1] += b''.join(events)
+                if not subscriber[1] and now - subscriber[2] >= EVENTS_HEARTBEAT:
+                    subscriber[1] = b': heartbeat\n\n'
+                try:
+                    if subscriber[1]:
+                        subscriber[1] = subscriber[1][sock.send(subscriber[1]):]
+                        subscriber[2] = now
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    drop(sock)
+                    continue
+                if len(subscriber[1]) > EVENTS_MAX_PENDING:
+                    drop(sock)
+                    continue
+                selector.modify(sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber[1] else 0))
+
+            # Wait for a publish, a writable socket, a disconnect 
+            # or the next heartbeat:
+            timeout = min((subscriber[2] + EVENTS_HEARTBEAT - now for subscriber in subscribers.values()), default=None)
+            for key, mask in selector.select(None if timeout is None else max(timeout, 0)):
+                if key.fileobj is self.wakeup:
+                    try:
+                        while self.wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif mask & selectors.EVENT_READ:
+                    # Clients send nothing on a stream, but for closing it:
+                    try:
+                        closed = not key.fileobj.recv(4096)
+                    except BlockingIOError:
+                        closed = False
+                    except OSError:
+                        closed = True
+                    if closed:
+                        drop(key.fileobj)
+
+def room_event(location: str, current_amount: int, max_amount: int) -> Dict:
+    """ Returns the occupancy update event of a location."""
+    ratio = current_amount / max_amount
+    return {'location': location,
+            'current': current_amount,
+            'max': max_amount,
+            'percent': int(ratio * 100),
+            'degrees': int(ratio * 180)}
+
+class StateStore:
+    """ Holds the current state and the load stats in memory as
+        the server's source of truth. Every transmission is an
+        O(1) dictionary update, and the DBs are written behind
+        by periodic, atomic snapshots (temp file + rename).
+        After a crash, the state is recovered from the last 
+        snapshot plus the transmissions logged after it."""
+
+    def __init__(self, current_state_db: str=CURRENT_STATE_DB, stats_db: str=LOAD_STATS_DB, log_db: str=TRANSMISSION_LOG_DB, snapshot: str=STATE_SNAPSHOT) -> None:
+        self.current_state_db = current_state_db
+        self.stats_db = stats_db
+        self.log_db = log_db
+        self.log = TransmissionLog(log_db, TRANSMISSION_FIELDS, LOG_SEGMENT_SIZE, LOG_FSYNC)
+        self.snapshot_file = snapshot
+        self.lock = DB_LOCK
+        self.current_state = {} # {Location: {Field: Value}}
+        self.load_stats = make_load_stats()
+        self.history_index = HistoryIndex(self.log)
+        self.version = 0        # Bumped on every state change.
+        self.modified = time()  # The time of the last change.
+        self.snapshot_version = 0
+        self.stop_event = Event()
+
+    def touch(self) -> None:
+        """ Marks the state as changed."""
+        self.version += 1
+        self.modified = time()
+
+    ### Loading:
+    def load(self, logger: logging.Logger) -> None:
+        """ Loads the state from the last snapshot and replays
+            the transmissions logged after it, and opens the log.
+            Falls back to the CSV DBs if there is no snapshot."""
+        with self.lock:
+            self.log.open(logger)
+            position = None
+            if exists(self.snapshot_file):
+                try:
+                    with open(self.snapshot_file, 'r') as f:
+                        snapshot = json.load(f)
+                    unmatched = self.set_rows(snapshot['current_state'], snapshot['load_stats'])
+                    # Snapshots from before the log was rotated are of the active file:
+                    position = (snapshot.get('log_segment', self.log.number), snapshot['log_offset'])
+                except (IOError, ValueError, KeyError):
+                    logger.error(f"The snapshot {self.snapshot_file} is corrupted, loading the DBs instead.")
+            if position is None:
+                unmatched = self.set_rows(read_csv(self.current_state_db, logger), read_csv(self.stats_db, logger))
+                position = self.log.position()
+            replayed = self.replay(position, logger)
+            if unmatched:
+                # E.g. {SLOT_MINUTES} has changed:
+                logger.warning(f"{unmatched} load stats rows do not match the locations, weekdays and time slots, recomputing the load stats from the log.")
+                self.recompute_stats(logger)
+            self.snapshot_version = 0 if replayed or unmatched else self.version
+        logger.info(f"The state was loaded, {replayed} logged transmissions were replayed.")
+        self.history_index.refresh(logger)
+        logger.info("The transmission log was indexed.")
+
+    def set_rows(self, current_state_dicts: List[Dict], load_stats_dicts: List[Dict]) -> int:
+        """ Replaces the store's content with the given DB 
+            rows. Returns how many load stats rows did not 
+            match any time slot."""
+        self.current_state = {}
+        for d in current_state_dicts:
+            self.current_state[d['Location']] = {   'Location': d['Location'],
+                                                    'Current Amount': int(d['Current Amount']),
+                                                    'Max Amount': int(d['Max Amount'])}
+        unmatched = self.load_stats.set_rows(load_stats_dicts)
+        self.touch()
+        return unmatched
+
+    def replay(self, position: Tuple[int, int], logger: logging.Logger) -> int:
+        """ Applies the transmissions logged after the given
+            position of the log. Returns how many were 
+            applied."""
+        number, offset = position
+        if number == self.log.number and offset > self.log.position()[1]:
+            logger.warning(f"{self.log_db} is shorter than the last snapshot, skipping replay.")
+            return 0
+        replayed = 0
+        for row in self.log.read(position):
+            self.apply(dict(zip(TRANSMISSION_FIELDS, row)), logger)
+            replayed += 1
+        return replayed
+
+    ### Updating:
+    def record(self, transmission: Dict, logger: logging.Logger) -> None:
+        """ Appends a transmission to the log and applies it to
+            the state. Returns once it is on disk."""
+        self.record_many([transmission], logger)
+
+    def record_many(self, transmissions: List[Dict], logger: logging.Logger) -> None:
+        """ Appends transmissions to the log with a single write
+            and applies them to the state, in order. Returns once
+            they are on disk."""
+        with self.lock:
+            ticket = self.log.append(transmissions, logger)
+            for transmission in transmissions:
+                self.apply(transmission, logger)
+        # Other handlers may log meanwhile, and share the fsync:
+        self.log.commit(ticket, logger)
+
+    def apply(self, transmission: Dict, logger: logging.Logger) -> bool:
+        """ Updates the current state and the load stats 
+            according to a transmission. Returns True if the 
+            state has changed."""
+        with self.lock:
+            # Update current state data:
+            location = self.current_state.get(transmission['Location'])
+            if location is None:
+                logger.error(f"Current state DB could not be updated according to sensor {transmission['S.N.']}'s data, because the location name {transmission['Location']} could not be found in {self.current_state_db}.")
+                return False
+            amount = int(transmission['Entrances']) - int(transmission['Exits'])
+            if amount != location['Current Amount']:
+                location['Current Amount'] = amount
+                EVENTS.publish(room_event(location['Location'], amount, location['Max Amount']))
+            self.touch()
+
+            # Update load stats:
+            load = location['Current Amount'] / location['Max Amount'] * 100
+            if not self.load_stats.add(transmission['Location'], transmission['Weekday'], transmission['Date'], transmission['Time'], load):
+                logger.error(f"The transmission of sensor {transmission['S.N.']} does not belong to the load stats DB.")
+            return True
+
+    def recompute_stats(self, logger: logging.Logger) -> int:
+        """ Replaces the load stats with those recomputed from 
+            the whole transmission log, e.g. after the log was 
+            fixed. Returns how many transmissions were 
+            counted."""
+        columns = read_log_columns(self.log, logger)
+        with self.lock:
+            max_amounts = {location: d['Max Amount'] for location, d in self.current_state.items()}
+            skipped = self.load_stats.recompute(columns, max_amounts)
+            self.touch()
+        if skipped:
+            logger.warning(f"{skipped} logged transmissions do not belong to the load stats DB, and were skipped.")
+        return len(columns['Location']) - skipped
+
+    ### Reading:
+    def current_state_rows(self) -> List[Dict[str, str]]:
+        """ Returns the current state as DB rows."""
+        with self.lock:
+            return [{key: str(value) for key, value in d.items()} for d in self.current_state.values()]
+
+    def load_stats_rows(self) -> List[Dict[str, str]]:
+        """ Returns the load stats as DB rows, with the 
+            averages rounded as in the DB."""
+        with self.lock:
+            rows = self.load_stats.rows()
+        return [format_stats_row(d) for d in rows]
+
+    def history(self, location: str, start: datetime, end: datetime, resolution: int, logger: logging.Logger) -> List[Dict]:
+        """ Returns the occupancy of a location from start to 
+            end in buckets of {resolution} minutes, from the 
+            sparse index of the transmission log (see 
+            history.py). Raises ValueError if the query is 
+            invalid, and OSError if the log cannot be read."""
+        return self.history_index.query(location, start, end, resolution, logger)
+
+    ### Snapshots:
+    def snapshot(self, logger: logging.Logger) -> bool:
+        """ Atomically writes the state to the snapshot file 
+            and the CSV DBs if it has changed since the last
+            snapshot, rotating the log first if it is due. 
+            Returns True if a snapshot was written."""
+        with self.lock:
+            # Until the new snapshot is written, the last one
+            # still replays from the rotated segment:
+            segment = self.log.rotate(logger) if self.log.should_rotate() else None
+            changed = self.version != self.snapshot_version
+            if changed:
+                version = self.version
+                number, offset = self.log.position()
+                current_state = [dict(d) for d in self.current_state.values()]
+                stats = self.load_stats.rows()
+        # Synced out of the lock, which the rotation held only to
+        # rename the active file and open a new one:
+        if segment is not None:
+            self.log.sync_segment(segment, logger)
+        written = False
+        if changed:
+            try:
+                write_atomic(self.snapshot_file, json.dumps({   'log_segment': number,
+                                                                'log_offset': offset, 
+                                                                'current_state': current_state,
+                                                                'load_stats': stats}))
+                write_csv_atomic(self.current_state_db, current_state, CURRENT_STATE_FIELDS)
+                write_csv_atomic(self.stats_db, [format_stats_row(d) for d in stats], LOAD_STATS_FIELDS)
+                self.snapshot_version = version
+                written = True
+            except IOError:
+                logger.error(f"An I/O error has occurred when writing a snapshot to {self.snapshot_file}.")
+        if segment is not None:
+            # Index the segment, and again once it is compressed:
+            self.history_index.refresh(logger)
+            self.log.compress(segment, logger)
+            self.history_index.refresh(logger)
+        return written
+
+    def start_snapshots(self, logger: logging.Logger, interval: float=SNAPSHOT_INTERVAL) -> None:
+        """ Starts a daemon thread that snapshots the state 
+            every {interval} seconds."""
+        def snapshot_loop():
+            while not self.stop_event.wait(interval):
+                self.snapshot(logger)
+        Thread(target=snapshot_loop, daemon=True).start()
+
+    def close(self, logger: logging.Logger, snapshot: bool=True) -> None:
+        """ Stops the snapshot thread, writes a last snapshot
+            (unless told not to) and closes the log."""
+        self.stop_event.set()
+        if snapshot:
+            self.snapshot(logger)
+        self.log.close()
+
+class SQLiteStore:
+    """ Keeps the transmission log, the current state and the
+        load stats in a SQLite DB in WAL mode. Every 
+        transmission is committed in a single transaction with
+        indexed updates, and readers on other threads render 
+        the page from their own connections while a writer 
+        commits. Has the same interface as StateStore."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transmissions (
+            id INTEGER PRIMARY KEY,
+            sn INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            weekday TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            entrances INTEGER NOT NULL,
+            exits INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transmissions_timestamp 
+            ON transmissions (timestamp);
+        CREATE INDEX IF NOT EXISTS transmissions_location_timestamp 
+            ON transmissions (location, timestamp);
+        CREATE TABLE IF NOT EXISTS current_state (
+            location TEXT PRIMARY KEY,
+            current_amount INTEGER NOT NULL,
+            max_amount INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS load_stats (
+            location TEXT NOT NULL,
+            weekday TEXT NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            average REAL NOT NULL,
+            occurences INTEGER NOT NULL,
+            decayed_average REAL NOT NULL,
+            decayed_weight REAL NOT NULL,
+            last_update INTEGER NOT NULL,
+            PRIMARY KEY (location, weekday, start_minute)
+        );
         """
+
+    def __init__(self, filename: str=SQLITE_DB, current_state_db: str=CURRENT_STATE_DB, stats_db: str=LOAD_STATS_DB) -> None:
+        self.filename = filename
+        self.current_state_db = current_state_db
+        self.stats_db = stats_db
+        self.lock = DB_LOCK
+        self.local = local()
+        self.grid = make_load_stats() # Finds the time slots of transmissions.
+        self.version = 0
+        self.modified = time()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Returns the calling thread's connection to the DB."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def touch(self) -> None:
+        """ Marks the state as changed."""
+        self.version += 1
+        self.modified = time()
+
+    ### Loading:
+    def load(self, logger: logging.Logger) -> None:
+        """ Creates the schema if needed, and imports the CSV
+            DBs of the current state and the load stats if the
+            DB is still empty. Recomputes the load stats from
+            the logged transmissions if they do not match the
+            time slots."""
+        with self.lock:
+            conn = self.connection()
+            unmatched = self.upgrade_schema(conn)
+            conn.executescript(self.SCHEMA)
+            if conn.execute("SELECT COUNT(*) FROM current_state").fetchone()[0] == 0:
+                self.import_csv(logger, self.current_state_db)
+            if conn.execute("SELECT COUNT(*) FROM load_stats").fetchone()[0] == 0:
+                unmatched += self.import_csv(logger, stats_db=self.stats_db)
+            if unmatched or set(conn.execute("SELECT DISTINCT start_minute, end_minute FROM load_stats")) != set(SLOTS):
+                # E.g. {SLOT_MINUTES} has changed:
+                logger.warning("The load stats do not match the locations, weekdays and time slots, recomputing them from the log.")
+                self.recompute_stats(logger)
+            self.touch()
+        logger.info(f"The SQLite DB {self.filename} was loaded.")
+
+    def upgrade_schema(self, conn: sqlite3.Connection) -> int:
+        """ Replaces a load stats table of hour slots (from 
+            before the slots were configurable) with one of
+            minute slots. Returns how many of its rows do not 
+            match the time slots."""
+        if "start_hour" not in [column[1] for column in conn.execute("PRAGMA table_info(load_stats)")]:
+            return 0
+        rows = [dict(zip(LOAD_STATS_FIELDS, (location, weekday, f"{start_hour}:00", f"{end_hour}:00", average, occurences)))
+                for location, weekday, start_hour, end_hour, average, occurences in 
+                conn.execute("SELECT location, weekday, start_hour, end_hour, average, occurences FROM load_stats")]
+        with conn:
+            conn.execute("DROP TABLE load_stats")
+        conn.executescript(self.SCHEMA)
+        with conn:
+            return self.replace_stats(conn, rows)
+
+    def import_csv(self, logger: logging.Logger, current_state_db: str=None, stats_db: str=None, log_db: str=None) -> int:
+        """ Imports CSV DBs into the SQLite DB in one 
+            transaction. The current state and the load stats
+            replace the existing rows, the transmission log is
+            appended. Returns how many load stats rows do not
+            match the time slots."""
+        unmatched = 0
+        with self.lock, self.connection() as conn:
+            conn.executescript(self.SCHEMA)
+            if current_state_db:
+                conn.execute("DELETE FROM current_state")
+                conn.executemany(   "INSERT INTO current_state VALUES (?, ?, ?)",
+                                    [(d['Location'], int(d['Current Amount']), int(d['Max Amount'])) 
+                                        for d in read_csv(current_state_db, logger)])
+            if stats_db:
+                unmatched = self.replace_stats(conn, read_csv(stats_db, logger))
+            if log_db:
+                conn.executemany(   "INSERT INTO transmissions (sn, location, weekday, date, time, entrances, exits, timestamp) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [transmission_row(dict(zip(TRANSMISSION_FIELDS, row))) 
+                                        for row in TransmissionLog(log_db, TRANSMISSION_FIELDS).read()])
+            self.touch()
+        return unmatched
+
+    def replace_stats(self, conn: sqlite3.Connection, load_stats_dicts: List[Dict]) -> int:
+        """ Replaces the load stats with the given DB rows. 
+            Returns how many rows do not match the time 
+            slots."""
+        load_stats = make_load_stats()
+        unmatched = load_stats.set_rows(load_stats_dicts)
+        self.write_stats(conn, load_stats)
+        return unmatched
+
+    def write_stats(self, conn: sqlite3.Connection, load_stats: LoadStats) -> None:
+        """ Replaces the load stats with those of a LoadStats."""
+        conn.execute("DELETE FROM load_stats")
+        conn.executemany("INSERT INTO load_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", load_stats.cells())
+
+    ### Updating:
+    def record(self, transmission: Dict, logger: logging.Logger) -> None:
+        """ Logs a transmission and applies it to the state in 
+            a single transaction."""
+        with self.lock, self.connection() as conn:
+            conn.execute(   "INSERT INTO transmissions (sn, location, weekday, date, time, entrances, exits, timestamp) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
+                            transmission_row(transmission))
+            self.apply(transmission, logger, conn)
+
+    def record_many(self, transmissions: List[Dict], logger: logging.Logger) -> None:
+        """ Logs transmissions and applies them to the state, in
+            order, in a single transaction."""
+        with self.lock, self.connection() as conn:
+            conn.executemany(   "INSERT INTO transmissions (sn, location, weekday, date, time, entrances, exits, timestamp) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
+                                [transmission_row(transmission) for transmission in transmissions])
+            for transmission in transmissions:
+                self.apply(transmission, logger, conn)
+
+    def apply(self, transmission: Dict, logger: logging.Logger, conn: sqlite3.Connection=None) -> bool:
+        """ Updates the current state and the load stats 
+            according to a transmission. Returns True if the 
+            state has changed."""
+        with self.lock:
+            if conn is None:
+                with self.connection() as conn:
+                    return self.apply(transmission, logger, conn)
+
+            # Update current state data:
+            amount = int(transmission['Entrances']) - int(transmission['Exits'])
+            row = conn.execute( "SELECT current_amount, max_amount FROM current_state WHERE location = ?", 
+                                (transmission['Location'],)).fetchone()
+            if row is None:
+                logger.error(f"Current state DB could not be updated according to sensor {transmission['S.N.']}'s data, because the location name {transmission['Location']} could not be found in {self.filename}.")
+                return False
+            if amount != row[0]:
+                conn.execute(   "UPDATE current_state SET current_amount = ? WHERE location = ?",
+                                (amount, transmission['Location']))
+                EVENTS.publish(room_event(transmission['Location'], amount, row[1]))
+            self.touch()
+
+            # Update load stats, found by their primary key:
+            load = amount / row[1] * 100
+            cell = self.grid.cell(transmission['Location'], transmission['Weekday'], transmission['Time'])
+            key = cell and (transmission['Location'], transmission['Weekday'], self.grid.slots[cell[2]][0])
+            stats = cell and conn.execute(  "SELECT average, occurences, decayed_average, decayed_weight, last_update FROM load_stats "
+                                            "WHERE location = ? AND weekday = ? AND start_minute = ?", key).fetchone()
+            if not stats:
+                logger.error(f"The transmission of sensor {transmission['S.N.']} does not belong to the load stats DB.")
+                return True
+            average, n, decayed, weight, last = stats
+            decayed, weight, last = decay(  decayed * weight, weight, last, load, 
+                                            clock(transmission['Date'], transmission['Time']), self.grid.half_life)
+            conn.execute(   "UPDATE load_stats SET average = ?, occurences = ?, decayed_average = ?, decayed_weight = ?, last_update = ? "
+                            "WHERE location = ? AND weekday = ? AND start_minute = ?",
+                            ((average * n + load) / (n + 1), n + 1, decayed / weight, weight, last) + key)
+            return True
+
+    def recompute_stats(self, logger: logging.Logger) -> int:
+        """ Replaces the load stats with those recomputed from 
+            all of the logged transmissions in one transaction. 
+            Returns how many transmissions were counted."""
+        with self.lock, self.connection() as conn:
+            columns = log_columns(conn.execute( "SELECT sn, location, weekday, date, time, entrances, exits "
+                                                "FROM transmissions ORDER BY id"))
+            load_stats = make_load_stats()
+            skipped = load_stats.recompute(columns, dict(conn.execute("SELECT location, max_amount FROM current_state")))
+            self.write_stats(conn, load_stats)
+            self.touch()
+        if skipped:
+            logger.warning(f"{skipped} logged transmissions do not belong to the load stats DB, and were skipped.")
+        return len(columns['Location']) - skipped
+
+    ### Reading:
+    def current_state_rows(self) -> List[Dict[str, str]]:
+        """ Returns the current state as DB rows."""
+        return [{   'Location': location, 
+                    'Current Amount': str(current_amount), 
+                    'Max Amount': str(max_amount)}
+                for location, current_amount, max_amount in 
+                self.connection().execute("SELECT location, current_amount, max_amount FROM current_state ORDER BY rowid")]
+
+    def load_stats_rows(self) -> List[Dict[str, str]]:
+        """ Returns the load stats as DB rows, with the 
+            averages rounded as in the CSV DB."""
+        return [format_stats_row({  'Location': location,
+                                    'Weekday': weekday,
+                                    'Start Time': slot_time(start_minute),
+                                    'End Time': slot_time(end_minute),
+                                    'Average': average,
+                                    'No. of Occurences': occurences,
+                                    'Decayed Average': decayed_average,
+                                    'Decayed Weight': decayed_weight,
+                                    'Last Update': format_clock(last_update)})
+                for location, weekday, start_minute, end_minute, average, occurences, decayed_average, decayed_weight, last_update in 
+                self.connection().execute("SELECT * FROM load_stats ORDER BY rowid")]
+
+    def history(self, location: str, start: datetime, end: datetime, resolution: int, logger: logging.Logger) -> List[Dict]:
+        """ Returns the occupancy of a location from start to 
+            end in buckets of {resolution} minutes, by a range
+            scan of the (location, timestamp) index. Raises 
+            ValueError if the query is invalid."""
+        begin, finish = query_range(start, end, resolution)
+        # An hour of slack on either side, in case of a DST shift
+        # between the local clocks and the timestamps:
+        rows = self.connection().execute(   "SELECT date, time, entrances - exits FROM transmissions "
+                                            "WHERE location = ? AND timestamp >= ? AND timestamp < ?",
+                                            (location, int(start.timestamp()) - 3600, int(end.timestamp()) + 3600))
+        return bucket_rows(aggregate_samples(((clock(date, time), amount) for date, time, amount in rows), begin, finish, resolution))
+
+    ### Snapshots (every commit is durable, nothing to write behind):
+    def snapshot(self, logger: logging.Logger) -> bool:
+        return False
+
+    def start_snapshots(self, logger: logging.Logger, interval: float=SNAPSHOT_INTERVAL) -> None:
+        pass
+
+    def close(self, logger: logging.Logger, snapshot: bool=True) -> None:
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+def transmission_row(transmission: Dict) -> Tuple:
+    """ Returns a transmission as a row of the SQLite 
+        transmissions table."""
+    return (int(transmission['S.N.']), transmission['Location'], transmission['Weekday'],
+            transmission['Date'], transmission['Time'], int(transmission['Entrances']), 
+            int(transmission['Exits']), transmission_timestamp(transmission))
+
+def read_log_columns(log: TransmissionLog, logger: logging.Logger) -> Dict[str, Tuple]:
+    """ Recieves the transmission log and returns the columns
+        of all of its segments."""
+    # The rows hold no reference cycles, so the garbage collector
+    # is paused instead of scanning millions of new rows:
+    collecting = gc.isenabled()
+    gc.disable()
     try:
-        with open(filename, 'a', newline='') as db:
-            writer = csv.DictWriter(db, fieldnames=fields)
-            writer.writerow(data_dict)
+        return log_columns(list(log.read()))
     except IOError:
-        logger.error(f"An I/O error has occurred when writing to {filename}.")
+        logger.error(f"An I/O error has occurred when reading {log.filename}.")
+        return log_columns([])
+    finally:
+        if collecting:
+            gc.enable()
+
+def make_store(backend: str=STORAGE_BACKEND):
+    """ Recieves a storage backend name and returns the 
+        matching state store."""
+    if backend == "csv":
+        return StateStore()
+    elif backend == "sqlite":
+        return SQLiteStore()
+    raise ValueError(f"Unknown storage backend {backend}.")
+
+def format_average(average: float) -> str:
+    """ Formats a load average the way it is stored in the 
+        load stats DB."""
+    return f"{round(average, 2):g}"
 
-def update_current_state(data_dict: Dict, logger: logging.Logger, filename: str=CURRENT_STATE_DB) -> None:
-    ''' Recieves a dictionary dataset sent from a sensor,
-        the server's logger, then updates the current status 
-        in the file.
-        Writes to the logger if an error has occurred.'''
-    
-    # Read current state DB:
-    current_state_dicts = []
+def format_stats_row(d: Dict) -> Dict[str, str]:
+    """ Formats a load stats row (of LoadStats.rows) the way it
+        is stored in the load stats DB."""
+    return dict(d, **{  'Average': format_average(d['Average']),
+                        'No. of Occurences': str(d['No. of Occurences']),
+                        'Decayed Average': format_average(d['Decayed Average']),
+                        'Decayed Weight': f"{d['Decayed Weight']:.6g}"})
+
+def make_load_stats() -> LoadStats:
+    """ Returns empty load stats of every location, weekday and
+        time slot."""
+    return LoadStats(LOCATION_LIST, WEEKDAYS, SLOTS, DECAY_HALF_LIFE * DAY_MINUTES)
+
+def read_csv(filename: str, logger: logging.Logger) -> List[Dict[str, str]]:
+    """ Recieves the filename of a csv file and returns its 
+        rows as dictionaries.
+        Writes to the logger if an error has occurred."""
     try:
         with open(filename, 'r', newline='') as db:
-            reader = csv.DictReader(db)
-            for d in reader: current_state_dicts.append(d)
+            return list(csv.DictReader(db))
     except IOError:
-        logger.error(f"An I/O error has occurred when writing to {filename}.")
-    
-    # Update the current state according to the new data:
-    found = False
-    for location_dict in current_state_dicts:
-        if location_dict['Location'] == data_dict['Location']:
-            location_dict['Current Amount'] = str(int(data_dict['Entrances']) - int(data_dict['Exits']))
-            found = True
-            break
-
-    # Rewrite the DB if the new location was found:
-    if found:
-        create_csv(filename, CURRENT_STATE_FIELDS, logger)
-        for d in current_state_dicts:
-            insert_to_csv(filename, d, CURRENT_STATE_FIELDS, logger)
-    else:
-        logger.error(f"Current state DB could not be updated according to sensor {data_dict['S.N.']}'s data, because the location name {data_dict['Location']} could not be found in {filename}.")
-
-def update_load_stats(transmission: Dict, logger: logging.Logger, stats: str=LOAD_STATS_DB, current_state: str=CURRENT_STATE_DB) -> None:
-    """ Recieves the sensor's transmission, the server's 
-        logger, the load stats DB filename and the current
-        state DB filename and updates the load average of the
-        location and corresponding time interval mentioned in
-        the transmission.
-    """
-    # Find current state of transmission's location:
-    try:
-        with open(current_state, 'r', newline='') as current_state_db:
-            reader = csv.DictReader(current_state_db)
-            for d in reader:
-                if d['Location'] == transmission['Location']:
-                    current_state_dict = d
-
-        if current_state_dict is None:
-            logger.error(f"The current state values of the location {transmission['Location']} was not found.")
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {current_state}.")
+        logger.error(f"An I/O error has occurred when reading {filename}.")
+        return []
 
-    # Read the load stats DB:
-    load_stats_dicts = []
-    try:
-        with open(stats, 'r', newline='') as db:
-            reader = csv.DictReader(db)
-            for d in reader: load_stats_dicts.append(d)
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {stats}.")
-
-    # Search for the right dictionary in load stats DB:
-    found = False
-    for stat_dict in load_stats_dicts: 
-                # Search for a row with the same location and weekday, and a matching time interval:
-                if  stat_dict['Location'] == transmission['Location'] and \
-                    stat_dict['Weekday'] == transmission['Weekday'] and \
-                    int(stat_dict['Start Time'].split(':')[0]) <= int(transmission['Time'].split(':')[0]) and \
-                    int(stat_dict['End Time'].split(':')[0]) > int(transmission['Time'].split(':')[0]):
-                        
-                        average, n = float(stat_dict['Average']), int(stat_dict['No. of Occurences'])
-                        cur_amount, total_amount = int(current_state_dict['Current Amount']), int(current_state_dict['Max Amount'])
-                        # print(f"Current percentage = {(cur_amount / total_amount) * 100} %")
-                        stat_dict['Average'] = str(round((average * n) / (n + 1) + (cur_amount / total_amount) * 100 / (n + 1), 2))
-                        stat_dict['No. of Occurences'] = str(n + 1)
-                        # print(f"Old average: {average}, new average: {stat_dict['Average']}, occurences: {stat_dict['No. of Occurences']}")
-                        found = True
-                        break
-
-    # Rewrite load stats DB:
-    if found:
-        create_csv(stats, LOAD_STATS_FIELDS, logger)
-        for d in load_stats_dicts:
-            insert_to_csv(stats, d, LOAD_STATS_FIELDS, logger)
-
-    # Else write an error in the logger:
-    else:
-        logger.error(f"The transmission of sensor {transmission['S.N.']} does not belong to the load stats DB.")
+def write_atomic(filename: str, data: str) -> None:
+    """ Writes data to a file by writing a temporary file and
+        renaming it over the original, so readers and crashes
+        never see a partially written file."""
+    temp = filename + '.tmp'
+    with open(temp, 'w', newline='') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+def write_csv_atomic(filename: str, rows: List[Dict], fields: List[str]) -> None:
+    """ Atomically replaces a csv file with the given rows."""
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
+    write_atomic(filename, buffer.getvalue())
+
+logger = logging.getLogger()
+EVENTS = EventHub()
+EVENT_STREAMER = EventStreamer(EVENTS)
+ASSETS = AssetStore()
+STORE = make_store(STORAGE_BACKEND)
+PAGE_CACHE = PageCache()
 
 if __name__ == '__main__':
     # Logger setup:
@@ -532,35 +1604,33 @@ if __name__ == '__main__':
     logger.info("Server has started running.")
 
     # DBs setup:
-    create_csv(TRANSMISSION_LOG_DB, TRANSMISSION_FIELDS, logger)
+    create_dbs(logger, RESET_LOAD_STATS)
+    logger.info("DBs are ready.")
 
-    if RESET_LOAD_STATS:
-        create_csv(LOAD_STATS_DB, LOAD_STATS_FIELDS, logger)
-        try:
-            with open(LOAD_STATS_DB, 'a') as f:
-                for location in LOCATION_LIST:
-                    for day in WEEKDAYS:
-                        for hour in range(8, 20, 2):
-                            f.write(f"{location},{day},{str(hour)}:00,{str(hour+2)}:00,0,0\n")
-        except IOError:
-            logger.error(f"An I/O error has occurred when writing to {LOAD_STATS_DB}.")
+    # Load and precompress the static assets:
+    ASSETS.load(logger)
 
-    create_csv(CURRENT_STATE_DB, CURRENT_STATE_FIELDS, logger)
-    try:
-        with open(CURRENT_STATE_DB, 'a') as f:
-            for line in CURRENT_STATE_DEFAULTS:
-                f.write(line + '\n')
-    except IOError:
-        logger.error(f"An I/O error has occurred when writing to {CURRENT_STATE_DB}.")
-    
-    logger.info("DBs were created and set to default.")
+    # Recover the state and start writing it behind:
+    STORE.load(logger)
+    if RESET_LOAD_STATS and STORAGE_BACKEND == "sqlite":
+        STORE.import_csv(logger, stats_db=LOAD_STATS_DB)
+    STORE.start_snapshots(logger)
 
     # HTTP handling:
-    server = HTTPServer((HOST, PORT), hujilib_http)
-    try:
-        server.serve_forever()
-        logger.info("The server has started running.")
-    except KeyboardInterrupt:
-        logger.warning("The server has catched a keyboard interrupt.")
-    server.server_close()
+    if SERVER_ENGINE == "async":
+        logger.info("Serving with the asyncio engine.")
+        try:
+            asyncio.run(serve_async(HOST, PORT))
+        except KeyboardInterrupt:
+            logger.warning("The server has catched a keyboard interrupt.")
+    else:
+        server = make_server(CONCURRENCY_MODE)
+        logger.info(f"Serving in {CONCURRENCY_MODE} mode.")
+        try:
+            server.serve_forever()
+            logger.info("The server has started running.")
+        except KeyboardInterrupt:
+            logger.warning("The server has catched a keyboard interrupt.")
+        server.server_close()
+    STORE.close(logger)
     logger.info("The server has finished running.")
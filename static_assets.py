@@ -0,0 +1,264 @@
+# Static asset pipeline of the HUJI-Lib server. Loads the css,
+# js and image files once, precompresses the text ones and
+# serves them with strong ETags, caching headers, Accept-
+# Encoding negotiation, Range requests and sendfile.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from os.path import exists, getmtime, getsize, join, splitext
+from threading import Lock
+from typing import Dict, List, Tuple
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIRS = ["css", "js", "assets"]
+DERIVED_DIR = "assets/derived" # Built by build_assets.py.
+DERIVED_MANIFEST = DERIVED_DIR + "/manifest.json"
+CONTENT_TYPES = {   ".css": "text/css",
+                    ".js": "application/javascript",
+                    ".jpg": "image/jpg",
+                    ".jpeg": "image/jpeg",
+                    ".png": "image/png",
+                    ".webp": "image/webp",
+                    ".avif": "image/avif",
+                    ".svg": "image/svg+xml",
+                    ".ico": "image/x-icon",
+                }
+COMPRESSIBLE_TYPES = ["text/css", "application/javascript", "image/svg+xml"]
+MIN_COMPRESS_SIZE = 1024 # In bytes
+SENDFILE_SIZE = 256 * 1024  # Files from this size (in bytes) are
+                            # sent from disk with sendfile
+                            # instead of being held in memory.
+MAX_AGE = 3600 # In seconds, revalidated with the ETag after.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600 # In seconds, for URLs with a
+                                    # matching ?v= fingerprint.
+
+class FileBody:
+    """ A response body that is sent straight from a file with
+        sendfile, instead of being read into memory."""
+
+    def __init__(self, path: str, offset: int, length: int) -> None:
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def send(self, sock) -> None:
+        """ Sends the body through a blocking socket."""
+        with open(self.path, 'rb') as f:
+            sock.sendfile(f, self.offset, self.length)
+
+class Asset:
+    """ A static file and its precompressed variants."""
+
+    def __init__(self, path: str, content_type: str, digest: str, size: int, mtime: float) -> None:
+        self.path = path
+        self.content_type = content_type
+        self.digest = digest
+        self.size = size
+        self.mtime = mtime
+        self.variants = {} # {Content encoding: Body}, "identity" is absent for sendfile assets.
+
+    def etag(self, encoding: str) -> str:
+        """ Returns the strong ETag of one of the asset's
+            encodings."""
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+class AssetStore:
+    """ Holds the static files of the given directories, loaded
+        and precompressed once. Only loaded files are served, so
+        request paths can never leave the directories."""
+
+    def __init__(self, dirs: List[str]=STATIC_DIRS) -> None:
+        self.dirs = dirs
+        self.assets = {} # {Path: Asset}
+        self.derived = {} # {Source path: [{'path', 'width', 'type'}]}
+        self.loaded = False
+        self.lock = Lock()
+
+    def load(self, logger: logging.Logger) -> None:
+        """ Loads and precompresses every file in the asset
+            directories.
+            Writes to the logger if an error has occurred."""
+        assets = {}
+        for directory in self.dirs:
+            for root, _, files in os.walk(directory):
+                for name in sorted(files):
+                    path = join(root, name).replace(os.sep, '/')
+                    content_type = CONTENT_TYPES.get(splitext(name)[1].lower())
+                    if content_type is None:
+                        continue
+                    try:
+                        assets[path] = load_asset(path, content_type)
+                    except IOError:
+                        logger.error(f"An I/O error has occurred when opening {path}.")
+        # Read the manifest of the built image variants:
+        derived = {}
+        if exists(DERIVED_MANIFEST):
+            try:
+                with open(DERIVED_MANIFEST, 'r') as f:
+                    derived = json.load(f)
+            except (IOError, ValueError):
+                logger.error(f"An I/O error has occurred when opening {DERIVED_MANIFEST}.")
+        with self.lock:
+            self.assets = assets
+            self.derived = derived
+            self.loaded = True
+        logger.info(f"{len(assets)} static assets were loaded.")
+
+    def get(self, path: str, logger: logging.Logger) -> Asset:
+        """ Returns the asset of a path (relative to the server's
+            directory), or None if there is none."""
+        if not self.loaded:
+            self.load(logger)
+        return self.assets.get(path)
+
+    def url(self, path: str) -> str:
+        """ Returns a fingerprinted URL of an asset, which may be
+            cached by browsers for good."""
+        asset = self.get(path, logging.getLogger())
+        return f"{path}?v={asset.digest}" if asset else path
+
+    def srcset(self, path: str, content_type: str) -> str:
+        """ Returns the srcset of the built variants of an image
+            in the given content type, or an empty string if 
+            there are none."""
+        self.get(path, logging.getLogger())
+        return ", ".join(   f"{self.url(variant['path'])} {variant['width']}w" 
+                            for variant in self.derived.get(path, []) 
+                            if variant['type'] == content_type and variant['path'] in self.assets)
+
+    def respond(self, path: str, query: Dict[str, List[str]], headers, logger: logging.Logger) -> Tuple[int, Dict[str, str], bytes]:
+        """ Recieves an asset's path, the parsed query and the
+            request headers, and returns the response as a
+            (status, headers, body) tuple, or None if there is no
+            such asset. The body is bytes or a FileBody."""
+        asset = self.get(path, logger)
+        if asset is None:
+            return None
+
+        # A fingerprinted URL of the current version never changes:
+        if query.get('v', [None])[0] == asset.digest:
+            cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            cache_control = f"public, max-age={MAX_AGE}"
+
+        # Ranges are only served from the identity encoding:
+        range_header = headers.get('Range')
+        if range_header is not None and headers.get('If-Range') not in (None, asset.etag("identity")):
+            range_header = None
+        encoding = "identity" if range_header else negotiate_encoding(headers.get('Accept-Encoding', ''), asset.variants)
+        reply_headers = {   'Content-Type': asset.content_type,
+                            'Cache-Control': cache_control,
+                            'ETag': asset.etag(encoding),
+                            'Accept-Ranges': 'bytes'}
+        if len(asset.variants) > 1:
+            reply_headers['Vary'] = 'Accept-Encoding'
+        if encoding != "identity":
+            reply_headers['Content-Encoding'] = encoding
+
+        # The client's copy is still valid:
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match is not None and \
+            (if_none_match.strip() == '*' or reply_headers['ETag'] in [tag.strip() for tag in if_none_match.split(',')]):
+            return 304, reply_headers, b''
+
+        # Send a part of the file:
+        if range_header:
+            byte_range = parse_range(range_header, asset.size)
+            if byte_range is None:
+                reply_headers['Content-Range'] = f"bytes */{asset.size}"
+                return 416, reply_headers, b''
+            start, end = byte_range
+            reply_headers['Content-Range'] = f"bytes {start}-{end}/{asset.size}"
+            return 206, reply_headers, asset_body(asset, encoding, start, end + 1 - start)
+
+        return 200, reply_headers, asset_body(asset, encoding, 0, asset.size)
+
+def load_asset(path: str, content_type: str) -> Asset:
+    """ Reads an asset and prepares its variants: small files
+        are held in memory, big ones are left on disk for
+        sendfile, and text files are gzip (and brotli, if
+        available) compressed."""
+    size, mtime = getsize(path), getmtime(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        data = f.read() if size < SENDFILE_SIZE or content_type in COMPRESSIBLE_TYPES else None
+        if data is None:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        else:
+            digest.update(data)
+    asset = Asset(path, content_type, digest.hexdigest()[:16], size, mtime)
+    if data is not None:
+        asset.variants["identity"] = data
+    if content_type in COMPRESSIBLE_TYPES and size >= MIN_COMPRESS_SIZE:
+        asset.variants["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            asset.variants["br"] = brotli.compress(data, quality=11)
+    return asset
+
+def asset_body(asset: Asset, encoding: str, offset: int, length: int):
+    """ Returns a part of an asset's encoded body, as bytes if
+        it is in memory or as a FileBody."""
+    if encoding != "identity":
+        return asset.variants[encoding]
+    data = asset.variants.get("identity")
+    if data is None:
+        return FileBody(asset.path, offset, length)
+    return data[offset:offset + length]
+
+def negotiate_encoding(accept_encoding: str, variants: Dict[str, bytes]) -> str:
+    """ Recieves an Accept-Encoding header and the available
+        variants, and returns the best encoding to send: the
+        client's most preferred (by q-value) precompressed
+        variant, brotli before gzip on ties, else identity."""
+    preferences = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        preferences[name.strip().lower()] = q
+    best, best_q = "identity", 0.0
+    for encoding in ["br", "gzip"]:
+        q = preferences.get(encoding, preferences.get('*', 0.0))
+        if encoding in variants and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def parse_range(range_header: str, size: int) -> Tuple[int, int]:
+    """ Recieves a Range header and the size of the file, and
+        returns the requested (first byte, last byte) of a
+        single range, or None if it cannot be satisfied.
+        Multiple ranges are served as the whole file."""
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return (0, size - 1) if size else None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first == '': # A suffix range, e.g. bytes=-500.
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
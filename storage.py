@@ -0,0 +1,34 @@
+# The server's storage settings, which its offline tools (e.g.
+# export_history.py) import without starting the server: the DBs'
+# filenames, the storage backend and the transmission log's
+# fields, and the helpers of the log's rows.
+
+from datetime import datetime
+from typing import Dict, Tuple
+
+CURRENT_STATE_DB = 'current_state.csv'
+TRANSMISSION_LOG_DB = 'transmission_log.csv'
+LOAD_STATS_DB = "load_stats.csv"
+STATE_SNAPSHOT = "state_snapshot.json"
+SQLITE_DB = "hujilib.db"
+STORAGE_BACKEND = "csv"     # "csv" - in-memory state with CSV 
+                            # snapshots, "sqlite" - {SQLITE_DB}.
+TRANSMISSION_FIELDS = [ "S.N.",
+                        "Location",
+                        "Weekday",
+                        "Date",
+                        "Time",
+                        "Entrances",
+                        "Exits",
+                    ]
+
+def transmission_timestamp(transmission: Dict) -> int:
+    """ Returns the epoch timestamp (local time) of a 
+        transmission's date and time."""
+    return int(datetime.strptime(f"{transmission['Date']} {transmission['Time']}", "%d/%m/%Y %H:%M").timestamp())
+
+def log_columns(rows) -> Dict[str, Tuple]:
+    """ Recieves transmission log rows (as sequences of the 
+        log's fields) and returns the log's columns."""
+    columns = list(zip(*rows)) or [()] * len(TRANSMISSION_FIELDS)
+    return dict(zip(TRANSMISSION_FIELDS, columns))
@@ -0,0 +1,306 @@
+# The server's transmission log: an append-only CSV file that is
+# rotated, by size and by day, into numbered gzip compressed
+# segments next to it, e.g. transmission_log.csv is followed by
+# transmission_log.000001.csv.gz, transmission_log.000002.csv.gz,
+# ... Nothing is ever truncated.
+#
+# The active file is kept open with a buffered handle. Appends
+# are made durable by group commit: a writer waiting for its rows
+# to reach the disk either fsyncs every row written so far, or
+# waits for the fsync that is already running to cover it, so
+# one fsync serves every concurrent writer.
+#
+# A position in the log is (segment number, offset in the
+# segment's uncompressed text). The active file's number follows
+# the last segment's.
+#
+# A segment is compressed in blocks of {BLOCK_ROWS} lines, each
+# block a gzip member of its own: the segment is still a valid
+# gzip file, and any block can be decompressed alone from its
+# offset in the segment, e.g. by a sparse index of the blocks.
+
+import csv
+import gzip
+import logging
+import os
+import re
+import zlib
+from datetime import date
+from os.path import basename, dirname, exists, getsize, join, splitext
+from threading import Condition
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SEGMENT_SIZE = 64 * 1024 * 1024 # In bytes.
+COMPRESS_LEVEL = 6
+BLOCK_ROWS = 4096 # Lines per compressed block.
+READ_SIZE = 64 * 1024
+ENCODING = "utf-8" # Of the log, whatever the locale.
+
+class TransmissionLog:
+    """ The transmission log of {filename}, and its rotated
+        segments, with rows of the given fields."""
+
+    def __init__(self, filename: str, fields: List[str], segment_size: int=SEGMENT_SIZE, fsync: bool=True) -> None:
+        self.filename = filename
+        self.fields = fields
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.stem, self.suffix = splitext(basename(filename))
+        self.directory = dirname(filename) or '.'
+        self.segment_pattern = re.compile(re.escape(self.stem) + r"\.(\d{6})" + re.escape(self.suffix) + r"(\.gz)?$")
+        self.cond = Condition()
+        self.file = None
+        self.writer = None
+        self.number = 1     # The active file's segment number.
+        self.day = None     # The day of the active file's last write.
+        self.written = 0    # Appends so far.
+        self.synced = 0     # Appends on disk.
+        self.syncing = False
+        self.rotated = 0    # Appends to the last rotated segment.
+
+    ### Segments:
+    def segments(self) -> List[Tuple[int, str]]:
+        """ Returns the (number, path) of the rotated segments, in
+            time order. A segment that was left both compressed
+            and not (by a crash while compressing) is given
+            compressed."""
+        segments = {}
+        for name in os.listdir(self.directory):
+            match = self.segment_pattern.match(name)
+            if match is not None and (match.group(2) or int(match.group(1)) not in segments):
+                segments[int(match.group(1))] = join(self.directory, name)
+        return sorted(segments.items())
+
+    def segment_path(self, number: int) -> str:
+        return join(self.directory, f"{self.stem}.{number:06d}{self.suffix}")
+
+    def compress(self, path: str, logger: logging.Logger) -> None:
+        """ Replaces a rotated segment with its gzip compressed
+            copy, a gzip member per block of lines."""
+        temp = path + ".gz.tmp"
+        try:
+            with open(path, 'rb') as source, open(temp, 'wb') as target:
+                while True:
+                    lines = [line for _, line in zip(range(BLOCK_ROWS), source)]
+                    if not lines:
+                        break
+                    target.write(gzip.compress(b"".join(lines), compresslevel=COMPRESS_LEVEL, mtime=0))
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp, path + ".gz")
+            os.remove(path)
+        except OSError:
+            logger.error(f"An I/O error has occurred when compressing {path}.")
+
+    ### Writing:
+    def open(self, logger: logging.Logger) -> None:
+        """ Opens the active file for appending, with a header
+            if it is new, and compresses segments that a crash
+            left uncompressed."""
+        for number, path in self.segments():
+            if not path.endswith(".gz"):
+                self.compress(path, logger)
+        self.open_active()
+
+    def open_active(self) -> None:
+        segments = self.segments()
+        self.number = segments[-1][0] + 1 if segments else 1
+        new = not exists(self.filename) or getsize(self.filename) == 0
+        self.day = None if new else date.fromtimestamp(os.stat(self.filename).st_mtime)
+        self.file = open(self.filename, 'a', newline='', encoding=ENCODING)
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(self.fields)
+
+    def append(self, rows: List[Dict], logger: logging.Logger) -> int:
+        """ Writes rows (dictionaries of the fields) to the
+            buffer of the active file. Returns a ticket for
+            commit()."""
+        with self.cond:
+            try:
+                self.writer.writerows([[row[field] for field in self.fields] for row in rows])
+            except IOError:
+                logger.error(f"An I/O error has occurred when writing to {self.filename}.")
+            self.day = date.today()
+            self.written += 1
+            return self.written
+
+    def commit(self, ticket: int, logger: logging.Logger) -> None:
+        """ Returns once the append of the ticket is on disk."""
+        if not self.fsync:
+            return
+        with self.cond:
+            while self.synced < ticket:
+                if self.syncing: # Its fsync may cover this ticket.
+                    self.cond.wait()
+                    continue
+                # Lead a group commit of every append so far:
+                self.syncing = True
+                target = self.written
+                try:
+                    self.file.flush()
+                    fd = self.file.fileno()
+                    self.cond.release()
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        self.cond.acquire()
+                    self.synced = max(self.synced, target)
+                except OSError:
+                    logger.error(f"An I/O error has occurred when syncing {self.filename}.")
+                    self.synced = max(self.synced, target) # Do not retry forever.
+                finally:
+                    self.syncing = False
+                    self.cond.notify_all()
+
+    def position(self) -> Tuple[int, int]:
+        """ Returns the position after the last append."""
+        with self.cond:
+            self.file.flush()
+            return self.number, self.file.tell()
+
+    def should_rotate(self) -> bool:
+        """ Returns True if the active file has reached the
+            segment size, or was last written on an earlier
+            day."""
+        with self.cond:
+            return self.file.tell() >= self.segment_size or \
+                self.day is not None and self.day != date.today()
+
+    def rotate(self, logger: logging.Logger) -> str:
+        """ Renames the active file to the next segment and opens
+            a new active file. Returns the segment's path, to be
+            synced by sync_segment() and then compressed. Until
+            it is synced, commits wait for it rather than fsync
+            the new active file."""
+        with self.cond:
+            while self.syncing:
+                self.cond.wait()
+            self.syncing = True # Until sync_segment().
+            try:
+                self.file.close()
+                path = self.segment_path(self.number)
+                os.replace(self.filename, path)
+                self.open_active()
+            except OSError:
+                self.syncing = False
+                self.cond.notify_all()
+                raise
+            self.rotated = self.written
+        logger.info(f"{self.filename} was rotated to {path}.")
+        return path
+
+    def sync_segment(self, path: str, logger: logging.Logger) -> None:
+        """ Syncs the segment that rotate() returned to disk, 
+            which commits the appends to it."""
+        if self.fsync:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                logger.error(f"An I/O error has occurred when syncing {path}.")
+        with self.cond:
+            self.synced = max(self.synced, self.rotated)
+            self.syncing = False
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        with self.cond:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+    ### Reading:
+    def read(self, position: Tuple[int, int]=(0, 0)) -> Iterator[List[str]]:
+        """ Yields the rows (lists of the fields' strings) logged
+            after a position, through every segment and the
+            active file in time order. Header rows and torn rows
+            are skipped."""
+        if self.file is not None:
+            with self.cond:
+                self.file.flush()
+        start, offset = position
+        active = self.number if self.file is not None else (self.segments() or [(0, None)])[-1][0] + 1
+        for number, path in self.segments() + [(active, self.filename)]:
+            if number < start or not exists(path):
+                continue
+            with (gzip.open(path, 'rt', newline='', encoding=ENCODING) if path.endswith(".gz") else open(path, 'r', newline='', encoding=ENCODING)) as f:
+                if number == start:
+                    f.seek(offset)
+                for row in csv.reader(f):
+                    if len(row) == len(self.fields) and row[0] != self.fields[0]:
+                        yield row
+
+    def blocks(self, path: str, offset: int=0, end: Optional[int]=None) -> Iterator[Tuple[int, int, int, List[List[str]]]]:
+        """ Yields the blocks of a segment, or of the active file
+            from an offset up to an end offset, as (offset, end
+            offset, lines, rows). Offsets are in the file, which
+            is the compressed file for a segment. The active
+            file's blocks are of {BLOCK_ROWS} lines, but for the
+            last one, and a line that is still being written ends
+            them."""
+        if path.endswith(".gz"):
+            # Fed in bounded chunks, a member's unused data is at 
+            # most the rest of its last chunk:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                member, chunks, start, data = zlib.decompressobj(wbits=31), [], offset, b""
+                while True:
+                    if not data:
+                        data = f.read(READ_SIZE)
+                        if not data:
+                            break
+                    chunks.append(member.decompress(data))
+                    if not member.eof:
+                        offset += len(data)
+                        data = b""
+                        continue
+                    offset += len(data) - len(member.unused_data)
+                    data = member.unused_data
+                    lines = b"".join(chunks).splitlines(keepends=True)
+                    yield start, offset, len(lines), self.parse(lines)
+                    member, chunks, start = zlib.decompressobj(wbits=31), [], offset
+            return
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            lines = []
+            start = position = offset
+            while end is None or position < end:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                lines.append(line)
+                position += len(line)
+                if len(lines) == BLOCK_ROWS:
+                    yield start, position, len(lines), self.parse(lines)
+                    lines, start = [], position
+            if lines:
+                yield start, position, len(lines), self.parse(lines)
+
+    def read_block(self, path: str, offset: int, lines: int) -> List[List[str]]:
+        """ Returns the rows of the block at an offset of a
+            segment, or of {lines} lines at an offset of the
+            active file."""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            if not path.endswith(".gz"):
+                return self.parse([f.readline() for _ in range(lines)])
+            member = zlib.decompressobj(wbits=31)
+            chunks = []
+            while not member.eof:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                chunks.append(member.decompress(chunk))
+            return self.parse(b"".join(chunks).splitlines(keepends=True))
+
+    def parse(self, lines: List[bytes]) -> List[List[str]]:
+        """ Returns the rows of lines of the log, without header
+            rows and torn rows."""
+        return [row for row in csv.reader(line.decode(ENCODING) for line in lines)
+                if len(row) == len(self.fields) and row[0] != self.fields[0]]